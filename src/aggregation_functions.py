@@ -0,0 +1,289 @@
+# aggregation_functions.py
+# This class is responsible for deriving the league table and team statistics from fixture results
+# The standings and the win/draw/loss and goals splits shown on team cards are aggregates of
+# finished fixtures, so they are kept up to date locally as each result lands instead of
+# calling the standings and team statistics endpoints for every request
+# A consistency check compares the local table against the API's, and the point adjustments it finds
+# are shared with other processes through the cache
+
+import os
+import time
+import threading
+import logging
+
+import sports_api_functions as sports_api
+import cache_functions
+
+# Where standings and team statistics come from: "local" derives them from fixture results,
+# "upstream" uses the API's standings and team statistics endpoints
+standings_source = os.environ.get("STANDINGS_SOURCE", "local")
+
+# Aggregates for each league's season, keyed by namespace
+# Each holds per-team tallies, the result each counted fixture was counted with, the fixtures response
+# they were last brought up to date with, whether every team in the league is in them, and point
+# adjustments found by the consistency check
+__aggregates = {}
+__aggregates_lock = threading.Lock()
+
+# Goals awarded to the winner of a match decided without being played (awarded or walkover)
+__awarded_score = 3
+
+# Key the point adjustments are cached under, in a namespace of their own so data changes do not invalidate them
+__adjustments_key = "point_adjustments"
+
+# How long to wait before trying to get a league's teams again after it failed, in seconds
+__teams_retry_interval = 60
+
+# Add one finished fixture's result to a season's aggregate
+# A fixture already counted with a different score (a corrected result) has its old result taken back out first.
+# Returns whether the aggregate changed
+def apply_fixture_result(aggregate, fixture):
+    fixture_id = fixture.get("fixture").get("id")
+    home_goals, away_goals = __get_fixture_score(fixture)
+    if home_goals is None or away_goals is None:
+        return False
+
+    result = (fixture.get("teams").get("home"), fixture.get("teams").get("away"), home_goals, away_goals)
+    applied = aggregate.get("applied")
+    previous_result = applied.get(fixture_id)
+    if previous_result is not None:
+        if previous_result[2:] == result[2:]:
+            return False
+        __add_result(aggregate, previous_result, -1)
+
+    __add_result(aggregate, result, 1)
+    applied[fixture_id] = result
+    return True
+
+# Take a fixture's result back out of a season's aggregate, for example when it is no longer a finished fixture
+def remove_fixture_result(aggregate, fixture_id):
+    previous_result = aggregate.get("applied").pop(fixture_id, None)
+    if previous_result is None:
+        return False
+
+    __add_result(aggregate, previous_result, -1)
+    return True
+
+# Get a season's aggregate, adding any results that have landed or been corrected since it was last updated
+# Nothing is recounted while the cached fixtures response is the one the aggregate was last brought up to date with
+def get_aggregate(league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    namespace = cache_functions.make_namespace(league_id, season)
+
+    fixtures = sports_api.get_finished_fixtures(league_id, season) or []
+    cached_adjustments = cache_functions.get_cache().get(__adjustments_namespace(namespace), __adjustments_key, allow_stale=True)
+
+    with __aggregates_lock:
+        aggregate = __aggregates.setdefault(namespace, {"teams": {}, "applied": {}, "source": None, "complete": False, "teams_checked_at": None, "point_adjustments": {}, "adjustments_source": None})
+
+        # Point adjustments found by the consistency check are shared through the cache, as it may have run in another process
+        if cached_adjustments is not None and aggregate.get("adjustments_source") is not cached_adjustments:
+            aggregate["point_adjustments"] = {int(team_id): adjustment for team_id, adjustment in cached_adjustments.items()}
+            aggregate["adjustments_source"] = cached_adjustments
+
+        teams_due = not aggregate.get("complete") and (aggregate.get("teams_checked_at") is None or time.time() - aggregate.get("teams_checked_at") >= __teams_retry_interval)
+        if aggregate.get("source") is fixtures and not teams_due:
+            return aggregate
+
+    # Every team in the league is in the table, including those that have not played yet
+    # The league's teams are only fetched again after a while if they could not be found
+    league_teams = None
+    if teams_due:
+        try:
+            league_teams = sports_api.get_league_teams(league_id, season)
+        except Exception:
+            logging.exception(f"Could not get the teams of league {league_id} season {season}")
+
+    with __aggregates_lock:
+        if teams_due:
+            aggregate["teams_checked_at"] = time.time()
+            for entry in league_teams or []:
+                aggregate.get("teams").setdefault(entry.get("team").get("id"), __new_team_tallies(entry.get("team")))
+            aggregate["complete"] = bool(league_teams)
+
+        if aggregate.get("source") is not fixtures:
+            # Only new and corrected results change the tallies
+            finished_ids = set()
+            for fixture in fixtures:
+                finished_ids.add(fixture.get("fixture").get("id"))
+                apply_fixture_result(aggregate, fixture)
+            # Results no longer listed as finished are taken back out, unless the list is empty because no response was available
+            if fixtures:
+                for fixture_id in aggregate.get("applied").keys() - finished_ids:
+                    remove_fixture_result(aggregate, fixture_id)
+            aggregate["source"] = fixtures
+        return aggregate
+
+# Get the league table derived from fixture results, in the same format as the API's standings
+# Returns an empty table if the league's teams could not be found, so the API's standings are used instead
+def get_standings(league_id = None, season = None):
+    aggregate = get_aggregate(league_id, season)
+    if not aggregate.get("complete"):
+        return []
+
+    with __aggregates_lock:
+        entries = [__build_standings_entry(team_id, tallies, aggregate.get("point_adjustments").get(team_id, 0))
+                   for team_id, tallies in aggregate.get("teams").items()]
+
+    # Rank by points, then goal difference, then goals scored
+    entries.sort(key=lambda e: (-e.get("points"), -e.get("goalsDiff"), -e.get("all").get("goals").get("for"), e.get("team").get("name")))
+    for rank, entry in enumerate(entries, start=1):
+        entry["rank"] = rank
+    return entries
+
+# Get a team's statistics derived from fixture results, in the same format as the API's team statistics
+# Returns None if the team is not in the league's season
+def get_team_statistics(team_id, league_id = None, season = None):
+    aggregate = get_aggregate(league_id, season)
+
+    with __aggregates_lock:
+        tallies = aggregate.get("teams").get(team_id)
+        if tallies is None:
+            return None
+
+        home = tallies.get("home")
+        away = tallies.get("away")
+        team_statistics = {
+            "team": {"id": team_id, "name": tallies.get("name"), "logo": tallies.get("logo")},
+            "fixtures": {
+                "played": __split_totals(home.get("played"), away.get("played")),
+                "wins": __split_totals(home.get("win"), away.get("win")),
+                "draws": __split_totals(home.get("draw"), away.get("draw")),
+                "loses": __split_totals(home.get("lose"), away.get("lose")),
+            },
+            "goals": {
+                "for": {"total": __split_totals(home.get("goals_for"), away.get("goals_for"))},
+                "against": {"total": __split_totals(home.get("goals_against"), away.get("goals_against"))},
+            },
+        }
+    return team_statistics
+
+# Compare the local table against the API's standings
+# Differences in points where the results match (for example point deductions) are kept as adjustments,
+# any other difference is logged. Returns the list of differences found
+def check_consistency(league_id = None, season = None, upstream_standings = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    if upstream_standings is None:
+        upstream_standings = sports_api.get_upstream_standings(league_id, season)
+
+    aggregate = get_aggregate(league_id, season)
+    if not aggregate.get("complete"):
+        # Without the league's teams there is no local table to compare
+        return []
+
+    local_entries = {entry.get("team").get("id"): entry for entry in get_standings(league_id, season)}
+    differences = []
+    adjusted = False
+
+    for upstream_entry in upstream_standings:
+        team_id = upstream_entry.get("team").get("id")
+        local_entry = local_entries.get(team_id)
+        if local_entry is None:
+            differences.append(f"{upstream_entry.get('team').get('name')}: missing from local standings")
+            continue
+
+        results_match = all(
+            local_entry.get(split).get(field) == upstream_entry.get(split).get(field)
+            for split in ("all", "home", "away") for field in ("played", "win", "draw", "lose"))
+        goals_match = local_entry.get("all").get("goals") == upstream_entry.get("all").get("goals")
+
+        if not results_match or not goals_match:
+            differences.append(f"{upstream_entry.get('team').get('name')}: local results {local_entry.get('all')} differ from upstream {upstream_entry.get('all')}")
+        elif local_entry.get("points") != upstream_entry.get("points"):
+            with __aggregates_lock:
+                point_adjustments = aggregate.get("point_adjustments")
+                point_adjustments[team_id] = point_adjustments.get(team_id, 0) + upstream_entry.get("points") - local_entry.get("points")
+            adjusted = True
+
+    # Processes sharing the cache, such as prefork workers, apply the same adjustments
+    if adjusted:
+        with __aggregates_lock:
+            cached_adjustments = {str(team_id): adjustment for team_id, adjustment in aggregate.get("point_adjustments").items()}
+            aggregate["adjustments_source"] = cached_adjustments
+        cache_functions.get_cache().set(__adjustments_namespace(cache_functions.make_namespace(league_id, season)), __adjustments_key, cached_adjustments)
+
+    for difference in differences:
+        logging.error(f"Standings consistency check for league {league_id} season {season}: {difference}")
+    return differences
+
+# Run the consistency check whenever the prefetcher finds new standings
+def start_consistency_checks():
+    def handle_data_change(league_id, season, standings_changed, changed_team_ids):
+        if standings_changed:
+            check_consistency(league_id, season)
+
+    sports_api.add_data_change_listener(handle_data_change)
+
+# Get a finished fixture's score. Matches awarded without being played may not have one, so the winner is given the awarded score
+def __get_fixture_score(fixture):
+    home_goals = fixture.get("goals").get("home")
+    away_goals = fixture.get("goals").get("away")
+    if home_goals is not None and away_goals is not None:
+        return home_goals, away_goals
+
+    if fixture.get("teams").get("home").get("winner"):
+        return __awarded_score, 0
+    if fixture.get("teams").get("away").get("winner"):
+        return 0, __awarded_score
+    return None, None
+
+# Add a counted result's goals and win, draw or loss to both teams' tallies, or take them back out with a sign of -1
+def __add_result(aggregate, result, sign):
+    home_team, away_team, home_goals, away_goals = result
+
+    for side, team, goals_for, goals_against in (("home", home_team, home_goals, away_goals), ("away", away_team, away_goals, home_goals)):
+        tallies = aggregate.get("teams").setdefault(team.get("id"), __new_team_tallies(team))
+
+        split = tallies.get(side)
+        split["played"] += sign
+        split["goals_for"] += sign * goals_for
+        split["goals_against"] += sign * goals_against
+        if goals_for > goals_against:
+            split["win"] += sign
+        elif goals_for == goals_against:
+            split["draw"] += sign
+        else:
+            split["lose"] += sign
+
+# Get the cache namespace a league season's point adjustments are kept in
+def __adjustments_namespace(namespace):
+    return f"standings:{namespace}"
+
+# Create empty tallies for a team
+def __new_team_tallies(team):
+    return {
+        "name": team.get("name"),
+        "logo": team.get("logo"),
+        "home": {"played": 0, "win": 0, "draw": 0, "lose": 0, "goals_for": 0, "goals_against": 0},
+        "away": {"played": 0, "win": 0, "draw": 0, "lose": 0, "goals_for": 0, "goals_against": 0},
+    }
+
+# Build home, away, and total values in the format the API uses for team statistics
+def __split_totals(home_value, away_value):
+    return {"home": home_value, "away": away_value, "total": home_value + away_value}
+
+# Build a team's standings entry in the format the API uses for standings
+def __build_standings_entry(team_id, tallies, point_adjustment):
+    home = tallies.get("home")
+    away = tallies.get("away")
+
+    def split_entry(*splits):
+        return {
+            "played": sum(s.get("played") for s in splits),
+            "win": sum(s.get("win") for s in splits),
+            "draw": sum(s.get("draw") for s in splits),
+            "lose": sum(s.get("lose") for s in splits),
+            "goals": {"for": sum(s.get("goals_for") for s in splits), "against": sum(s.get("goals_against") for s in splits)},
+        }
+
+    all_entry = split_entry(home, away)
+    standings_entry = {
+        "rank": None,
+        "team": {"id": team_id, "name": tallies.get("name"), "logo": tallies.get("logo")},
+        "points": 3 * all_entry.get("win") + all_entry.get("draw") + point_adjustment,
+        "goalsDiff": all_entry.get("goals").get("for") - all_entry.get("goals").get("against"),
+        "all": all_entry,
+        "home": split_entry(home),
+        "away": split_entry(away),
+    }
+    return standings_entry
@@ -0,0 +1,341 @@
+# analytics_functions.py
+# This class is responsible for form and head-to-head analytics
+# A season's finished fixtures are turned into NumPy columns of team IDs, goals, and dates,
+# and the form of every team is computed in one vectorized pass over those columns
+# Results are cached until results land or are corrected, so these commands never make extra API calls
+
+import json
+import threading
+import logging
+
+import numpy as np
+
+import sports_api_functions as sports_api
+import cache_functions
+
+# Number of games used for rolling form
+__form_games = 5
+
+# Computed analytics for each league's season, keyed by namespace
+# Each entry holds the fixtures response and the results it was computed from, the columns, and the team form
+__analytics = {}
+__analytics_lock = threading.Lock()
+
+# Turn a list of fixtures from the API into columns, sorted oldest to newest
+def build_fixture_columns(fixtures):
+    fixture_count = len(fixtures)
+    columns = {
+        "fixture_id": np.empty(fixture_count, dtype=np.int64),
+        "timestamp": np.empty(fixture_count, dtype=np.int64),
+        "home_id": np.empty(fixture_count, dtype=np.int32),
+        "away_id": np.empty(fixture_count, dtype=np.int32),
+        "home_goals": np.empty(fixture_count, dtype=np.int16),
+        "away_goals": np.empty(fixture_count, dtype=np.int16),
+    }
+    team_names = {}
+
+    for i, fixture in enumerate(fixtures):
+        home_team = fixture.get("teams").get("home")
+        away_team = fixture.get("teams").get("away")
+        columns["fixture_id"][i] = fixture.get("fixture").get("id")
+        columns["timestamp"][i] = fixture.get("fixture").get("timestamp")
+        columns["home_id"][i] = home_team.get("id")
+        columns["away_id"][i] = away_team.get("id")
+        columns["home_goals"][i] = fixture.get("goals").get("home") or 0
+        columns["away_goals"][i] = fixture.get("goals").get("away") or 0
+        team_names[home_team.get("id")] = home_team.get("name")
+        team_names[away_team.get("id")] = away_team.get("name")
+
+    order = np.argsort(columns["timestamp"], kind="stable")
+    for name in columns:
+        columns[name] = columns[name][order]
+    columns["team_names"] = team_names
+    return columns
+
+# Compute the form, goal difference trend, and home/away splits of every team in one pass
+# Returns a dict of team ID to that team's analytics
+def compute_team_form(columns, form_games = __form_games):
+    fixture_count = len(columns["fixture_id"])
+    if fixture_count == 0:
+        return {}
+
+    # Each fixture gives one row for the home team and one row for the away team
+    team_ids = np.concatenate((columns["home_id"], columns["away_id"]))
+    goals_for = np.concatenate((columns["home_goals"], columns["away_goals"])).astype(np.int32)
+    goals_against = np.concatenate((columns["away_goals"], columns["home_goals"])).astype(np.int32)
+    is_home = np.concatenate((np.ones(fixture_count, dtype=bool), np.zeros(fixture_count, dtype=bool)))
+    timestamps = np.concatenate((columns["timestamp"], columns["timestamp"]))
+
+    unique_team_ids, team_index = np.unique(team_ids, return_inverse=True)
+    team_count = len(unique_team_ids)
+
+    # 1 for a win, 0 for a draw, -1 for a loss
+    result = np.sign(goals_for - goals_against)
+    points = np.select([result > 0, result == 0], [3, 1], 0)
+    goal_difference = goals_for - goals_against
+
+    # Season and home/away totals for every team at once
+    def totals(mask):
+        return {
+            "played": np.bincount(team_index[mask], minlength=team_count),
+            "wins": np.bincount(team_index[mask & (result > 0)], minlength=team_count),
+            "draws": np.bincount(team_index[mask & (result == 0)], minlength=team_count),
+            "losses": np.bincount(team_index[mask & (result < 0)], minlength=team_count),
+            "goals_for": np.bincount(team_index[mask], weights=goals_for[mask], minlength=team_count).astype(np.int32),
+            "goals_against": np.bincount(team_index[mask], weights=goals_against[mask], minlength=team_count).astype(np.int32),
+        }
+
+    all_rows = np.ones(len(team_ids), dtype=bool)
+    split_totals = {"total": totals(all_rows), "home": totals(is_home), "away": totals(~is_home)}
+
+    # Sort rows by team and then by date, so each team's games are contiguous and in order
+    order = np.lexsort((timestamps, team_index))
+    sorted_team = team_index[order]
+    sorted_result = result[order]
+    sorted_points = points[order]
+    sorted_goal_difference = goal_difference[order]
+
+    # Position of each row within its team's games, counted from the start and from the end
+    played = split_totals["total"]["played"]
+    group_start = np.concatenate(([0], np.cumsum(played)[:-1]))
+    position = np.arange(len(sorted_team)) - group_start[sorted_team]
+    games_from_end = played[sorted_team] - position
+
+    # Running goal difference after each game, per team
+    running_goal_difference = np.cumsum(sorted_goal_difference)
+    group_offset = np.concatenate(([0], running_goal_difference))[group_start]
+    running_goal_difference = running_goal_difference - group_offset[sorted_team]
+
+    # Points and goal difference in the last form_games games, and in the games before those
+    recent = games_from_end <= form_games
+    previous = (games_from_end > form_games) & (games_from_end <= 2 * form_games)
+    recent_points = np.bincount(sorted_team[recent], weights=sorted_points[recent], minlength=team_count).astype(np.int32)
+    recent_goal_difference = np.bincount(sorted_team[recent], weights=sorted_goal_difference[recent], minlength=team_count).astype(np.int32)
+    previous_goal_difference = np.bincount(sorted_team[previous], weights=sorted_goal_difference[previous], minlength=team_count).astype(np.int32)
+
+    form_letters = np.array(["L", "D", "W"])[sorted_result + 1]
+
+    team_form = {}
+    for i, team_id in enumerate(unique_team_ids):
+        team_rows = slice(group_start[i], group_start[i] + played[i])
+        team_form[int(team_id)] = {
+            "team_name": columns["team_names"].get(int(team_id)),
+            "form": "".join(form_letters[team_rows][-form_games:]),
+            "recent_points": int(recent_points[i]),
+            "recent_goal_difference": int(recent_goal_difference[i]),
+            "previous_goal_difference": int(previous_goal_difference[i]),
+            "goal_difference_trend": running_goal_difference[team_rows][-2 * form_games:].tolist(),
+            "splits": {
+                split: {name: int(values[i]) for name, values in split_values.items()}
+                for split, split_values in split_totals.items()
+            },
+        }
+    return team_form
+
+# Get the results of every game played between two teams, oldest to newest
+def compute_head_to_head(columns, team_a_id, team_b_id):
+    home_id = columns["home_id"]
+    away_id = columns["away_id"]
+    mask = ((home_id == team_a_id) & (away_id == team_b_id)) | ((home_id == team_b_id) & (away_id == team_a_id))
+
+    # Goals from team A's point of view for every meeting
+    a_is_home = home_id[mask] == team_a_id
+    a_goals = np.where(a_is_home, columns["home_goals"][mask], columns["away_goals"][mask]).astype(np.int32)
+    b_goals = np.where(a_is_home, columns["away_goals"][mask], columns["home_goals"][mask]).astype(np.int32)
+
+    head_to_head = {
+        "team_a_wins": int(np.count_nonzero(a_goals > b_goals)),
+        "team_b_wins": int(np.count_nonzero(b_goals > a_goals)),
+        "draws": int(np.count_nonzero(a_goals == b_goals)),
+        "team_a_goals": int(a_goals.sum()),
+        "team_b_goals": int(b_goals.sum()),
+        "games": [
+            {
+                "timestamp": int(timestamp),
+                "home_id": int(home),
+                "away_id": int(away),
+                "home_goals": int(home_goals),
+                "away_goals": int(away_goals),
+            }
+            for timestamp, home, away, home_goals, away_goals in zip(
+                columns["timestamp"][mask], home_id[mask], away_id[mask], columns["home_goals"][mask], columns["away_goals"][mask])
+        ],
+    }
+    return head_to_head
+
+# Get the fixture columns and form of every team in a league's season
+# They are only recomputed when a result has landed or been corrected. The results are only compared
+# when the cached fixtures response is not the one they were last computed or checked against
+def get_season_analytics(league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    namespace = cache_functions.make_namespace(league_id, season)
+
+    fixtures = sports_api.get_finished_fixtures(league_id, season) or []
+
+    with __analytics_lock:
+        analytics = __analytics.get(namespace)
+        if analytics is not None and analytics.get("source") is fixtures:
+            return analytics
+
+    results = __get_results(fixtures)
+    if analytics is not None and analytics.get("results") == results:
+        with __analytics_lock:
+            analytics["source"] = fixtures
+        return analytics
+
+    columns = build_fixture_columns(fixtures)
+    analytics = {"source": fixtures, "results": results, "columns": columns, "team_form": compute_team_form(columns)}
+
+    with __analytics_lock:
+        __analytics[namespace] = analytics
+    return analytics
+
+# Show the form of the team requested by the user
+def get_form_data(client, message, team_name, league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+
+    try:
+        team_id = sports_api.get_team_id(team_name)
+        team_form = get_season_analytics(league_id, season).get("team_form").get(team_id)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get team form. Please try again later.")
+        return
+
+    if team_form is None:
+        __post_error(client, message, f"No games found for {team_name} in the {sports_api.get_league_name(league_id)} {season} season.")
+        return
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{team_name} Form",
+        blocks=json.dumps(__create_form_card_block(team_form)))
+
+# Show the head-to-head history of the two teams requested by the user
+def get_head_to_head_data(client, message, team_a_name, team_b_name, league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+
+    try:
+        team_a_id = sports_api.get_team_id(team_a_name)
+        team_b_id = sports_api.get_team_id(team_b_name)
+        if team_a_id is None or team_b_id is None:
+            __post_error(client, message, "Please ensure you have provided two valid team names.")
+            return
+
+        columns = get_season_analytics(league_id, season).get("columns")
+        head_to_head = compute_head_to_head(columns, team_a_id, team_b_id)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get head-to-head history. Please try again later.")
+        return
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{team_a_name} vs {team_b_name}",
+        blocks=json.dumps(__create_head_to_head_card_block(head_to_head, team_a_name, team_b_name, columns.get("team_names"), season)))
+
+# Create set of blocks representing a team's form
+def __create_form_card_block(team_form):
+    team_name = team_form.get("team_name")
+    total = team_form.get("splits").get("total")
+    home = team_form.get("splits").get("home")
+    away = team_form.get("splits").get("away")
+    trend = ", ".join(f"{gd:+d}" for gd in team_form.get("goal_difference_trend"))
+
+    form_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"Current Form for {team_name}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Last {len(team_form.get('form'))} Games*: {' '.join(team_form.get('form'))} | *Points*: {team_form.get('recent_points')}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Goal Difference*: {team_form.get('recent_goal_difference'):+d} in the last {__form_games} games, {team_form.get('previous_goal_difference'):+d} in the {__form_games} before | *Season Goal Difference by Game*: {trend}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Home*: {home.get('wins')}W {home.get('draws')}D {home.get('losses')}L, {home.get('goals_for')} scored, {home.get('goals_against')} allowed"
+                    + f"\n*Away*: {away.get('wins')}W {away.get('draws')}D {away.get('losses')}L, {away.get('goals_for')} scored, {away.get('goals_against')} allowed"
+                    + f"\n*Total*: {total.get('wins')}W {total.get('draws')}D {total.get('losses')}L, {total.get('goals_for')} scored, {total.get('goals_against')} allowed"
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return form_card
+
+# Create set of blocks representing the head-to-head history of two teams
+def __create_head_to_head_card_block(head_to_head, team_a_name, team_b_name, team_names, season):
+    game_lines = []
+    for game in head_to_head.get("games"):
+        game_lines.append(f"{team_names.get(game.get('away_id'))} {game.get('away_goals')} - {game.get('home_goals')} {team_names.get(game.get('home_id'))}")
+
+    head_to_head_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{team_a_name} vs {team_b_name} in {season}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{team_a_name} Wins*: {head_to_head.get('team_a_wins')} | *Draws*: {head_to_head.get('draws')} | *{team_b_name} Wins*: {head_to_head.get('team_b_wins')}"
+                    + f"\n*Goals*: {team_a_name} {head_to_head.get('team_a_goals')} - {head_to_head.get('team_b_goals')} {team_b_name}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "\n".join(game_lines) or "These teams have not played each other this season."
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return head_to_head_card
+
+# Get the result of every fixture, which the analytics are computed from
+def __get_results(fixtures):
+    return {f.get("fixture").get("id"): (f.get("fixture").get("timestamp"), f.get("teams").get("home").get("id"), f.get("teams").get("away").get("id"), f.get("goals").get("home"), f.get("goals").get("away")) for f in fixtures}
+
+# Let the user know their analytics command could not be completed
+def __post_error(client, message, error_text):
+    client.chat_postMessage(
+        channel=message["channel"],
+        text="Error Getting Data",
+        blocks=[{
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": error_text,
+                "emoji": False
+            }
+        }])
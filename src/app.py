@@ -1,6 +1,9 @@
 import os
 import re
+import json
+import logging
 import string
+import threading
 
 # Use the package we installed
 from slack_bolt import App, Say, BoltContext
@@ -9,6 +12,22 @@ from slack_sdk import WebClient
 # Import function to connect to football data api
 import sports_api_functions as sports_api
 import dynamo_functions as db
+import notification_functions as notifications
+import slack_queue_functions as slack_queue
+import home_tab_functions as home_tab
+import player_functions as players
+import analytics_functions as analytics
+import aggregation_functions as aggregation
+import socket_mode_functions as socket_mode
+import digest_functions as digest
+import profiling_functions as profiling
+import snapshot_functions as snapshots
+import status_functions as status
+import circuit_breaker_functions as breakers
+import scoreboard_functions as scoreboards
+import prefork_functions as prefork
+import history_functions as history
+import scheduler_functions as scheduler
 
 # Define format for accepted commands
 __help_command = re.compile("(help|Help|HELP)")
@@ -19,13 +38,80 @@ __next_games_command = "nextgames"
 __fav_team_set_command = "faveset"
 __fav_team_get_command = "faveget"
 __fav_team_delete_command = "favedel"
+__subscribe_command = re.compile("^subscribe")
+__unsubscribe_command = "unsubscribe"
+__player_command = "player"
+__form_command = re.compile("^form")
+__head_to_head_command = "h2h"
+__digest_command = re.compile("^digest")
+__profile_command = re.compile("^profile")
+__live_command = re.compile("^live")
+__history_command = re.compile("^history")
+
+# Define format for the page buttons on standings and game lists, e.g. "standings_page_next"
+__standings_page_action = re.compile("^standings_page_")
+__past_games_page_action = re.compile("^pastgames_page_")
+__next_games_page_action = re.compile("^nextgames_page_")
+
+# Slack user IDs allowed to use admin commands, separated by commas
+__admin_user_ids = set(user_id.strip() for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip())
+
+# Define format for separating the two teams in a head-to-head command, e.g. "h2h Arsenal vs Chelsea"
+__head_to_head_separator = re.compile(r"\s+(?:vs\.?|v)\s+|\s*,\s*", re.IGNORECASE)
+
+# Define format for options that pick the league and season, e.g. "standings league:laliga season:2022"
+__league_option = re.compile(r"\bleague:(\S*)", re.IGNORECASE)
+__season_option = re.compile(r"\bseason:(\S*)", re.IGNORECASE)
+__season_year = re.compile(r"^\d{4}$")
+
+# Define format for a season given at the end of a history command, e.g. "history Arsenal 2019"
+__trailing_season = re.compile(r"\s+(\d{4})$")
+
+# Runs the bot's listeners in the scheduler's worker threads, ahead of background work
+__listener_executor = scheduler.get_executor(scheduler.INTERACTIVE)
 
 # Initializes app with bot token and signing secret
+# SLACK_API_URL can point the Web API client at a local stand-in for testing
+# Messages and Home views are sent through circuit breakers, so a Slack outage fails fast
 app = App(
-    token=os.environ.get("SLACK_BOT_TOKEN"),
-    signing_secret=os.environ.get("SLACK_SIGNING_SECRET")
+    client=breakers.BreakerWebClient(token=os.environ.get("SLACK_BOT_TOKEN"), base_url=os.environ.get("SLACK_API_URL", WebClient.BASE_URL)),
+    signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
+    listener_executor=__listener_executor
 )
 
+# Classify every request from Slack, over HTTP or Socket Mode, so its listeners are queued in the scheduler
+# as App Home or interactive work for the user it is from
+@app.middleware
+def classify_request(body, next):
+    scheduler.set_request_context(*scheduler.classify_request(body))
+    next()
+
+# Get the team name, league ID, and season from a command message
+# The league and season are None when the message does not set them
+# Raises ValueError if the league is not recognized or the season is not a year
+def __parse_command(msg, command):
+    start_index = msg.find(command) + len(command)
+    args = msg[start_index:]
+
+    league_id = None
+    league_match = __league_option.search(args)
+    if league_match:
+        league_id = sports_api.get_league_id(league_match.group(1))
+        if league_id is None:
+            raise ValueError(f"Unknown league *{league_match.group(1)}*. Available leagues: {', '.join(sports_api.leagues)}.")
+        args = __league_option.sub("", args)
+
+    season = None
+    season_match = __season_option.search(args)
+    if season_match:
+        if not __season_year.match(season_match.group(1)):
+            raise ValueError(f"Invalid season *{season_match.group(1)}*. Seasons are given by the year they start in, e.g. season:2022.")
+        season = int(season_match.group(1))
+        args = __season_option.sub("", args)
+
+    team_name = string.capwords(args.strip())
+    return team_name, league_id, season
+
 # Handle team join event to let the user know how to see available commands
 @app.event("team_join")
 def handle_team_join(messagesay):
@@ -43,15 +129,27 @@ def show_help(message, say):
     user = message['user']
     say(f"Hi <@{user}>!"
     + "\n\nHere are the currently available commands:" 
-    + "\n*standings*: Get current English Premier League (EPL) standings."
+    + "\n*standings*: Get current English Premier League (EPL) standings, one page at a time."
     + "\n*team [team_name]*: Get the current EPL standings for the specified team."
-    + "\n*pastgames*: Get details of the past 3 EPL games."
+    + "\n*pastgames*: Get details of the past 3 EPL games. Use the buttons to see older games."
     + "\n*pastgames [team_name]*: Get details of the past 3 games the specified team has played."
-    + "\n*nextgames*: Get details of the next 3 EPL games."
+    + "\n*nextgames*: Get details of the next 3 EPL games. Use the buttons to see later games."
     + "\n*nextgames [team_name]*: Get details of the next 3 games the specified team is scheduled to play."
-    + "\n*faveset [team name]*: Set (or change) your favorite EPL team. Favorite team is used to personalize the home tab."
+    + "\n*faveset [team name]*: Set (or change) your favorite EPL team. Favorite team is used to personalize the home tab. Add *league:* to set a team from another league."
     + "\n*faveget*: See your currently set favorite EPL team."
     + "\n*favedel*: Delete your currently set favorite EPL team."
+    + "\n*subscribe [team_name]*: Get kickoff, goal, and full time notifications for the specified team in this conversation. Uses your favorite team if no team is given."
+    + "\n*unsubscribe*: Stop match notifications in this conversation."
+    + "\n*live [team_name]*: Post a scoreboard of the specified team's live game, or of every live game, that updates as the score changes."
+    + "\n*form [team_name]*: Get the specified team's recent form, goal difference trend, and home and away record."
+    + "\n*h2h [team_name] vs [team_name]*: Get the head-to-head record of two teams this season."
+    + "\n*history [team_name] [season]*: Get the specified team's finish in every archived season, or its record in one season. Without a team, get the all-time table and records."
+    + "\n*digest on*: Get a preview of each EPL round, with the previous round's results and table movement, in this channel."
+    + "\n*digest off*: Stop round previews in this channel."
+    + "\n*player [player_name]*: Get the current season's stats for the specified player."
+    + "\n*player top*: Get the top scorers in the EPL."
+    + "\n*player squad [team_name]*: Get the players in the specified team's squad."
+    + f"\n\n_Leagues and seasons_: Add *league:[league]* and/or *season:[year]* to the standings, team, pastgames, and nextgames commands to see another league or season, e.g. *standings league:laliga season:2022*. Available leagues: {', '.join(sports_api.leagues)}. Seasons are named by the year they start in."
     + "\n\n_Note_: When the bot recognizes a command, it will acknowledge it with a 👍 reaction to let you know the bot is working on it.")
 
 # For all long running commands, the bot responds to recognized commands with a thumbs up reaction
@@ -66,7 +164,12 @@ def league_standings(client, message, say, body: dict, context: BoltContext):
         timestamp=message_ts,
         name="thumbsup",
       )
-    sports_api.get_standings_data_all(client, message)
+
+    try:
+        _, league_id, season = __parse_command(message['text'], "")
+        sports_api.get_standings_data_all(client, message, league_id=league_id, season=season)
+    except ValueError as e:
+        say(str(e))
 
 # Team command. Gets current team stats for specified team
 @app.message(__team_command)
@@ -80,15 +183,15 @@ def team_lookup(client, message, say, body: dict, context: BoltContext):
 
     try:
         # Get team name from message
-        msg = message['text']
-        start_index = msg.find(__team_command) + len(__team_command)
-        team_name = string.capwords(msg[start_index:].strip())
+        team_name, league_id, season = __parse_command(message['text'], __team_command)
 
         # Get data from API
-        sports_api.get_team_stats_data(client, message, team_name)
-        sports_api.get_past_games_data(client, message, team_name)
+        sports_api.get_team_stats_data(client, message, team_name, league_id=league_id, season=season)
+        sports_api.get_past_games_data(client, message, team_name, league_id=league_id, season=season)
     except IndexError:
-        say("Please ensure you have provided a valid EPL team name.")
+        say("Please ensure you have provided a valid team name.")
+    except ValueError as e:
+        say(str(e))
 
 # Past games command. Gets past 3 games for a team or generally for the EPL
 @app.message(__past_games_command)
@@ -102,14 +205,14 @@ def past_game(client, message, say, body: dict, context: BoltContext):
 
     try:
         # Get team name from message
-        msg = message['text']
-        start_index = msg.find(__past_games_command) + len(__past_games_command)
-        team_name = string.capwords(msg[start_index:].strip())
+        team_name, league_id, season = __parse_command(message['text'], __past_games_command)
 
         # Get data from API
-        sports_api.get_past_games_data(client, message, team_name)
+        sports_api.get_past_games_data(client, message, team_name, league_id=league_id, season=season)
     except IndexError:
-        say("Please ensure you have provided a valid EPL team name.")
+        say("Please ensure you have provided a valid team name.")
+    except ValueError as e:
+        say(str(e))
 
 # Next games command. Gets next 3 games for a team or generally for the EPL
 @app.message(__next_games_command)
@@ -123,14 +226,139 @@ def next_game(client, message, say, body: dict, context: BoltContext):
 
     try:
         # Get team name from message
-        msg = message['text']
-        start_index = msg.find(__next_games_command) + len(__next_games_command)
-        team_name = string.capwords(msg[start_index:].strip())
+        team_name, league_id, season = __parse_command(message['text'], __next_games_command)
 
         # Get data from API
-        sports_api.get_next_game_data(client, message, team_name)
+        sports_api.get_next_game_data(client, message, team_name, league_id=league_id, season=season)
     except IndexError:
-        say("Please ensure you have provided a valid EPL team name.")
+        say("Please ensure you have provided a valid team name.")
+    except ValueError as e:
+        say(str(e))
+
+# Page buttons. Each button holds the arguments for its page, which is rendered from cached data
+# and replaces the current page in the same message
+@app.action(__standings_page_action)
+def standings_page(ack, body, client):
+    ack()
+    page_args = json.loads(body["actions"][0]["value"])
+    sports_api.get_standings_data_all(client, {"channel": body["channel"]["id"]}, league_id=page_args.get("league_id"),
+                                      season=page_args.get("season"), page=page_args.get("page"), update_ts=body["message"]["ts"])
+
+@app.action(__past_games_page_action)
+def past_games_page(ack, body, client):
+    ack()
+    page_args = json.loads(body["actions"][0]["value"])
+    sports_api.get_past_games_data(client, {"channel": body["channel"]["id"]}, page_args.get("team_name"), league_id=page_args.get("league_id"),
+                                   season=page_args.get("season"), page=page_args.get("page"), update_ts=body["message"]["ts"])
+
+@app.action(__next_games_page_action)
+def next_games_page(ack, body, client):
+    ack()
+    page_args = json.loads(body["actions"][0]["value"])
+    sports_api.get_next_game_data(client, {"channel": body["channel"]["id"]}, page_args.get("team_name"), league_id=page_args.get("league_id"),
+                                  season=page_args.get("season"), page=page_args.get("page"), update_ts=body["message"]["ts"])
+
+# Player command. Gets a player's stats, the top scorers, or a team's squad from the player store
+@app.message(__player_command)
+def player_lookup(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+        channel=context.channel_id,
+        timestamp=message_ts,
+        name="thumbsup",
+      )
+
+    try:
+        # Get the sub-command or player name from message
+        player_args, league_id, season = __parse_command(message['text'], __player_command)
+    except ValueError as e:
+        say(str(e))
+        return
+
+    if player_args.lower() == "top":
+        players.get_top_scorers_data(client, message, league_id, season)
+    elif player_args.lower().startswith("squad"):
+        team_name = player_args[len("squad"):].strip()
+        players.get_squad_data(client, message, team_name, league_id, season)
+    elif player_args:
+        players.get_player_data(client, message, player_args, league_id, season)
+    else:
+        say("Please provide a player name, *top*, or *squad [team_name]*.")
+
+# Form command. Gets a team's form, computed locally from the season's results
+@app.message(__form_command)
+def team_form(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+        channel=context.channel_id,
+        timestamp=message_ts,
+        name="thumbsup",
+      )
+
+    try:
+        team_name, league_id, season = __parse_command(message['text'], "form")
+    except ValueError as e:
+        say(str(e))
+        return
+
+    if not team_name:
+        say("Please provide a team name.")
+        return
+
+    analytics.get_form_data(client, message, team_name, league_id, season)
+
+# History command. Gets a team's history or the all-time records from the archive of past seasons
+@app.message(__history_command)
+def team_history(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+        channel=context.channel_id,
+        timestamp=message_ts,
+        name="thumbsup",
+      )
+
+    try:
+        team_name, league_id, season = __parse_command(message['text'], "history")
+    except ValueError as e:
+        say(str(e))
+        return
+
+    # The season can also be given on its own after the team name
+    season_match = __trailing_season.search(team_name)
+    if season_match and season is None:
+        season = int(season_match.group(1))
+        team_name = team_name[:season_match.start()].strip()
+
+    if team_name:
+        history.get_team_history_data(client, message, team_name, league_id, season)
+    else:
+        history.get_all_time_records_data(client, message, league_id)
+
+# Head-to-head command. Gets the record between two teams, computed locally from the season's results
+@app.message(__head_to_head_command)
+def head_to_head(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+        channel=context.channel_id,
+        timestamp=message_ts,
+        name="thumbsup",
+      )
+
+    try:
+        teams_text, league_id, season = __parse_command(message['text'], __head_to_head_command)
+    except ValueError as e:
+        say(str(e))
+        return
+
+    # Teams are separated by "vs" or a comma. Two single-word team names can also be given on their own
+    team_names = __head_to_head_separator.split(teams_text)
+    if len(team_names) == 1:
+        team_names = teams_text.split()
+    if len(team_names) != 2:
+        say("Please provide two team names, e.g. *h2h Arsenal vs Chelsea*.")
+        return
+
+    analytics.get_head_to_head_data(client, message, string.capwords(team_names[0]), string.capwords(team_names[1]), league_id, season)
 
 # Set the user's favorite team in DynamoDB
 @app.message(__fav_team_set_command)
@@ -142,19 +370,22 @@ def set_favorite_team(client, message, say, body: dict, context: BoltContext):
       name="thumbsup",
     )
 
-    # Extract the team name from the message
-    msg = message['text']
-    start_index = msg.find(__fav_team_set_command) + len(__fav_team_set_command)
-    team_name = string.capwords(msg[start_index:].strip())
+    # Extract the team name and league from the message
+    try:
+      team_name, league_id, _ = __parse_command(message['text'], __fav_team_set_command)
+    except ValueError as e:
+      say(str(e))
+      return
 
     # Get user ID and call dynamo to create/update the entry
     user_id = message['user']
-    res = db.set_favorite_team(user_id, team_name)
+    res = db.set_favorite_team(user_id, team_name, league_id)
 
     if res:
+      home_tab.refresh_favorite_team(user_id)
       say(f"Your favorite team has been set to {team_name}")
     else:
-      say("Unable to set favorite team. Please ensure you have provided a valid EPL team name or try again later.")
+      say("Unable to set favorite team. Please ensure you have provided a valid team name or try again later.")
 
 # Get the user's favorite team from DynamoDB
 @app.message(__fav_team_get_command)
@@ -191,12 +422,144 @@ def remove_favorite_team(client, message, say, body: dict, context: BoltContext)
     res = db.remove_favorite_team(user_id)
 
     if res == 200:
+      home_tab.refresh_favorite_team(user_id)
       say("Your favorite team has been removed.")
     elif res == 404:
       say(f"You currently do not have a favorite team set. Use *{__fav_team_set_command}* to set it.")
     else:
       say("Unable to remove favorite team. Please try again later.")
 
+# Subscribe the conversation to match notifications for a team
+@app.message(__subscribe_command)
+def subscribe_team(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+      channel=context.channel_id,
+      timestamp=message_ts,
+      name="thumbsup",
+    )
+
+    # Extract the team name from the message
+    msg = message['text']
+    start_index = msg.find("subscribe") + len("subscribe")
+    team_name = string.capwords(msg[start_index:].strip())
+
+    # Fall back to the user's favorite team if no team was provided
+    if not team_name:
+      result = db.get_favorite_team(message['user'])
+      if result is None:
+        say(f"Please provide a team name, or use *{__fav_team_set_command}* to set a favorite team first.")
+        return
+      team_name = result.get("team_name")
+
+    # Notifications are sent to the conversation the command was sent in
+    res = db.set_subscription(message['channel'], team_name)
+
+    if res:
+      say(f"This conversation will now get match notifications for {team_name}.")
+    else:
+      say("Unable to subscribe. Please ensure you have provided a valid team name or try again later.")
+
+# Live command. Posts a scoreboard that is edited in place as the live games on it change
+@app.message(__live_command)
+def live_scoreboard(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+      channel=context.channel_id,
+      timestamp=message_ts,
+      name="thumbsup",
+    )
+
+    try:
+      team_name, league_id, _ = __parse_command(message['text'], "live")
+      if not scoreboards.post_scoreboard(client, message['channel'], team_name, league_id):
+        say(f"{team_name} are not playing right now." if team_name else "There are no live games right now.")
+    except IndexError:
+      say("Please ensure you have provided a valid team name.")
+    except ValueError as e:
+      say(str(e))
+
+# Remove the conversation's match notifications subscription
+@app.message(__unsubscribe_command)
+def unsubscribe_team(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+      channel=context.channel_id,
+      timestamp=message_ts,
+      name="thumbsup",
+    )
+
+    res = db.remove_subscription(message['channel'])
+
+    if res == 200:
+      say("This conversation will no longer get match notifications.")
+    elif res == 404:
+      say("This conversation is not subscribed to match notifications.")
+    else:
+      say("Unable to unsubscribe. Please try again later.")
+
+# Opt the channel in or out of the round preview and results digest
+@app.message(__digest_command)
+def digest_subscription(client, message, say, body: dict, context: BoltContext):
+    message_ts = body["event"]["ts"]
+    api_response = client.reactions_add(
+      channel=context.channel_id,
+      timestamp=message_ts,
+      name="thumbsup",
+    )
+
+    try:
+      setting, league_id, _ = __parse_command(message['text'], "digest")
+    except ValueError as e:
+      say(str(e))
+      return
+
+    league_id = league_id or sports_api.get_league_id(None)
+    league_name = sports_api.get_league_name(league_id)
+
+    if setting.lower() == "on":
+      if db.set_digest_channel(message['channel'], league_id):
+        say(f"This channel will now get a preview of each {league_name} round.")
+      else:
+        say("Unable to turn on round previews. Please try again later.")
+    elif setting.lower() == "off":
+      res = db.remove_digest_channel(message['channel'])
+      if res == 200:
+        say("This channel will no longer get round previews.")
+      elif res == 404:
+        say("This channel is not getting round previews.")
+      else:
+        say("Unable to turn off round previews. Please try again later.")
+    else:
+      say("Please use *digest on* or *digest off*.")
+
+# Admin command. Profiles the running bot for a number of seconds and sends back the results
+# Not listed in help, and only available to the users in ADMIN_USER_IDS
+@app.message(__profile_command)
+def profile_bot(client, message, say, body: dict, context: BoltContext):
+    if message['user'] not in __admin_user_ids:
+      say("Sorry, this command is only available to bot admins.")
+      return
+
+    # Get the profiling window from the message
+    msg = message['text']
+    duration_text = msg[len("profile"):].strip()
+    duration = int(duration_text) if duration_text.isdigit() else 30
+    channel = message['channel']
+
+    # Post the summary and upload the flamegraph and allocation files when the window ends
+    def send_profile(summary, file_paths):
+      client.chat_postMessage(channel=channel, text=summary)
+      for file_path in file_paths:
+        try:
+          client.files_upload_v2(channel=channel, file=file_path, title=os.path.basename(file_path))
+        except Exception as e:
+          client.chat_postMessage(channel=channel, text=f"Unable to upload {file_path}: {e}")
+
+    if profiling.start_profiling(duration, send_profile):
+      say(f"Profiling for {min(max(duration, 1), profiling.max_duration)} seconds. Results will be posted here when it finishes.")
+    else:
+      say("A profile is already running. Please wait for it to finish.")
 
 # Handle App Home event. Updates App Home with top 3 teams and next 3 EPL games
 @app.event("app_home_opened")
@@ -204,13 +567,9 @@ def update_home_tab(client, event, logger):
   try:
     client.views_publish(
       user_id=event["user"],
-      view={
-        "type": "home",
-        "callback_id": "home_view",
 
-        # Get blocks to display as app home
-        "blocks": sports_api.get_app_home_data(client, event)
-      }
+      # Get the view to display as app home. The user is remembered so their view is republished when the data changes
+      view=home_tab.render_home_tab(event["user"])
     )
   except Exception as e:
     logger.error(f"Error publishing home tab: {e}")
@@ -221,6 +580,83 @@ def global_error_handler(error, body, logger):
     logger.exception(error)
     logger.info(body)
 
+    # Let the user know when a dependency is failing fast instead of leaving their command unanswered
+    channel = (body.get("event") or {}).get("channel")
+    if isinstance(error, breakers.CircuitOpenError) and channel and not error.name.startswith("slack:"):
+        try:
+            app.client.chat_postMessage(channel=channel, text="This is temporarily unavailable. Please try again in a few minutes.")
+        except Exception as e:
+            logger.error(f"Unable to send unavailable message: {e}")
+
 # Start your app
+# Start the jobs that keep the cached data fresh and push events, in the process that calls the football API
+def __start_refresh_jobs():
+    # Warm the cache from the last snapshot, and keep checkpointing it for the next restart
+    snapshots.load_snapshot()
+    snapshots.start_snapshots()
+
+    # Report readiness once the cache can serve every active league from memory
+    status.start_status_server()
+
+    # Keep the cached league data fresh in the background
+    sports_api.start_prefetcher()
+
+    # Push match events to subscribers from a single shared poll of the live fixtures
+    slack_queue.start_slack_queue(app.client)
+    notifications.start_live_poller()
+
+    # Post each round's preview to the channels that opted in
+    digest.start_digest_scheduler()
+
+    # Compare the standings derived from fixture results against the API's whenever they change
+    aggregation.start_consistency_checks()
+
+    # Load the active leagues' players in the background, so player commands are answered from memory
+    players.start_player_preloader()
+
+# Start the jobs that update what was sent to Slack users, in each process that serves Slack events
+def __start_serving_jobs():
+    slack_queue.start_slack_queue(app.client)
+
+    # Edit live scoreboards in place from the shared poll of the live fixtures
+    scoreboards.start_scoreboard_updates()
+
+    # Republish recent viewers' App Home when the standings or their team's fixtures change
+    home_tab.start_home_tab_updates()
+
+# Serve Slack events until the process is stopped
+# Uses Socket Mode when an app-level token is set, otherwise serves HTTP requests
+def __serve():
+    if os.environ.get("SLACK_APP_TOKEN"):
+        # Socket Mode connections take events straight away, so only open them once the cache is warm
+        if not status.wait_until_ready(int(os.environ.get("READY_TIMEOUT_SECONDS", 60))):
+            logging.warning("Cache is not warm yet, opening Socket Mode connections anyway")
+        socket_mode.start_socket_mode(app)
+    else:
+        app.start(port=int(os.environ.get("PORT", 3000)))
+
+# Run the refresher process of a prefork deployment
+def __run_refresher():
+    __start_refresh_jobs()
+    prefork.start_snapshot_publisher()
+    threading.Event().wait()
+
+# Run a worker process of a prefork deployment
+def __run_worker():
+    prefork.start_snapshot_reader()
+    __start_serving_jobs()
+    __serve()
+
 if __name__ == "__main__":
-    app.start(port=int(os.environ.get("PORT", 3000)))
\ No newline at end of file
+    # Several worker processes can only share the load over Socket Mode, as HTTP requests come in on one port
+    prefork_workers = int(os.environ.get("PREFORK_WORKERS", 0))
+    if prefork_workers > 0 and os.environ.get("SLACK_APP_TOKEN"):
+        # The refresher and every worker send queued messages, so they split the Slack send rate
+        slack_queue.share_send_rate(prefork_workers + 1)
+        prefork.run_prefork(prefork_workers, __run_refresher, __run_worker)
+    else:
+        if prefork_workers > 0:
+            logging.warning("PREFORK_WORKERS needs SLACK_APP_TOKEN, running in a single process")
+        __start_refresh_jobs()
+        __start_serving_jobs()
+        __serve()
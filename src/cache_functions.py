@@ -0,0 +1,254 @@
+# cache_functions.py
+# This class is responsible for caching the data GET'd from the football API
+# Two backends are available: an in-process LRU cache (the default) and a Redis-protocol
+# shared cache that lets several bot processes share a single copy of the upstream data
+# Cached records are namespaced by league and season so they can be invalidated together
+
+import os
+import json
+import time
+import threading
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# The Redis client is only needed when the shared backend is selected
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Default cache settings, can be overridden through the environment
+__default_max_entries = 512
+__redis_key_prefix = "sportsbot"
+
+# Backend selected for this process, created on first use
+__cache = None
+__cache_lock = threading.Lock()
+
+# Build the namespace used to group cached records for a league and season
+def make_namespace(league_id, season):
+    return f"{league_id}:{season}"
+
+# Serialize a cached record so it can be stored outside of the process
+def serialize_record(value, expires_at):
+    return json.dumps({"expires_at": expires_at, "value": value}, separators=(",", ":"))
+
+# Deserialize a cached record, returning None if it is missing or has expired
+# Expired records are still returned when allow_stale is set
+def deserialize_record(raw, allow_stale=False):
+    if raw is None:
+        return None
+
+    record = json.loads(raw)
+    expires_at = record.get("expires_at")
+    if not allow_stale and expires_at is not None and expires_at < time.time():
+        return None
+    return record.get("value")
+
+# Interface every cache backend implements
+class CacheBackend(ABC):
+    def __init__(self):
+        self.invalidation_listeners = []
+
+    # Get a cached value, or None if it is not cached
+    # allow_stale also returns values that have expired but not been evicted yet, for when the upstream source is failing
+    @abstractmethod
+    def get(self, namespace, key, allow_stale=False):
+        pass
+
+    # Cache a value. A ttl of None keeps the value until it is evicted or invalidated
+    @abstractmethod
+    def set(self, namespace, key, value, ttl=None):
+        pass
+
+    # Drop every value cached under a namespace
+    @abstractmethod
+    def invalidate(self, namespace):
+        pass
+
+    # Try to take a named lock so that only one instance does a piece of work
+    @abstractmethod
+    def acquire_lock(self, name, ttl):
+        pass
+
+    # Get every cached value, including expired values that can still be served as stale, as a list of (namespace, key, value, expires_at)
+    @abstractmethod
+    def export_entries(self):
+        pass
+
+    # Cache values exported by export_entries, keeping their original expiry times
+    # Entries that have expired since they were exported are cached as already expired, so they are only
+    # served as stale data until they are refreshed. Returns the number of entries cached
+    def import_entries(self, entries):
+        now = time.time()
+        imported = 0
+        for namespace, key, value, expires_at in entries:
+            self.set(namespace, key, value, expires_at - now if expires_at is not None else None)
+            imported += 1
+        return imported
+
+    # Register a function called with the namespace whenever it is invalidated
+    def add_invalidation_listener(self, callback):
+        self.invalidation_listeners.append(callback)
+
+    # Let every registered listener know a namespace was invalidated
+    def notify_invalidation(self, namespace):
+        for callback in self.invalidation_listeners:
+            try:
+                callback(namespace)
+            except Exception as e:
+                logging.error(f"Cache invalidation listener failed: {e}")
+
+# In-process least recently used cache. Each bot process keeps its own copy of the data
+class LRUCacheBackend(CacheBackend):
+    def __init__(self, max_entries):
+        super().__init__()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, namespace, key, allow_stale=False):
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is None:
+                return None
+
+            # Expired entries are kept until they are evicted, so they can still be served as stale data
+            value, expires_at = entry
+            if not allow_stale and expires_at is not None and expires_at < time.time():
+                return None
+
+            # Mark the entry as recently used
+            self.entries.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        with self.lock:
+            self.entries[(namespace, key)] = (value, expires_at)
+            self.entries.move_to_end((namespace, key))
+
+            # Evict the least recently used entries once the cache is full
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, namespace):
+        with self.lock:
+            for entry_key in [k for k in self.entries if k[0] == namespace]:
+                del self.entries[entry_key]
+
+        self.notify_invalidation(namespace)
+
+    def export_entries(self):
+        with self.lock:
+            # Least recently used first, so importing the entries keeps their order
+            return [(namespace, key, value, expires_at) for (namespace, key), (value, expires_at) in self.entries.items()]
+
+    def acquire_lock(self, name, ttl):
+        now = time.time()
+
+        with self.lock:
+            if self.locks.get(name, 0) > now:
+                return False
+            self.locks[name] = now + ttl
+            return True
+
+# Shared cache that speaks the Redis protocol. Works against a Redis server or fakeredis
+# Each namespace is stored as one Redis hash so it can be invalidated with a single DEL,
+# and invalidations are published so every instance can react to refreshed data
+class RedisCacheBackend(CacheBackend):
+    def __init__(self, client, key_prefix):
+        super().__init__()
+        self.client = client
+        self.key_prefix = key_prefix
+        self.channel = f"{key_prefix}:invalidate"
+        self.listener_thread = None
+
+    def namespace_key(self, namespace):
+        return f"{self.key_prefix}:{namespace}"
+
+    def get(self, namespace, key, allow_stale=False):
+        return deserialize_record(self.client.hget(self.namespace_key(namespace), key), allow_stale)
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        namespace_key = self.namespace_key(namespace)
+
+        pipe = self.client.pipeline()
+        pipe.hset(namespace_key, key, serialize_record(value, expires_at))
+        pipe.ttl(namespace_key)
+        hash_ttl = pipe.execute()[1]
+
+        # Hash fields cannot expire on their own, so bound the lifetime of the whole hash
+        # The lifetime is only ever extended, so short-lived entries do not cut short the longer-lived
+        # entries in the same namespace. A hash without a lifetime has a TTL below 0
+        if ttl is not None and ttl > 0 and int(ttl) * 2 > hash_ttl:
+            self.client.expire(namespace_key, int(ttl) * 2)
+
+    def invalidate(self, namespace):
+        self.client.delete(self.namespace_key(namespace))
+        self.client.publish(self.channel, namespace)
+
+    def export_entries(self):
+        entries = []
+
+        # Lock keys share the prefix but are plain strings, so only namespace hashes are exported
+        for namespace_key in self.client.scan_iter(match=f"{self.key_prefix}:*", _type="hash"):
+            if isinstance(namespace_key, bytes):
+                namespace_key = namespace_key.decode()
+            namespace = namespace_key[len(self.key_prefix) + 1:]
+
+            for key, raw in self.client.hgetall(namespace_key).items():
+                record = json.loads(raw)
+                entries.append((namespace, key.decode() if isinstance(key, bytes) else key, record.get("value"), record.get("expires_at")))
+        return entries
+
+    def acquire_lock(self, name, ttl):
+        return bool(self.client.set(f"{self.key_prefix}:lock:{name}", "1", nx=True, ex=int(ttl)))
+
+    def add_invalidation_listener(self, callback):
+        super().add_invalidation_listener(callback)
+
+        # Start listening for invalidations published by any instance, including this one
+        if self.listener_thread is None:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self.handle_invalidation_message})
+            self.listener_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def handle_invalidation_message(self, message):
+        namespace = message.get("data")
+        if isinstance(namespace, bytes):
+            namespace = namespace.decode()
+        self.notify_invalidation(namespace)
+
+# Create the cache backend selected by the CACHE_BACKEND environment variable
+def create_cache(backend_name=None, redis_client=None):
+    backend_name = backend_name or os.environ.get("CACHE_BACKEND", "lru")
+
+    if backend_name == "redis":
+        if redis_client is None:
+            if redis is None:
+                raise RuntimeError("The redis package is required to use the redis cache backend")
+            redis_client = redis.Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+        return RedisCacheBackend(redis_client, os.environ.get("CACHE_KEY_PREFIX", __redis_key_prefix))
+
+    return LRUCacheBackend(int(os.environ.get("CACHE_MAX_ENTRIES", __default_max_entries)))
+
+# Get the cache used by this process
+def get_cache():
+    global __cache
+
+    with __cache_lock:
+        if __cache is None:
+            __cache = create_cache()
+        return __cache
+
+# Replace the cache used by this process, for example with one backed by fakeredis
+def set_cache(cache):
+    global __cache
+
+    with __cache_lock:
+        __cache = cache
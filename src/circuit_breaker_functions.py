@@ -0,0 +1,152 @@
+# circuit_breaker_functions.py
+# This class is responsible for protecting the bot from slow or failing dependencies
+# Each dependency call goes through a named circuit breaker. After enough consecutive failures
+# the breaker opens and calls fail fast without waiting on the dependency, so workers are not tied
+# up and the outage is not made worse. Once the reset timeout passes, a single probe call is let
+# through, and the breaker closes again if it succeeds
+
+import os
+import time
+import threading
+import logging
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+# Number of consecutive failures that open a breaker
+__failure_threshold = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+
+# Number of seconds an open breaker fails fast before letting a probe call through
+__reset_timeout = float(os.environ.get("BREAKER_RESET_SECONDS", 30))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Breakers for each dependency, keyed by name
+__breakers = {}
+__breakers_lock = threading.Lock()
+
+# Raised instead of calling a dependency whose breaker is open
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f"Circuit breaker {name} is open")
+        self.name = name
+
+# Tracks the failures of one dependency and decides whether calls to it are allowed
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.probe_in_flight = False
+        self.counts = {"calls": 0, "failures": 0, "rejections": 0, "opens": 0}
+        self.lock = threading.Lock()
+
+    # Call a function through the breaker. Raises CircuitOpenError without calling it if the breaker is open
+    # is_failure decides whether an exception counts against the dependency, e.g. so rate limiting does not
+    def call(self, func, *args, is_failure = None, **kwargs):
+        probe = self.before_call()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure(probe)
+            else:
+                self.record_success(probe)
+            raise
+
+        self.record_success(probe)
+        return result
+
+    # Check whether a call may go through, moving an open breaker to half open once its reset timeout passes
+    # Returns whether the call is the half-open probe
+    def before_call(self):
+        with self.lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+
+            # Only one probe call is let through while half open
+            if self.state == OPEN or (self.state == HALF_OPEN and self.probe_in_flight):
+                self.counts["rejections"] += 1
+                raise CircuitOpenError(self.name)
+
+            self.counts["calls"] += 1
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    # Record a call that succeeded. While the breaker is not closed only the probe's outcome counts, so a slow
+    # call that started before the breaker opened does not close it
+    def record_success(self, probe = False):
+        with self.lock:
+            if self.state != CLOSED and not probe:
+                return
+
+            if self.state != CLOSED:
+                logging.info(f"Circuit breaker {self.name} closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    # Record a call that failed. While the breaker is not closed only the probe's outcome moves it
+    def record_failure(self, probe = False):
+        with self.lock:
+            self.counts["failures"] += 1
+            if self.state != CLOSED and not probe:
+                return
+
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+
+            # A failed probe opens the breaker again straight away
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.counts["opens"] += 1
+                    logging.error(f"Circuit breaker {self.name} opened after {self.consecutive_failures} consecutive failures")
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    # Get the breaker's state and counts for metrics
+    def get_metrics(self):
+        with self.lock:
+            metrics = {"state": self.state, "consecutive_failures": self.consecutive_failures}
+            metrics.update(self.counts)
+            return metrics
+
+# Slack Web API client that sends messages and Home views through circuit breakers
+# Other methods, such as reactions, are called directly
+class BreakerWebClient(WebClient):
+    def chat_postMessage(self, **kwargs):
+        return get_breaker("slack:chat_postMessage").call(super().chat_postMessage, is_failure=is_slack_failure, **kwargs)
+
+    def views_publish(self, **kwargs):
+        return get_breaker("slack:views_publish").call(super().views_publish, is_failure=is_slack_failure, **kwargs)
+
+# Check whether a Slack error means Slack is unavailable
+# Rate limiting and errors about the request itself, such as an unknown channel, do not count against the breaker
+def is_slack_failure(e):
+    if isinstance(e, SlackApiError):
+        return e.response.status_code >= 500
+    return True
+
+# Get the breaker for a dependency, creating it on first use
+def get_breaker(name):
+    with __breakers_lock:
+        breaker = __breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, __failure_threshold, __reset_timeout)
+            __breakers[name] = breaker
+        return breaker
+
+# Get the state and counts of every breaker, keyed by name
+def get_breaker_metrics():
+    with __breakers_lock:
+        breakers = list(__breakers.values())
+    return {breaker.name: breaker.get_metrics() for breaker in breakers}
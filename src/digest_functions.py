@@ -0,0 +1,160 @@
+# digest_functions.py
+# This class is responsible for the round preview and results digest
+# Before each round of a league, the upcoming fixtures with predictions, the previous round's
+# results, and the movement in the table are rendered into blocks once, and then posted to every
+# opted-in channel through the rate-limited Slack queue
+
+import os
+import json
+import threading
+import time
+import logging
+
+import dateutil.parser
+
+import sports_api_functions as sports_api
+import dynamo_functions as db
+import slack_queue_functions as slack_queue
+import scheduler_functions as scheduler
+
+# Number of seconds between checks for a round that needs a digest
+__check_interval = int(os.environ.get("DIGEST_CHECK_INTERVAL_SECONDS", 3600))
+
+# Number of hours before a round's first kickoff that its digest is sent
+__lead_hours = int(os.environ.get("DIGEST_LEAD_HOURS", 48))
+
+# Send the digest for a league's next round if it is due and has not been sent yet
+# Returns True if the digest was sent
+def send_digest_if_due(league_id = None, season = None, now = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    now = now or time.time()
+
+    upcoming_fixtures = sports_api.get_upcoming_fixtures(league_id, season) or []
+    if not upcoming_fixtures:
+        return False
+
+    # The next round is the round of the next fixture to be played
+    next_round = upcoming_fixtures[0].get("league").get("round")
+    round_fixtures = [f for f in upcoming_fixtures if f.get("league").get("round") == next_round]
+    first_kickoff = min(f.get("fixture").get("timestamp") for f in round_fixtures)
+    if first_kickoff - now > __lead_hours * 3600:
+        return False
+
+    # Each round's digest is only rendered and sent once, across restarts and every instance
+    sent_round, previous_ranks = db.get_digest_state(league_id, season)
+    if sent_round == next_round:
+        return False
+
+    channel_ids = db.get_digest_channels(league_id)
+    if not channel_ids:
+        return False
+
+    # Render the digest once, and post the same blocks to every channel
+    # It is rendered before the round is recorded as sent, so a failure leaves it to be sent on the next check
+    league_standings = sports_api.get_league_standings(league_id, season)
+    blocks = build_digest_blocks(league_id, season, next_round, round_fixtures, league_standings, previous_ranks)
+
+    # Only the instance that records the round sends it. The next digest shows movement from the ranks in this one
+    ranks = {str(e.get("team").get("id")): e.get("rank") for e in league_standings}
+    if not db.set_digest_sent(league_id, season, next_round, ranks):
+        return False
+
+    for channel_id in channel_ids:
+        slack_queue.enqueue(
+            "chat_postMessage",
+            channel=channel_id,
+            text=f"{sports_api.get_league_name(league_id)} {next_round} Preview",
+            blocks=blocks)
+
+    logging.info(f"Sent {next_round} digest for league {league_id} to {len(channel_ids)} channels")
+    return True
+
+# Render the digest for a round into blocks, with the table's movement since the previous digest's ranks
+def build_digest_blocks(league_id, season, next_round, round_fixtures, league_standings, previous_ranks):
+    league_name = sports_api.get_league_name(league_id)
+
+    blocks = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{league_name} {next_round} Preview",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+
+    # Upcoming fixtures with their predicted winners
+    fixture_lines = []
+    for fixture in round_fixtures:
+        prediction = sports_api.get_prediction(fixture, league_id, season)
+        predicted_winner = (prediction or {}).get("predictions", {}).get("winner", {}).get("name") or "Prediction Unavailable"
+        kickoff = dateutil.parser.isoparse(fixture.get("fixture").get("date")).strftime("%a %d %b %H:%M")
+        fixture_lines.append(f"*{fixture.get('teams').get('away').get('name')}* at *{fixture.get('teams').get('home').get('name')}* - {kickoff} UTC - _Predicted Winner_: {predicted_winner}")
+    blocks.append(__section_block("*Upcoming Games*\n" + "\n".join(fixture_lines)))
+
+    # Results of the most recently completed round
+    finished_fixtures = sports_api.get_finished_fixtures(league_id, season) or []
+    if finished_fixtures:
+        last_round = finished_fixtures[-1].get("league").get("round")
+        result_lines = [
+            f"{f.get('teams').get('away').get('name')} {f.get('goals').get('away')} - {f.get('goals').get('home')} {f.get('teams').get('home').get('name')}"
+            for f in finished_fixtures if f.get("league").get("round") == last_round
+        ]
+        blocks.append(__section_block(f"*{last_round} Results*\n" + "\n".join(result_lines)))
+
+    # The table with each team's movement since the last digest
+    blocks.extend(__build_table_movement_blocks(league_standings, previous_ranks))
+    blocks.append({"type": "divider"})
+    return json.dumps(blocks)
+
+# Start the background thread that sends each active league's digest when it is due
+def start_digest_scheduler():
+    def digest_loop():
+        while True:
+            for league_id in sports_api.get_active_league_ids():
+                try:
+                    scheduler.run(scheduler.BULK, send_digest_if_due, league_id)
+                except Exception as e:
+                    logging.error(f"Error sending digest for league {league_id}: {e}")
+            time.sleep(__check_interval)
+
+    digest_thread = threading.Thread(target=digest_loop, name="digest-scheduler", daemon=True)
+    digest_thread.start()
+    return digest_thread
+
+# Build the table blocks, showing how far each team moved since the ranks saved by the last digest
+def __build_table_movement_blocks(league_standings, previous_ranks):
+    table_lines = []
+    for entry in league_standings:
+        team_id = str(entry.get("team").get("id"))
+        rank = entry.get("rank")
+        previous_rank = previous_ranks.get(team_id)
+
+        if previous_rank is None or previous_rank == rank:
+            movement = "➖"
+        elif previous_rank > rank:
+            movement = f"🔼{previous_rank - rank}"
+        else:
+            movement = f"🔽{rank - previous_rank}"
+        table_lines.append(f"{rank}. {movement} *{entry.get('team').get('name')}* - {entry.get('points')} pts")
+
+    # Split the table in two so each section stays well within Slack's text limit
+    half = (len(table_lines) + 1) // 2
+    return [
+        __section_block("*Table*\n" + "\n".join(table_lines[:half])),
+        __section_block("\n".join(table_lines[half:]) or " "),
+    ]
+
+# Create a section block with mrkdwn text
+def __section_block(text):
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": text
+        }
+    }
@@ -1,31 +1,69 @@
 # dynamo_functions.py
 # This class is responsible for holding the functions that interact with AWS DynamoDB
+# Finding everyone who follows a team (or a league's digest channels) uses a global secondary index
+# on the table, mirrored in memory so fan-out jobs do not query DynamoDB for every event
+import os
+import sys
+import time
+import threading
+
 import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 import sports_api_functions as sports_api
+import circuit_breaker_functions as breakers
+
+# Number of seconds to wait for DynamoDB before giving up on a request
+__request_timeout = 5
 
-# Creat dynamo resource and set table resource
-__dynamodb = boto3.resource('dynamodb')
+# Creat dynamo resource and set table resources
+# DYNAMODB_ENDPOINT_URL can point the resource at a local stand-in such as DynamoDB Local for testing
+__dynamodb = boto3.resource('dynamodb', endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL"), config=Config(connect_timeout=__request_timeout, read_timeout=__request_timeout, retries={"max_attempts": 2}))
 __dynamo_table = __dynamodb.Table('sports_bot_user_preferences')
+__subscriptions_table = __dynamodb.Table('sports_bot_subscriptions')
+__digest_channels_table = __dynamodb.Table('sports_bot_digest_channels')
+
+# Secondary index of each table used to find the IDs that follow a team or league, keyed by table name
+# Each holds the index name, the indexed attribute, and the table's key attribute
+__follower_indexes = {
+    "sports_bot_user_preferences": ("team_id-index", "team_id", "user_id"),
+    "sports_bot_subscriptions": ("team_id-index", "team_id", "subscriber_id"),
+    "sports_bot_digest_channels": ("league_id-index", "league_id", "channel_id"),
+}
+
+# Number of seconds a mirrored follower list is used before it is read from the index again,
+# so changes made by other instances are picked up
+__followers_ttl = int(os.environ.get("FOLLOWERS_MIRROR_TTL_SECONDS", 300))
+
+# In-memory mirror of the follower indexes, keyed by table name and indexed team or league ID
+# Each entry holds the set of follower IDs and when it was read from the index
+__followers = {}
+__followers_lock = threading.Lock()
 
 # Create/Update user's favorite team in Dynamo
-def set_favorite_team(user_id, team_name):
+# The team's league is stored with it so the home tab can show that league
+def set_favorite_team(user_id, team_name, league_id = None):
     team_id = sports_api.get_team_id(team_name)
     
     if team_id is None: return False
 
-    res =__dynamo_table.put_item(
+    res = __call_table(__dynamo_table, "put_item",
         Item={
             "user_id" : user_id,
             "team_name": team_name,
-            "team_id": team_id
-        }
+            "team_id": team_id,
+            "league_id": league_id or sports_api.get_league_id(None)
+        },
+        ReturnValues="ALL_OLD"
     )
+    __update_followers_mirror(__dynamo_table, user_id, res.get("Attributes", {}).get("team_id"), team_id)
     return res.get("ResponseMetadata").get("HTTPStatusCode") == 200
 
 # Read user's favorite team in Dynamo
 def get_favorite_team(user_id):
-    res = __dynamo_table.get_item(
+    res = __call_table(__dynamo_table, "get_item",
         Key={
             "user_id" : user_id
         }
@@ -33,7 +71,10 @@ def get_favorite_team(user_id):
     if "Item" in res:
         team_name = res.get("Item").get("team_name")
         team_id = res.get("Item").get("team_id")
-        return {"team_name" : team_name, "team_id" : int(team_id)}
+
+        # Favorites set before leagues were stored are in the default league
+        league_id = res.get("Item").get("league_id") or sports_api.get_league_id(None)
+        return {"team_name" : team_name, "team_id" : int(team_id), "league_id" : int(league_id)}
     else:
         return None
 
@@ -45,9 +86,251 @@ def remove_favorite_team(user_id):
         return 404
 
     # Delete it if the user has a favorite team set
-    res = __dynamo_table.delete_item(
+    res = __call_table(__dynamo_table, "delete_item",
         Key={
             "user_id" : user_id
         }
     )
+    __update_followers_mirror(__dynamo_table, user_id, fav_res.get("team_id"), None)
     return res.get("ResponseMetadata").get("HTTPStatusCode")
+
+# Subscribe a conversation (a channel or a user's DM) to match notifications for a team
+def set_subscription(subscriber_id, team_name):
+    team_id = sports_api.get_team_id(team_name)
+
+    if team_id is None: return False
+
+    res = __call_table(__subscriptions_table, "put_item",
+        Item={
+            "subscriber_id" : subscriber_id,
+            "team_name": team_name,
+            "team_id": team_id
+        },
+        ReturnValues="ALL_OLD"
+    )
+    __update_followers_mirror(__subscriptions_table, subscriber_id, res.get("Attributes", {}).get("team_id"), team_id)
+    return res.get("ResponseMetadata").get("HTTPStatusCode") == 200
+
+# Read the team a conversation is subscribed to
+def get_subscription(subscriber_id):
+    res = __call_table(__subscriptions_table, "get_item",
+        Key={
+            "subscriber_id" : subscriber_id
+        }
+    )
+    if "Item" in res:
+        team_name = res.get("Item").get("team_name")
+        team_id = res.get("Item").get("team_id")
+        return {"team_name" : team_name, "team_id" : int(team_id)}
+    else:
+        return None
+
+# Remove a conversation's subscription
+def remove_subscription(subscriber_id):
+    # Check if the conversation has a subscription
+    sub_res = get_subscription(subscriber_id)
+    if sub_res is None:
+        return 404
+
+    res = __call_table(__subscriptions_table, "delete_item",
+        Key={
+            "subscriber_id" : subscriber_id
+        }
+    )
+    __update_followers_mirror(__subscriptions_table, subscriber_id, sub_res.get("team_id"), None)
+    return res.get("ResponseMetadata").get("HTTPStatusCode")
+
+# Get the IDs of every conversation subscribed to a team
+def get_subscribers(team_id):
+    return list(__get_follower_ids(__subscriptions_table, team_id))
+
+# Get the IDs of every user whose favorite team is the given team
+def get_team_followers(team_id):
+    return __get_follower_ids(__dynamo_table, team_id)
+
+# Get the number of users whose favorite team is the given team
+def get_follower_count(team_id):
+    return len(__get_follower_ids(__dynamo_table, team_id))
+
+# Get one page of the users whose favorite team is the given team, straight from the index
+# Returns the user IDs and the key to pass as start_key for the next page, which is None on the last page
+def get_followers_page(team_id, limit = 100, start_key = None):
+    return __query_follower_index(__dynamo_table, team_id, limit, start_key)
+
+# Opt a channel into the round preview and results digest for a league
+def set_digest_channel(channel_id, league_id):
+    res = __call_table(__digest_channels_table, "put_item",
+        Item={
+            "channel_id" : channel_id,
+            "league_id": league_id
+        },
+        ReturnValues="ALL_OLD"
+    )
+    __update_followers_mirror(__digest_channels_table, channel_id, res.get("Attributes", {}).get("league_id"), league_id)
+    return res.get("ResponseMetadata").get("HTTPStatusCode") == 200
+
+# Opt a channel out of the digest
+def remove_digest_channel(channel_id):
+    res = __call_table(__digest_channels_table, "delete_item",
+        Key={
+            "channel_id" : channel_id
+        },
+        ReturnValues="ALL_OLD"
+    )
+
+    # Deleting a channel that was not opted in returns no attributes
+    if "Attributes" not in res:
+        return 404
+    __update_followers_mirror(__digest_channels_table, channel_id, res.get("Attributes").get("league_id"), None)
+    return res.get("ResponseMetadata").get("HTTPStatusCode")
+
+# Get the IDs of every channel opted into the digest for a league
+def get_digest_channels(league_id):
+    return list(__get_follower_ids(__digest_channels_table, league_id))
+
+# Get the round a league season's last digest was sent for, and the table ranks shown in it keyed by team ID
+# They are kept in the digest channels table under a key no channel uses, and have no league_id,
+# so they are left out of the table's league index. Returns None and no ranks before the first digest
+def get_digest_state(league_id, season):
+    res = __call_table(__digest_channels_table, "get_item",
+        Key={
+            "channel_id" : __digest_state_key(league_id, season)
+        },
+        ConsistentRead=True
+    )
+    item = res.get("Item", {})
+    return item.get("sent_round"), {team_id: int(rank) for team_id, rank in item.get("ranks", {}).items()}
+
+# Record that a league season's digest was sent for a round, with the table ranks shown in it keyed by team ID
+# The write only succeeds if the round was not already recorded, so exactly one instance sends each round's digest.
+# Returns False if the round was already recorded
+def set_digest_sent(league_id, season, round_name, ranks):
+    try:
+        __call_table(__digest_channels_table, "put_item",
+            Item={
+                "channel_id" : __digest_state_key(league_id, season),
+                "sent_round": round_name,
+                "ranks": ranks
+            },
+            ConditionExpression="attribute_not_exists(sent_round) OR sent_round <> :round",
+            ExpressionAttributeValues={":round": round_name}
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+# Create any missing tables, and add the follower indexes to existing tables that do not have them yet
+# Used to set up a new deployment or a local stand-in, e.g. "python dynamo_functions.py create-tables"
+def create_tables():
+    client = __dynamodb.meta.client
+    existing_tables = client.list_tables().get("TableNames")
+
+    for table in (__dynamo_table, __subscriptions_table, __digest_channels_table):
+        index_name, index_attribute, key_attribute = __follower_indexes.get(table.name)
+        index = {
+            "IndexName": index_name,
+            "KeySchema": [{"AttributeName": index_attribute, "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "KEYS_ONLY"},
+        }
+        attribute_definitions = [
+            {"AttributeName": key_attribute, "AttributeType": "S"},
+            {"AttributeName": index_attribute, "AttributeType": "N"},
+        ]
+
+        if table.name not in existing_tables:
+            client.create_table(
+                TableName=table.name,
+                KeySchema=[{"AttributeName": key_attribute, "KeyType": "HASH"}],
+                AttributeDefinitions=attribute_definitions,
+                GlobalSecondaryIndexes=[index],
+                BillingMode="PAY_PER_REQUEST")
+            client.get_waiter("table_exists").wait(TableName=table.name)
+            continue
+
+        existing_indexes = client.describe_table(TableName=table.name).get("Table").get("GlobalSecondaryIndexes", [])
+        if index_name not in [i.get("IndexName") for i in existing_indexes]:
+            client.update_table(
+                TableName=table.name,
+                AttributeDefinitions=attribute_definitions,
+                GlobalSecondaryIndexUpdates=[{"Create": index}])
+
+# Get the key of the digest channels table item holding a league season's last digest
+def __digest_state_key(league_id, season):
+    return f"ranks:{league_id}:{season}"
+
+# Get the IDs following a team or league, from the in-memory mirror of the table's follower index
+# The mirror entry is read from the index on first use and again once it is older than the mirror TTL
+def __get_follower_ids(table, followed_id):
+    mirror_key = (table.name, int(followed_id))
+
+    with __followers_lock:
+        entry = __followers.get(mirror_key)
+        if entry is not None and time.time() - entry.get("loaded_at") < __followers_ttl:
+            return set(entry.get("ids"))
+
+    # Index query results are paginated, so keep reading until there are no more pages
+    follower_ids = set()
+    start_key = None
+    while True:
+        page_ids, start_key = __query_follower_index(table, followed_id, start_key=start_key)
+        follower_ids.update(page_ids)
+        if start_key is None:
+            break
+
+    with __followers_lock:
+        __followers[mirror_key] = {"ids": follower_ids, "loaded_at": time.time()}
+    return set(follower_ids)
+
+# Query one page of a table's follower index
+# Returns the follower IDs and the key the next page starts at, or None on the last page
+def __query_follower_index(table, followed_id, limit = None, start_key = None):
+    index_name, index_attribute, key_attribute = __follower_indexes.get(table.name)
+    query_kwargs = {
+        "IndexName": index_name,
+        "KeyConditionExpression": Key(index_attribute).eq(int(followed_id)),
+        "ProjectionExpression": key_attribute,
+    }
+    if limit:
+        query_kwargs["Limit"] = limit
+    if start_key:
+        query_kwargs["ExclusiveStartKey"] = start_key
+
+    res = __call_table(table, "query", **query_kwargs)
+    return [item.get(key_attribute) for item in res.get("Items", [])], res.get("LastEvaluatedKey")
+
+# Move an ID between mirrored follower lists after this instance changes what it follows
+# Only lists already in the mirror are updated, the others are read from the index when first needed
+def __update_followers_mirror(table, follower_id, old_followed_id, new_followed_id):
+    with __followers_lock:
+        if old_followed_id is not None:
+            entry = __followers.get((table.name, int(old_followed_id)))
+            if entry is not None:
+                entry.get("ids").discard(follower_id)
+
+        if new_followed_id is not None:
+            entry = __followers.get((table.name, int(new_followed_id)))
+            if entry is not None:
+                entry.get("ids").add(follower_id)
+
+# Call an operation on a table through the table's circuit breaker
+# Raises CircuitOpenError without calling DynamoDB while the breaker is open
+def __call_table(table, operation, **kwargs):
+    return breakers.get_breaker(f"dynamodb:{table.name}").call(getattr(table, operation), is_failure=__is_table_failure, **kwargs)
+
+# Check whether an error means DynamoDB is unavailable or overloaded, rather than the request itself being invalid
+def __is_table_failure(e):
+    if isinstance(e, ClientError):
+        status_code = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500)
+        error_code = e.response.get("Error", {}).get("Code")
+        return status_code >= 500 or error_code in ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded")
+    return True
+
+# Set up the tables, e.g. against a local stand-in with DYNAMODB_ENDPOINT_URL=http://localhost:8000
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "create-tables":
+        print("Usage: python dynamo_functions.py create-tables")
+        sys.exit(1)
+
+    create_tables()
@@ -0,0 +1,544 @@
+# history_functions.py
+# This class is responsible for the archive of past seasons
+# Past seasons' finished fixtures and final standings are imported from the API once, and stored as
+# NumPy column files in a directory per league and season. They are memory mapped when read, so only
+# the pages a query touches are loaded, and history commands and all-time records are computed with
+# vectorized scans over the columns without making any API calls
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import logging
+
+import numpy as np
+
+import sports_api_functions as sports_api
+import analytics_functions as analytics
+
+# Directory the archive is stored in
+__history_dir = os.environ.get("HISTORY_DIR", "history")
+
+# Number of seasons imported when the import command is not given a first season
+__default_import_seasons = 5
+
+# Number of teams shown in the all-time table
+__all_time_table_size = 10
+
+# Standings columns stored for each season, and where each value is found in a standings entry from the API
+__standings_fields = {
+    "team_id": lambda entry: entry.get("team").get("id"),
+    "rank": lambda entry: entry.get("rank"),
+    "points": lambda entry: entry.get("points"),
+    "played": lambda entry: entry.get("all").get("played"),
+    "win": lambda entry: entry.get("all").get("win"),
+    "draw": lambda entry: entry.get("all").get("draw"),
+    "lose": lambda entry: entry.get("all").get("lose"),
+    "goals_for": lambda entry: entry.get("all").get("goals").get("for"),
+    "goals_against": lambda entry: entry.get("all").get("goals").get("against"),
+}
+
+# Fixture columns stored for each season, as built by analytics.build_fixture_columns
+__fixture_fields = ("fixture_id", "timestamp", "home_id", "away_id", "home_goals", "away_goals")
+
+# Number of times a season being imported again is looked for while its new directory is swapped in,
+# and the number of seconds between tries
+__load_attempts = 5
+__load_retry_delay = 0.05
+
+# Loaded seasons, keyed by league and season. Each holds the inode of the season's directory,
+# so a season imported again by another process is mapped again
+__seasons = {}
+
+# All-time records for each league, keyed by league. Each holds the archived seasons they were computed from
+__records = {}
+__archive_lock = threading.Lock()
+
+# Import a league's past seasons from the API into the archive, replacing seasons already archived
+# Returns the seasons that were imported
+def import_seasons(league_id, first_season, last_season):
+    imported = []
+    for season in range(first_season, last_season + 1):
+        try:
+            import_season(league_id, season)
+            imported.append(season)
+        except Exception as e:
+            logging.error(f"Unable to import league {league_id} season {season}: {e}")
+    return imported
+
+# Import one past season from the API into the archive
+def import_season(league_id, season):
+    fixtures = sports_api.get_finished_fixtures(league_id, season)
+    if not fixtures:
+        raise ValueError("no finished fixtures")
+    standings = sports_api.get_upstream_standings(league_id, season)
+
+    columns = analytics.build_fixture_columns(fixtures)
+    team_names = columns.get("team_names")
+    for entry in standings:
+        team_names[entry.get("team").get("id")] = entry.get("team").get("name")
+
+    # Write the season to a new directory, and swap it in once every column is written
+    season_dir = __season_dir(league_id, season)
+    temp_dir = f"{season_dir}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    for name in __fixture_fields:
+        np.save(os.path.join(temp_dir, f"fixtures_{name}.npy"), columns.get(name))
+    for name, get_value in __standings_fields.items():
+        np.save(os.path.join(temp_dir, f"standings_{name}.npy"), np.array([get_value(entry) or 0 for entry in standings], dtype=np.int32))
+    with open(os.path.join(temp_dir, "teams.json"), "w") as teams_file:
+        json.dump({str(team_id): name for team_id, name in team_names.items()}, teams_file)
+
+    old_dir = f"{season_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(season_dir):
+        os.rename(season_dir, old_dir)
+    os.rename(temp_dir, season_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logging.info(f"Archived league {league_id} season {season}: {len(fixtures)} fixtures, {len(standings)} teams")
+
+# Get the archived seasons of a league, oldest first
+# Seasons being imported again are included while their previous directory is renamed aside
+def get_archived_seasons(league_id):
+    league_dir = os.path.join(__history_dir, str(league_id))
+    if not os.path.isdir(league_dir):
+        return []
+    return sorted({int(name.removesuffix(".old")) for name in os.listdir(league_dir) if name.removesuffix(".old").isdigit()})
+
+# Load an archived season's columns, memory mapped. Returns None if the season is not archived
+# Holds "fixtures" and "standings" dicts of column name to array, and "team_names", a dict of team ID to name
+# A season being imported again is briefly missing while its new directory is swapped in. The previous mapping
+# is used meanwhile, as it stays readable after its files are removed, or the new directory is waited for
+def load_season(league_id, season):
+    season_dir = __season_dir(league_id, season)
+    for attempt in range(__load_attempts):
+        try:
+            return __map_season(league_id, season)
+        except FileNotFoundError:
+            with __archive_lock:
+                archived = __seasons.get((league_id, season))
+            if archived is not None:
+                return archived
+
+            # The previous directory is only renamed aside while the new one is swapped in
+            if not os.path.exists(f"{season_dir}.old"):
+                return None
+            time.sleep(__load_retry_delay)
+    return None
+
+# Get a team's finish and record in every archived season of a league, oldest first
+def compute_team_history(league_id, team_id):
+    history = []
+    for season in get_archived_seasons(league_id):
+        archived = load_season(league_id, season)
+        if archived is None:
+            continue
+
+        standings = archived.get("standings")
+        rows = np.flatnonzero(standings["team_id"] == team_id)
+        if len(rows) == 0:
+            continue
+
+        row = rows[0]
+        history.append({"season": season, **{name: int(standings[name][row]) for name in __standings_fields}})
+    return history
+
+# Get a team's record in one archived season, with its home and away splits, form, and biggest win and defeat
+# Returns None if the team did not play in the season
+def compute_team_season(archived, team_id):
+    fixtures = archived.get("fixtures")
+    team_form = analytics.compute_team_form(fixtures).get(team_id)
+    if team_form is None:
+        return None
+
+    standings = archived.get("standings")
+    rows = np.flatnonzero(standings["team_id"] == team_id)
+
+    # Goal margin of every game from the team's point of view
+    is_home = fixtures["home_id"] == team_id
+    played = is_home | (fixtures["away_id"] == team_id)
+    margin = np.where(is_home, fixtures["home_goals"].astype(np.int32) - fixtures["away_goals"], fixtures["away_goals"].astype(np.int32) - fixtures["home_goals"])
+    margin = np.where(played, margin, 0)
+
+    team_season = {
+        "team_form": team_form,
+        "rank": int(standings["rank"][rows[0]]) if len(rows) else None,
+        "points": int(standings["points"][rows[0]]) if len(rows) else None,
+        "biggest_win": __describe_game(fixtures, int(np.argmax(margin))) if margin.max() > 0 else None,
+        "heaviest_defeat": __describe_game(fixtures, int(np.argmin(margin))) if margin.min() < 0 else None,
+    }
+    return team_season
+
+# Compute a league's all-time table and records across every archived season
+# They are only recomputed when seasons are added to or replaced in the archive
+def get_all_time_records(league_id):
+    seasons = [archived for archived in (load_season(league_id, season) for season in get_archived_seasons(league_id)) if archived is not None]
+    signature = tuple((archived.get("season"), archived.get("inode")) for archived in seasons)
+    if not seasons:
+        return None
+
+    with __archive_lock:
+        records = __records.get(league_id)
+        if records is not None and records.get("signature") == signature:
+            return records
+
+    team_names = {}
+    for archived in seasons:
+        team_names.update(archived.get("team_names"))
+
+    # Every season's games in one set of columns, with the season each game was played in
+    def concatenate(name):
+        return np.concatenate([archived.get("fixtures")[name] for archived in seasons])
+    home_id, away_id = concatenate("home_id"), concatenate("away_id")
+    home_goals, away_goals = concatenate("home_goals").astype(np.int32), concatenate("away_goals").astype(np.int32)
+    game_seasons = np.concatenate([np.full(len(archived.get("fixtures")["home_id"]), archived.get("season")) for archived in seasons])
+
+    # Each game gives one row for the home team and one row for the away team
+    team_ids = np.concatenate((home_id, away_id))
+    goals_for = np.concatenate((home_goals, away_goals))
+    goals_against = np.concatenate((away_goals, home_goals))
+    result = np.sign(goals_for - goals_against)
+    unique_team_ids, team_index = np.unique(team_ids, return_inverse=True)
+    team_count = len(unique_team_ids)
+
+    wins = np.bincount(team_index[result > 0], minlength=team_count)
+    draws = np.bincount(team_index[result == 0], minlength=team_count)
+    losses = np.bincount(team_index[result < 0], minlength=team_count)
+    total_goals_for = np.bincount(team_index, weights=goals_for, minlength=team_count).astype(np.int32)
+    total_goals_against = np.bincount(team_index, weights=goals_against, minlength=team_count).astype(np.int32)
+    points = 3 * wins + draws
+
+    table = [
+        {
+            "team_name": team_names.get(int(unique_team_ids[i])),
+            "played": int(wins[i] + draws[i] + losses[i]),
+            "wins": int(wins[i]),
+            "draws": int(draws[i]),
+            "losses": int(losses[i]),
+            "goals_for": int(total_goals_for[i]),
+            "goals_against": int(total_goals_against[i]),
+            "points": int(points[i]),
+        }
+        for i in np.lexsort((total_goals_for - total_goals_against, points))[::-1][:__all_time_table_size]
+    ]
+
+    # Champions are the teams ranked first in each season's final standings
+    champion_ids = np.concatenate([archived.get("standings")["team_id"][archived.get("standings")["rank"] == 1] for archived in seasons])
+    title_team_ids, title_counts = np.unique(champion_ids, return_counts=True)
+    titles = sorted(((team_names.get(int(team_id)), int(count)) for team_id, count in zip(title_team_ids, title_counts)), key=lambda title: -title[1])
+
+    # Best points total in a season
+    season_points = [(archived.get("season"), archived.get("standings")) for archived in seasons if len(archived.get("standings")["points"])]
+    best_season, best_standings = max(season_points, key=lambda pair: pair[1]["points"].max()) if season_points else (None, None)
+    best_row = int(np.argmax(best_standings["points"])) if best_standings is not None else None
+
+    all_games = {"home_id": home_id, "away_id": away_id, "home_goals": home_goals, "away_goals": away_goals, "season": game_seasons, "team_names": team_names}
+    records = {
+        "signature": signature,
+        "seasons": [archived.get("season") for archived in seasons],
+        "game_count": len(home_id),
+        "table": table,
+        "titles": titles,
+        "best_season": {
+            "team_name": team_names.get(int(best_standings["team_id"][best_row])),
+            "season": best_season,
+            "points": int(best_standings["points"][best_row]),
+        } if best_standings is not None else None,
+        "biggest_win": __describe_game(all_games, int(np.argmax(np.abs(home_goals - away_goals)))),
+        "highest_scoring": __describe_game(all_games, int(np.argmax(home_goals + away_goals))),
+    }
+
+    with __archive_lock:
+        __records[league_id] = records
+    return records
+
+# Show a team's finish in every archived season, or its record in one season if a season is given
+def get_team_history_data(client, message, team_name, league_id = None, season = None):
+    league_id = league_id or sports_api.get_league_id(None)
+    league_name = sports_api.get_league_name(league_id)
+
+    try:
+        team_id = __find_team_id(league_id, team_name)
+        if team_id is None:
+            __post_error(client, message, f"No archived seasons found for {team_name} in the {league_name}.")
+            return
+
+        if season is None:
+            history = compute_team_history(league_id, team_id)
+            blocks = __create_team_history_card_block(team_name, league_name, history)
+        else:
+            archived = load_season(league_id, season)
+            team_season = compute_team_season(archived, team_id) if archived is not None else None
+            if team_season is None:
+                __post_error(client, message, f"The {league_name} {season} season is not archived, or {team_name} did not play in it.")
+                return
+            blocks = __create_team_season_card_block(team_name, league_name, season, team_season)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get team history. Please try again later.")
+        return
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{team_name} History",
+        blocks=json.dumps(blocks))
+
+# Show a league's all-time table and records across every archived season
+def get_all_time_records_data(client, message, league_id = None):
+    league_id = league_id or sports_api.get_league_id(None)
+    league_name = sports_api.get_league_name(league_id)
+
+    try:
+        records = get_all_time_records(league_id)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get all-time records. Please try again later.")
+        return
+
+    if records is None:
+        __post_error(client, message, f"No seasons of the {league_name} have been archived yet.")
+        return
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{league_name} All-Time Records",
+        blocks=json.dumps(__create_records_card_block(league_name, records)))
+
+# Map an archived season's columns, reusing the mapping already loaded if the season was not imported again since
+# Raises FileNotFoundError if the season's directory is missing or is replaced while it is read
+def __map_season(league_id, season):
+    season_dir = __season_dir(league_id, season)
+    inode = os.stat(season_dir).st_ino
+
+    with __archive_lock:
+        archived = __seasons.get((league_id, season))
+        if archived is not None and archived.get("inode") == inode:
+            return archived
+
+    with open(os.path.join(season_dir, "teams.json")) as teams_file:
+        team_names = {int(team_id): name for team_id, name in json.load(teams_file).items()}
+
+    fixtures = {name: np.load(os.path.join(season_dir, f"fixtures_{name}.npy"), mmap_mode="r") for name in __fixture_fields}
+    fixtures["team_names"] = team_names
+    archived = {
+        "inode": inode,
+        "season": season,
+        "fixtures": fixtures,
+        "standings": {name: np.load(os.path.join(season_dir, f"standings_{name}.npy"), mmap_mode="r") for name in __standings_fields},
+        "team_names": team_names,
+    }
+
+    with __archive_lock:
+        __seasons[(league_id, season)] = archived
+    return archived
+
+# Get the directory an archived season is stored in
+def __season_dir(league_id, season):
+    return os.path.join(__history_dir, str(league_id), str(season))
+
+# Find a team in the archive by name, falling back to looking it up in the API for teams that are not archived
+def __find_team_id(league_id, team_name):
+    for season in reversed(get_archived_seasons(league_id)):
+        archived = load_season(league_id, season)
+        if archived is None:
+            continue
+
+        for team_id, name in archived.get("team_names").items():
+            if name.lower() == team_name.lower():
+                return team_id
+    return sports_api.get_team_id(team_name)
+
+# Describe one game from a set of fixture columns
+def __describe_game(columns, index):
+    team_names = columns.get("team_names")
+    game = {
+        "home_name": team_names.get(int(columns["home_id"][index])),
+        "away_name": team_names.get(int(columns["away_id"][index])),
+        "home_goals": int(columns["home_goals"][index]),
+        "away_goals": int(columns["away_goals"][index]),
+    }
+    if "season" in columns:
+        game["season"] = int(columns["season"][index])
+    return game
+
+# Format a game as a score line
+def __format_game(game):
+    score = f"{game.get('away_name')} {game.get('away_goals')} - {game.get('home_goals')} {game.get('home_name')}"
+    return f"{score} ({game.get('season')})" if game.get("season") else score
+
+# Create set of blocks representing a team's finish in every archived season
+def __create_team_history_card_block(team_name, league_name, history):
+    season_lines = [
+        f"*{entry.get('season')}*: Finished {entry.get('rank')} with {entry.get('points')} pts | {entry.get('win')}W {entry.get('draw')}D {entry.get('lose')}L, {entry.get('goals_for')} scored, {entry.get('goals_against')} allowed"
+        for entry in history
+    ]
+
+    history_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{team_name} in the {league_name}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "\n".join(season_lines) or f"{team_name} did not play in any archived season."
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return history_card
+
+# Create set of blocks representing a team's record in one archived season
+def __create_team_season_card_block(team_name, league_name, season, team_season):
+    team_form = team_season.get("team_form")
+    total = team_form.get("splits").get("total")
+    home = team_form.get("splits").get("home")
+    away = team_form.get("splits").get("away")
+    biggest_win = team_season.get("biggest_win")
+    heaviest_defeat = team_season.get("heaviest_defeat")
+
+    season_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{team_name} in the {league_name} {season} Season",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Finished*: {team_season.get('rank')} | *Points*: {team_season.get('points')} | *Last {len(team_form.get('form'))} Games*: {' '.join(team_form.get('form'))}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Home*: {home.get('wins')}W {home.get('draws')}D {home.get('losses')}L, {home.get('goals_for')} scored, {home.get('goals_against')} allowed"
+                    + f"\n*Away*: {away.get('wins')}W {away.get('draws')}D {away.get('losses')}L, {away.get('goals_for')} scored, {away.get('goals_against')} allowed"
+                    + f"\n*Total*: {total.get('wins')}W {total.get('draws')}D {total.get('losses')}L, {total.get('goals_for')} scored, {total.get('goals_against')} allowed"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Biggest Win*: {__format_game(biggest_win) if biggest_win else 'None'}"
+                    + f"\n*Heaviest Defeat*: {__format_game(heaviest_defeat) if heaviest_defeat else 'None'}"
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return season_card
+
+# Create set of blocks representing a league's all-time table and records
+def __create_records_card_block(league_name, records):
+    seasons = records.get("seasons")
+    table_lines = [
+        f"{i + 1}. *{entry.get('team_name')}*: {entry.get('points')} pts | {entry.get('played')} played, {entry.get('wins')}W {entry.get('draws')}D {entry.get('losses')}L, {entry.get('goals_for')} scored, {entry.get('goals_against')} allowed"
+        for i, entry in enumerate(records.get("table"))
+    ]
+    title_lines = [f"*{team_name}*: {count}" for team_name, count in records.get("titles")]
+    best_season = records.get("best_season")
+
+    records_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{league_name} All-Time Records",
+                "emoji": True
+            }
+        },
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"{len(seasons)} seasons from {seasons[0]} to {seasons[-1]}, {records.get('game_count')} games"
+                }
+            ]
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "\n".join(table_lines)
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "*Titles*\n" + (", ".join(title_lines) or "None")
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": (f"*Most Points in a Season*: {best_season.get('team_name')}, {best_season.get('points')} pts ({best_season.get('season')})\n" if best_season else "")
+                    + f"*Biggest Win*: {__format_game(records.get('biggest_win'))}"
+                    + f"\n*Highest Scoring Game*: {__format_game(records.get('highest_scoring'))}"
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return records_card
+
+# Let the user know their history command could not be completed
+def __post_error(client, message, error_text):
+    client.chat_postMessage(
+        channel=message["channel"],
+        text="Error Getting Data",
+        blocks=[{
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": error_text,
+                "emoji": False
+            }
+        }])
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python history_functions.py import [league] [first_season] [last_season]")
+        sys.exit(1)
+
+    league_id = sports_api.get_league_id(sys.argv[2]) if len(sys.argv) > 2 else sports_api.get_league_id(None)
+    if league_id is None:
+        print(f"Unknown league {sys.argv[2]}. Use a league ID or one of: {', '.join(sports_api.leagues)}")
+        sys.exit(1)
+
+    last_season = int(sys.argv[4]) if len(sys.argv) > 4 else sports_api.get_current_season(league_id) - 1
+    first_season = int(sys.argv[3]) if len(sys.argv) > 3 else last_season - __default_import_seasons + 1
+
+    imported = import_seasons(league_id, first_season, last_season)
+    print(f"Imported {len(imported)} seasons of {sports_api.get_league_name(league_id)}: {', '.join(str(season) for season in imported)}")
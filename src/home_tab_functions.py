@@ -0,0 +1,170 @@
+# home_tab_functions.py
+# This class is responsible for rendering the App Home tab and keeping it fresh
+# Users who recently opened their Home tab are tracked, and when the standings or their
+# favorite team's fixtures change, only those users' views are re-rendered and republished
+# Republishes are batched, rate limited through the Slack queue, and skipped when nothing changed
+
+import os
+import json
+import hashlib
+import threading
+import time
+import logging
+
+import sports_api_functions as sports_api
+import dynamo_functions as db
+import slack_queue_functions as slack_queue
+import circuit_breaker_functions as breakers
+import scheduler_functions as scheduler
+
+# Number of seconds a user is considered a recent viewer after opening their Home tab
+__viewer_ttl = int(os.environ.get("HOME_VIEWER_TTL_SECONDS", 86400))
+
+# Number of seconds data changes are collected for before republishing, so several
+# changes found close together only cause one republish per user
+__batch_delay = float(os.environ.get("HOME_REPUBLISH_DELAY_SECONDS", 5))
+
+# Recent viewers, keyed by user ID
+# Each entry holds when the user last viewed Home, their favorite team, and the hash of the blocks last published
+__recent_viewers = {}
+__viewers_lock = threading.Lock()
+
+# Users waiting to be republished in the next batch
+__pending_users = set()
+__pending_timer = None
+
+# Render the user's Home tab and remember them as a recent viewer
+# Returns the view to pass to views_publish
+def render_home_tab(user_id):
+    try:
+        favorite_team = db.get_favorite_team(user_id)
+    except breakers.CircuitOpenError:
+        # Fall back to the favorite team remembered from the user's last view while DynamoDB is failing
+        with __viewers_lock:
+            favorite_team = (__recent_viewers.get(user_id) or {}).get("favorite_team")
+
+    blocks = __render_blocks(favorite_team)
+
+    with __viewers_lock:
+        __recent_viewers[user_id] = {
+            "viewed_at": time.time(),
+            "favorite_team": favorite_team,
+            "blocks_hash": __hash_blocks(blocks),
+        }
+
+    return __build_view(blocks)
+
+# Look up a recent viewer's favorite team again after they change it
+def refresh_favorite_team(user_id):
+    with __viewers_lock:
+        if user_id in __recent_viewers:
+            __recent_viewers[user_id]["favorite_team"] = db.get_favorite_team(user_id)
+
+# Queue a republish for every recent viewer affected by a data change in a league's current season
+def handle_data_change(league_id, season, standings_changed, changed_team_ids):
+    now = time.time()
+    affected_users = []
+
+    # When only fixtures changed, the users following the changed teams are found through the followers index
+    # If the index cannot be read, viewers are matched on the favorite team remembered from their last view instead
+    changed_team_followers = set()
+    unresolved_team_ids = set()
+    if not standings_changed:
+        for team_id in changed_team_ids:
+            try:
+                changed_team_followers.update(db.get_team_followers(team_id))
+            except Exception as e:
+                logging.error(f"Error getting followers of team {team_id} for home tab republish: {e}")
+                unresolved_team_ids.add(team_id)
+
+    with __viewers_lock:
+        for user_id in [u for u, v in __recent_viewers.items() if now - v.get("viewed_at") > __viewer_ttl]:
+            del __recent_viewers[user_id]
+
+        for user_id, viewer in __recent_viewers.items():
+            favorite_team = viewer.get("favorite_team")
+
+            # Home shows the favorite team's league, or the default league
+            viewer_league_id = favorite_team.get("league_id") if favorite_team else sports_api.get_league_id(None)
+            if viewer_league_id != league_id:
+                continue
+
+            # Everyone sees the top of the table. Users without a favorite team see games featuring any team
+            if standings_changed or favorite_team is None or user_id in changed_team_followers or favorite_team.get("team_id") in unresolved_team_ids:
+                affected_users.append(user_id)
+
+    __schedule_republish(affected_users)
+
+# Register for data change notifications from the prefetcher
+def start_home_tab_updates():
+    sports_api.add_data_change_listener(handle_data_change)
+
+# Add users to the next republish batch, starting the batch timer if it is not already running
+def __schedule_republish(user_ids):
+    global __pending_timer
+
+    if not user_ids:
+        return
+
+    with __viewers_lock:
+        __pending_users.update(user_ids)
+        if __pending_timer is None:
+            # The batch is rendered in the scheduler, so it waits for workers that commands are not using
+            __pending_timer = threading.Timer(__batch_delay, scheduler.submit_logged, args=(scheduler.APP_HOME, __republish_pending))
+            __pending_timer.daemon = True
+            __pending_timer.start()
+
+# Re-render and republish the Home tab of every user in the pending batch
+def __republish_pending():
+    global __pending_timer
+
+    with __viewers_lock:
+        user_ids = list(__pending_users)
+        __pending_users.clear()
+        __pending_timer = None
+
+    # Users with the same favorite team see the same blocks, so render each team once per batch
+    rendered_by_team = {}
+    for user_id in user_ids:
+        with __viewers_lock:
+            viewer = __recent_viewers.get(user_id)
+        if viewer is None:
+            continue
+
+        favorite_team = viewer.get("favorite_team")
+        team_key = favorite_team.get("team_id") if favorite_team else None
+        try:
+            if team_key not in rendered_by_team:
+                rendered_by_team[team_key] = __render_blocks(favorite_team)
+            blocks = rendered_by_team.get(team_key)
+        except Exception as e:
+            logging.error(f"Error rendering home tab for republish: {e}")
+            continue
+
+        # Skip the publish if the user would see the same content they already have
+        blocks_hash = __hash_blocks(blocks)
+        if not blocks or blocks_hash == viewer.get("blocks_hash"):
+            continue
+
+        viewer["blocks_hash"] = blocks_hash
+        slack_queue.enqueue("views_publish", priority_class=scheduler.APP_HOME, user_id=user_id, view=__build_view(blocks))
+
+# Render the Home tab blocks for a user with the given favorite team
+def __render_blocks(favorite_team):
+    if favorite_team is None:
+        return sports_api.get_app_home_blocks()
+    return sports_api.get_app_home_blocks(favorite_team.get("team_name"), favorite_team.get("league_id"))
+
+# Hash the content of the Home tab blocks, ignoring the "Last Updated" context line
+# which changes on every render
+def __hash_blocks(blocks):
+    content_blocks = [block for block in blocks if block.get("type") != "context"]
+    return hashlib.sha256(json.dumps(content_blocks, sort_keys=True).encode()).hexdigest()
+
+# Build the Home tab view from its blocks
+def __build_view(blocks):
+    return {
+        "type": "home",
+        "callback_id": "home_view",
+        "blocks": json.dumps(blocks)
+    }
@@ -0,0 +1,162 @@
+# notification_functions.py
+# This class is responsible for pushing match events to subscribed users and channels
+# A single poller watches the league's live fixtures for everybody, detects kickoffs, goals, red cards,
+# and full time results, and fans the notifications out through the rate-limited Slack queue
+
+import os
+import threading
+import time
+import logging
+
+import sports_api_functions as sports_api
+import dynamo_functions as db
+import slack_queue_functions as slack_queue
+import scheduler_functions as scheduler
+
+# Number of seconds between polls of the live fixtures
+__poll_interval = int(os.environ.get("LIVE_POLL_INTERVAL_SECONDS", 60))
+
+# Card details the API uses for a player being sent off
+__red_card_details = ("Red Card", "Second Yellow card")
+
+# Last seen state of each live fixture, keyed by fixture ID
+__fixture_states = {}
+
+# Functions called with the live fixtures after every poll
+__live_listeners = []
+
+# Register a function called after every poll with the list of live fixtures, and the list of
+# fixtures that finished since the last poll with their final state
+def add_live_listener(callback):
+    __live_listeners.append(callback)
+
+# Poll the live fixtures once and notify subscribers of anything that happened since the last poll
+def poll_live_fixtures(notify=True):
+    live_fixtures = sports_api.get_live_fixtures()
+    live_ids = set()
+
+    for fixture in live_fixtures:
+        fixture_id = fixture.get("fixture").get("id")
+        live_ids.add(fixture_id)
+
+        new_state = __extract_fixture_state(fixture)
+        old_state = __fixture_states.get(fixture_id)
+        __fixture_states[fixture_id] = new_state
+
+        if notify:
+            for event_text in __detect_events(old_state, new_state):
+                __notify_subscribers(fixture, event_text)
+
+    # Fixtures drop out of the live list once they finish, so look up their final result
+    finished_fixtures = []
+    # A fixture is only forgotten once its final state has been fetched and its notifications queued,
+    # so a failed lookup is retried on the next poll instead of losing the full time notification
+    for fixture_id in [f for f in __fixture_states if f not in live_ids]:
+        try:
+            fixture = sports_api.get_fixture(fixture_id)
+        except Exception as e:
+            logging.error(f"Unable to get final state of fixture {fixture_id}, retrying next poll: {e}")
+            continue
+        if fixture is None:
+            __fixture_states.pop(fixture_id)
+            continue
+
+        new_state = __extract_fixture_state(fixture)
+        if notify:
+            for event_text in __detect_events(__fixture_states.get(fixture_id), new_state):
+                __notify_subscribers(fixture, event_text)
+
+        finished_fixtures.append(fixture)
+        __fixture_states.pop(fixture_id)
+
+    notify_live_listeners(live_fixtures, finished_fixtures)
+
+# Call every live listener
+# Used by the poller, and to pass on the live fixtures polled by another process
+def notify_live_listeners(live_fixtures, finished_fixtures):
+    for callback in __live_listeners:
+        try:
+            callback(live_fixtures, finished_fixtures)
+        except Exception as e:
+            logging.error(f"Live fixtures listener failed: {e}")
+
+# Start the background thread that polls live fixtures every poll interval
+def start_live_poller():
+    def poll_loop():
+        # The first poll only records the current state, so games already in progress
+        # when the bot starts do not send duplicate kickoff or goal notifications
+        notify = False
+        while True:
+            try:
+                scheduler.run(scheduler.BACKGROUND, poll_live_fixtures, notify)
+                notify = True
+            except Exception as e:
+                logging.error(f"Error polling live fixtures: {e}")
+            time.sleep(__poll_interval)
+
+    poll_thread = threading.Thread(target=poll_loop, name="live-poller", daemon=True)
+    poll_thread.start()
+    return poll_thread
+
+# Extract the parts of a fixture that notifications are sent for
+# Red cards come from the fixture's events, listed in the order they happened
+def __extract_fixture_state(fixture):
+    return {
+        "status": fixture.get("fixture").get("status").get("short"),
+        "home_goals": fixture.get("goals").get("home") or 0,
+        "away_goals": fixture.get("goals").get("away") or 0,
+        "home_name": fixture.get("teams").get("home").get("name"),
+        "away_name": fixture.get("teams").get("away").get("name"),
+        "red_cards": [
+            [(event.get("team") or {}).get("name"), (event.get("player") or {}).get("name")]
+            for event in fixture.get("events") or []
+            if event.get("type") == "Card" and event.get("detail") in __red_card_details
+        ],
+    }
+
+# Compare two states of a fixture and describe the events that happened between them
+def __detect_events(old_state, new_state):
+    events = []
+    home_name = new_state.get("home_name")
+    away_name = new_state.get("away_name")
+    score = f"{away_name} {new_state.get('away_goals')} - {new_state.get('home_goals')} {home_name}"
+
+    # A fixture seen for the first time has just kicked off
+    if old_state is None or old_state.get("status") in ("TBD", "NS"):
+        if new_state.get("status") not in ("TBD", "NS"):
+            events.append(f":stopwatch: *Kickoff*: {away_name} at {home_name}")
+        old_state = {"home_goals": 0, "away_goals": 0, "red_cards": [], "status": new_state.get("status")}
+
+    if new_state.get("home_goals") > old_state.get("home_goals"):
+        events.append(f":soccer: *Goal for {home_name}!* {score}")
+    if new_state.get("away_goals") > old_state.get("away_goals"):
+        events.append(f":soccer: *Goal for {away_name}!* {score}")
+
+    # Events are only ever added to a fixture, so red cards after the ones already seen are new
+    for team_name, player_name in new_state.get("red_cards", [])[len(old_state.get("red_cards", [])):]:
+        events.append(f":red_circle: *Red Card* for {player_name or 'a player'} of {team_name}. {score}")
+
+    if new_state.get("status") in sports_api.finished_statuses and old_state.get("status") not in sports_api.finished_statuses:
+        events.append(f":checkered_flag: *Full Time*: {score}")
+
+    return events
+
+# Queue a notification for every conversation subscribed to either team in the fixture
+def __notify_subscribers(fixture, event_text):
+    subscriber_ids = set()
+    for side in ("home", "away"):
+        team_id = fixture.get("teams").get(side).get("id")
+        subscriber_ids.update(db.get_subscribers(team_id))
+
+    for subscriber_id in subscriber_ids:
+        slack_queue.enqueue(
+            "chat_postMessage",
+            channel=subscriber_id,
+            text=event_text,
+            blocks=[{
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": event_text
+                }
+            }])
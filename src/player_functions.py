@@ -0,0 +1,493 @@
+# player_functions.py
+# This class is responsible for player statistics
+# Players for a league's season are bulk loaded from the API's paginated players endpoint
+# into a local store indexed by team and by name, so player queries are served locally
+# instead of making an API call for every query
+# Loads run in the background as bulk work, with each page fetched as its own bulk task, and queries
+# keep being served from the previous store while it is reloaded
+# Loaded players are also put in the cache, so processes sharing it, such as prefork workers reading the
+# refresher's snapshot, build their store from that copy instead of loading the players themselves
+
+import os
+import json
+import time
+import threading
+import logging
+from concurrent.futures import Future
+
+import sports_api_functions as sports_api
+import cache_functions
+import scheduler_functions as scheduler
+
+# Maximum number of API requests per minute the player loader may use, to stay within the API quota
+__requests_per_minute = int(os.environ.get("PLAYER_INGEST_REQUESTS_PER_MINUTE", 30))
+
+# Number of seconds before a league's player store is reloaded
+__store_ttl = int(os.environ.get("PLAYER_STORE_TTL_SECONDS", 21600))
+
+# Number of times a page of players is requested before it is skipped
+__page_attempts = 3
+
+# Number of seconds after a failed load before the store is loaded again
+__retry_delay = 60
+
+# Number of seconds between checks for active leagues' player stores that need loading
+__preload_check_interval = 60
+
+# Key the loaded players are cached under, in a namespace of their own so data changes do not invalidate them
+__cache_key = "players"
+
+# Number of players shown in the top scorers list
+__top_scorers_limit = 10
+
+# Loaded player stores, keyed by league and season namespace
+__stores = {}
+__stores_lock = threading.Lock()
+
+# Namespaces whose players are being loaded, so only one load runs for each league at a time
+__loading = set()
+
+# Time of the last failed load of each namespace
+__failed_at = {}
+
+# Time the next upstream request may be made by the player loader
+__next_request_time = 0
+__quota_lock = threading.Lock()
+
+# Get the player store for a league's season
+# A newer copy of the players in the cache, loaded by another process, replaces this process's store.
+# A store that is missing or has expired is loaded in the background. The expired store is returned
+# in the meantime, and None is returned while a league's first load is running
+def get_player_store(league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    namespace = cache_functions.make_namespace(league_id, season)
+
+    cached_players = cache_functions.get_cache().get(__cache_namespace(namespace), __cache_key, allow_stale=True)
+    if cached_players is not None:
+        with __stores_lock:
+            store = __stores.get(namespace)
+            if store is None or store.get("loaded_at") < cached_players.get("loaded_at"):
+                __stores[namespace] = __build_store(cached_players.get("players"), cached_players.get("loaded_at"), cached_players.get("skipped_pages"))
+
+    refresh_player_store(league_id, season)
+
+    with __stores_lock:
+        return __stores.get(namespace)
+
+# Start loading a league's players in the background if its store is missing or has expired
+# Returns a Future for the load, or None if no load was started
+def refresh_player_store(league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    namespace = cache_functions.make_namespace(league_id, season)
+    now = time.time()
+
+    with __stores_lock:
+        store = __stores.get(namespace)
+        if store is not None and now - store.get("loaded_at") <= __store_ttl:
+            return None
+        if namespace in __loading or now - __failed_at.get(namespace, 0) < __retry_delay:
+            return None
+        __loading.add(namespace)
+
+    # The load's future is only resolved once its store is swapped in
+    loaded = Future()
+    load = load_players(league_id, season)
+    load.add_done_callback(lambda load: loaded.set_result(__swap_in_store(league_id, season, namespace, load)))
+    return loaded
+
+# Keep the active leagues' player stores loaded, so the first query for a league does not wait for a load
+def start_player_preloader():
+    def preload_loop():
+        while True:
+            for league_id in sports_api.get_active_league_ids():
+                try:
+                    refresh_player_store(league_id)
+                except Exception as e:
+                    logging.error(f"Error preloading players for league {league_id}: {e}")
+            time.sleep(__preload_check_interval)
+
+    preload_thread = threading.Thread(target=preload_loop, name="player-preloader", daemon=True)
+    preload_thread.start()
+    return preload_thread
+
+# Load every player in a league's season from the paginated players endpoint
+# The first page says how many pages there are, and the rest are each fetched as a bulk task of their own,
+# so the scheduler's bulk limit decides how many are fetched at the same time. Nothing waits on the pages,
+# as a task waiting on them would hold the bulk workers they need
+# Pages that still fail after being retried are skipped, so one bad page does not lose the whole load
+# Returns a Future holding the loaded store
+def load_players(league_id, season):
+    load = {"league_id": league_id, "season": season, "pages": {}, "remaining": 0, "lock": threading.Lock(), "future": Future()}
+    scheduler.submit(scheduler.BULK, __fetch_first_page, load)
+    return load.get("future")
+
+# Find players in a store by name
+# Full name matches are preferred, then players matching every word, then partial matches
+def find_players(store, player_name):
+    search_name = player_name.strip().lower()
+    words = search_name.split()
+    if not words:
+        return []
+
+    player_ids = store.get("by_name").get(search_name)
+    if not player_ids:
+        word_matches = [store.get("by_name").get(word, set()) for word in words]
+        player_ids = set.intersection(*word_matches)
+    if not player_ids:
+        player_ids = {p.get("id") for p in store.get("players").values() if search_name in p.get("name").lower()}
+
+    # Show the players who have played the most first
+    players = [store.get("players").get(player_id) for player_id in player_ids]
+    return sorted(players, key=lambda p: p.get("minutes") or 0, reverse=True)
+
+# Get the players with the most goals in a store
+def get_top_scorers(store, limit = __top_scorers_limit):
+    players = [p for p in store.get("players").values() if p.get("goals")]
+    return sorted(players, key=lambda p: (p.get("goals"), p.get("assists") or 0), reverse=True)[:limit]
+
+# Get the players on a team in a store
+def get_squad(store, team_id):
+    return [store.get("players").get(player_id) for player_id in store.get("by_team").get(team_id, [])]
+
+# Show the card for the player requested by the user
+def get_player_data(client, message, player_name, league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+
+    try:
+        store = get_player_store(league_id, season)
+        if store is None:
+            __post_loading(client, message, league_id, season)
+            return
+        players = find_players(store, player_name)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get player data. Please try again later.")
+        return
+
+    if not players:
+        __post_error(client, message, f"No player named {player_name} found in the {sports_api.get_league_name(league_id)} {season} season.")
+        return
+
+    # Show the closest match, and list any other players with the same name
+    player_card = __create_player_card_block(players[0])
+    if len(players) > 1:
+        other_players = ", ".join(f"{p.get('name')} ({p.get('team_name')})" for p in players[1:6])
+        player_card.append({
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f"Other matching players: {other_players}"}]
+        })
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text="Player Card",
+        blocks=json.dumps(player_card))
+
+# Show the league's top scorers
+def get_top_scorers_data(client, message, league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    league_name = sports_api.get_league_name(league_id)
+
+    try:
+        store = get_player_store(league_id, season)
+        if store is None:
+            __post_loading(client, message, league_id, season)
+            return
+        top_scorers = get_top_scorers(store)
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get top scorers. Please try again later.")
+        return
+
+    lines = []
+    for rank, player in enumerate(top_scorers, start=1):
+        lines.append(f"{rank}. *{player.get('name')}* ({player.get('team_name')}) - {player.get('goals')} goals, {player.get('assists') or 0} assists")
+
+    top_scorers_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{league_name} Top Scorers {season}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "\n".join(lines) or "No goals have been scored yet this season."
+            }
+        },
+    ]
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{league_name} Top Scorers",
+        blocks=json.dumps(top_scorers_card))
+
+# Show the squad of the team requested by the user, grouped by position
+def get_squad_data(client, message, team_name, league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+
+    try:
+        store = get_player_store(league_id, season)
+        if store is None:
+            __post_loading(client, message, league_id, season)
+            return
+        team_id = sports_api.get_team_id(team_name)
+        squad = get_squad(store, team_id) if team_id is not None else []
+    except Exception as e:
+        logging.error(e)
+        __post_error(client, message, "Unable to get squad. Please try again later.")
+        return
+
+    if not squad:
+        __post_error(client, message, f"No squad found for {team_name}. Please ensure you have provided a valid team name.")
+        return
+
+    squad_card = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"{team_name} Squad {season}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+
+    for position in ("Goalkeeper", "Defender", "Midfielder", "Attacker"):
+        players = sorted([p for p in squad if p.get("position") == position], key=lambda p: p.get("minutes") or 0, reverse=True)
+        if not players:
+            continue
+
+        player_lines = [f"{p.get('name')} - {p.get('appearances') or 0} apps, {p.get('goals') or 0} goals" for p in players]
+        squad_card.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{position}s*\n" + "\n".join(player_lines)
+            }
+        })
+
+    client.chat_postMessage(
+        channel=message["channel"],
+        text=f"{team_name} Squad",
+        blocks=json.dumps(squad_card))
+
+# Swap in a league's loaded player store, keeping the previous store if the load failed
+def __swap_in_store(league_id, season, namespace, load):
+    try:
+        store = load.result()
+        with __stores_lock:
+            __stores[namespace] = store
+            __failed_at.pop(namespace, None)
+
+        # Kept until it is replaced, as other processes keep serving it while the next load runs
+        cached_players = {"players": list(store.get("players").values()), "loaded_at": store.get("loaded_at"), "skipped_pages": store.get("skipped_pages")}
+        cache_functions.get_cache().set(__cache_namespace(namespace), __cache_key, cached_players)
+        return store
+    except Exception as e:
+        logging.error(f"Error loading players for league {league_id} season {season}: {e}")
+        with __stores_lock:
+            __failed_at[namespace] = time.time()
+    finally:
+        with __stores_lock:
+            __loading.discard(namespace)
+
+# Fetch the first page of a load, and queue the fetch of every other page
+def __fetch_first_page(load):
+    league_id = load.get("league_id")
+    try:
+        first_page = __fetch_page(league_id, load.get("season"), 1)
+        if first_page is None:
+            raise RuntimeError(f"Unable to load the first page of players for league {league_id}")
+
+        total_pages = first_page.get("paging", {}).get("total", 1)
+        load["pages"][1] = first_page
+        load["remaining"] = total_pages - 1
+    except Exception as e:
+        load.get("future").set_exception(e)
+        return
+
+    if total_pages <= 1:
+        __finish_load(load)
+    for page in range(2, total_pages + 1):
+        scheduler.submit(scheduler.BULK, __fetch_next_page, load, page)
+
+# Fetch one of the other pages of a load, finishing the load once every page has been fetched
+def __fetch_next_page(load, page):
+    page_dict = None
+    try:
+        page_dict = __fetch_page(load.get("league_id"), load.get("season"), page)
+    finally:
+        with load.get("lock"):
+            load["pages"][page] = page_dict
+            load["remaining"] -= 1
+            finished = load.get("remaining") == 0
+        if finished:
+            __finish_load(load)
+
+# Build the store from a load's pages in page order, skipping the pages that failed
+def __finish_load(load):
+    league_id = load.get("league_id")
+    try:
+        pages = [load.get("pages").get(page) for page in sorted(load.get("pages"))]
+        player_list = [__extract_player_data(player_entry, league_id) for page in pages if page is not None for player_entry in page.get("response") or []]
+        store = __build_store(player_list, time.time(), pages.count(None))
+    except Exception as e:
+        load.get("future").set_exception(e)
+        return
+
+    logging.info(f"Loaded {len(store.get('players'))} players for league {league_id} season {load.get('season')}, skipped {store.get('skipped_pages')} pages")
+    load.get("future").set_result(store)
+
+# Get one page of players, retrying it if it fails. Returns None if every attempt failed
+def __fetch_page(league_id, season, page):
+    for attempt in range(__page_attempts):
+        __wait_for_quota()
+        try:
+            page_dict = sports_api.get_players_page(league_id, season, page)
+            if not page_dict.get("errors"):
+                return page_dict
+            error = page_dict.get("errors")
+        except Exception as e:
+            error = e
+        logging.error(f"Error loading page {page} of players for league {league_id}, attempt {attempt + 1} of {__page_attempts}: {error}")
+    return None
+
+# Build a player store, indexing the players by team and by name
+def __build_store(player_list, loaded_at, skipped_pages):
+    store = {"players": {}, "by_team": {}, "by_name": {}, "loaded_at": loaded_at, "skipped_pages": skipped_pages}
+    for player_data in player_list:
+        __add_player(store, player_data)
+    return store
+
+# Get the cache namespace the loaded players of a league's season are kept in
+def __cache_namespace(namespace):
+    return f"players:{namespace}"
+
+# Add a player to a store and its team and name indexes
+# A player listed on more than one page is only added the first time, so they are not in their team twice
+def __add_player(store, player_data):
+    player_id = player_data.get("id")
+    if player_id in store.get("players"):
+        return
+    store.get("players")[player_id] = player_data
+
+    store.get("by_team").setdefault(player_data.get("team_id"), []).append(player_id)
+
+    by_name = store.get("by_name")
+    names = {player_data.get("name").lower()}
+    names.update(player_data.get("name").lower().split())
+    names.update(player_data.get("full_name").lower().split())
+    for name in names:
+        by_name.setdefault(name, set()).add(player_id)
+
+# Wait until the player loader may make another upstream request
+def __wait_for_quota():
+    global __next_request_time
+
+    with __quota_lock:
+        now = time.time()
+        wait_time = __next_request_time - now
+        __next_request_time = max(now, __next_request_time) + 60 / __requests_per_minute
+
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+# Extract player data and return dict with extracted data
+# A player's statistics are listed per team, so use the first entry for this league
+def __extract_player_data(player_entry, league_id):
+    player = player_entry.get("player")
+    statistics = player_entry.get("statistics") or [{}]
+    league_statistics = [stats for stats in statistics if (stats.get("league") or {}).get("id") == league_id]
+    stats = (league_statistics or statistics)[0]
+
+    team = stats.get("team") or {}
+    games = stats.get("games") or {}
+    goals = stats.get("goals") or {}
+    cards = stats.get("cards") or {}
+
+    player_data = {
+        "id" : player.get("id"),
+        "name" : player.get("name") or "",
+        "full_name" : f"{player.get('firstname') or ''} {player.get('lastname') or ''}".strip(),
+        "age" : player.get("age"),
+        "nationality" : player.get("nationality"),
+        "photo_url" : player.get("photo"),
+        "team_id" : team.get("id"),
+        "team_name" : team.get("name"),
+        "position" : games.get("position"),
+        "appearances" : games.get("appearences"),
+        "minutes" : games.get("minutes"),
+        "rating" : games.get("rating"),
+        "goals" : goals.get("total"),
+        "assists" : goals.get("assists"),
+        "yellow_cards" : cards.get("yellow"),
+        "red_cards" : cards.get("red"),
+    }
+    return player_data
+
+# Create set of blocks representing a player
+def __create_player_card_block(player_data):
+    rating = player_data.get("rating")
+    rating = f"{float(rating):.2f}" if rating else "N/A"
+
+    player_card = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{player_data.get('name')}* - {player_data.get('team_name')}\n"
+                    + f"*Position*: {player_data.get('position')} | *Age*: {player_data.get('age')} | *Nationality*: {player_data.get('nationality')}"
+            },
+            "accessory": {
+                "type": "image",
+                "image_url": f"{player_data.get('photo_url')}",
+                "alt_text": "Player Photo"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Appearances*: {player_data.get('appearances') or 0} | *Minutes*: {player_data.get('minutes') or 0} | *Rating*: {rating}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Goals*: {player_data.get('goals') or 0} | *Assists*: {player_data.get('assists') or 0} | *Yellow Cards*: {player_data.get('yellow_cards') or 0} | *Red Cards*: {player_data.get('red_cards') or 0}"
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+    return player_card
+
+# Let the user know a league's players are still being loaded
+def __post_loading(client, message, league_id, season):
+    __post_error(client, message, f"Players for the {sports_api.get_league_name(league_id)} {season} season are still being loaded. Please try again in a minute.")
+
+# Let the user know their player command could not be completed
+def __post_error(client, message, error_text):
+    client.chat_postMessage(
+        channel=message["channel"],
+        text="Error Getting Player Data",
+        blocks=[{
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": error_text,
+                "emoji": False
+            }
+        }])
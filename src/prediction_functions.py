@@ -0,0 +1,240 @@
+# prediction_functions.py
+# This class is responsible for predicting the winners of upcoming fixtures
+# A Poisson model of each team's attack and defense strength is fitted on the season's results,
+# and every upcoming fixture is scored in one vectorized batch whenever new results arrive,
+# instead of making one predictions API call per displayed fixture
+# Run this file with "evaluate" to compare the model against the API's predictions
+
+import os
+import sys
+import json
+import threading
+import logging
+
+import numpy as np
+
+import sports_api_functions as sports_api
+import analytics_functions as analytics
+import cache_functions
+
+# Where predictions come from first: "local" uses the model and falls back to the API,
+# "upstream" uses the API and falls back to the model
+prediction_source = os.environ.get("PREDICTION_SOURCE", "local")
+
+# Number of average games each team's strengths are shrunk towards, so early season strengths are not extreme
+__prior_games = 5
+
+# Highest number of goals per team considered when scoring a fixture
+__max_goals = 10
+
+# Scored fixtures for each league's season, keyed by namespace
+# Each entry holds the signature of the results the model was fitted on and the predictions by fixture ID
+__predictions = {}
+__predictions_lock = threading.Lock()
+
+# Fit attack and defense strengths for every team on a season's fixture columns
+# Returns a dict with the team IDs, their home and away strengths, and the league's average goals
+def fit_model(columns, team_ids = None):
+    home_id = columns["home_id"]
+    away_id = columns["away_id"]
+    home_goals = columns["home_goals"].astype(np.float64)
+    away_goals = columns["away_goals"].astype(np.float64)
+
+    if team_ids is None:
+        team_ids = np.unique(np.concatenate((home_id, away_id)))
+    team_count = len(team_ids)
+
+    # Average goals per game for home and away teams across the league
+    game_count = len(home_id)
+    home_average = home_goals.mean() if game_count else 1.5
+    away_average = away_goals.mean() if game_count else 1.2
+
+    home_index = np.searchsorted(team_ids, home_id)
+    away_index = np.searchsorted(team_ids, away_id)
+
+    home_games = np.bincount(home_index, minlength=team_count)
+    away_games = np.bincount(away_index, minlength=team_count)
+
+    # Strength is goals relative to the league average, shrunk towards 1 by the prior games
+    def strength(goals, games, average):
+        return (goals + __prior_games * average) / ((games + __prior_games) * average)
+
+    model = {
+        "team_ids": team_ids,
+        "home_average": home_average,
+        "away_average": away_average,
+        "home_attack": strength(np.bincount(home_index, weights=home_goals, minlength=team_count), home_games, home_average),
+        "home_defense": strength(np.bincount(home_index, weights=away_goals, minlength=team_count), home_games, away_average),
+        "away_attack": strength(np.bincount(away_index, weights=away_goals, minlength=team_count), away_games, away_average),
+        "away_defense": strength(np.bincount(away_index, weights=home_goals, minlength=team_count), away_games, home_average),
+    }
+    return model
+
+# Score a batch of fixtures, given as arrays of home and away team IDs
+# Returns arrays of home win, draw, and away win probabilities
+def score_fixtures(model, home_ids, away_ids):
+    team_ids = model["team_ids"]
+    home_index = np.searchsorted(team_ids, home_ids)
+    away_index = np.searchsorted(team_ids, away_ids)
+
+    # Expected goals for each side of every fixture
+    home_expected = model["home_attack"][home_index] * model["away_defense"][away_index] * model["home_average"]
+    away_expected = model["away_attack"][away_index] * model["home_defense"][home_index] * model["away_average"]
+
+    # Probability of each number of goals for each side, one row per fixture
+    goals = np.arange(__max_goals + 1)
+    factorials = np.cumprod(np.concatenate(([1], goals[1:]))).astype(np.float64)
+    home_probabilities = np.exp(-home_expected)[:, None] * home_expected[:, None] ** goals / factorials
+    away_probabilities = np.exp(-away_expected)[:, None] * away_expected[:, None] ** goals / factorials
+
+    # Probability of every scoreline, with home goals on the rows and away goals on the columns
+    scorelines = home_probabilities[:, :, None] * away_probabilities[:, None, :]
+    home_win = np.tril(np.ones((__max_goals + 1, __max_goals + 1)), -1)
+    away_win = np.triu(np.ones((__max_goals + 1, __max_goals + 1)), 1)
+
+    home_win_probability = (scorelines * home_win).sum(axis=(1, 2))
+    draw_probability = np.trace(scorelines, axis1=1, axis2=2)
+    away_win_probability = (scorelines * away_win).sum(axis=(1, 2))
+
+    # Normalize for the scorelines above the goal limit that were left out
+    total = home_win_probability + draw_probability + away_win_probability
+    return home_win_probability / total, draw_probability / total, away_win_probability / total
+
+# Get the predictions for every upcoming fixture in a league's season
+# The model is only refitted, and the fixtures rescored, when new results have arrived
+def get_season_predictions(league_id = None, season = None):
+    league_id, season = sports_api.resolve_league_season(league_id, season)
+    namespace = cache_functions.make_namespace(league_id, season)
+
+    season_analytics = analytics.get_season_analytics(league_id, season)
+    upcoming_fixtures = sports_api.get_upcoming_fixtures(league_id, season) or []
+    signature = (season_analytics.get("signature"), len(upcoming_fixtures))
+
+    with __predictions_lock:
+        season_predictions = __predictions.get(namespace)
+        if season_predictions is not None and season_predictions.get("signature") == signature:
+            return season_predictions.get("predictions")
+
+    fixture_predictions = predict_fixtures(season_analytics.get("columns"), upcoming_fixtures)
+
+    with __predictions_lock:
+        __predictions[namespace] = {"signature": signature, "predictions": fixture_predictions}
+    return fixture_predictions
+
+# Fit the model on the given fixture columns and score a list of fixtures from the API in one batch
+# Returns a dict of fixture ID to prediction, in the same format as the API's predictions
+def predict_fixtures(columns, fixtures):
+    if not fixtures:
+        return {}
+
+    home_ids = np.array([f.get("teams").get("home").get("id") for f in fixtures])
+    away_ids = np.array([f.get("teams").get("away").get("id") for f in fixtures])
+
+    # Teams without results yet, such as newly promoted teams, get average strengths
+    team_ids = np.unique(np.concatenate((columns["home_id"], columns["away_id"], home_ids, away_ids)))
+    model = fit_model(columns, team_ids)
+    home_win, draw, away_win = score_fixtures(model, home_ids, away_ids)
+
+    fixture_predictions = {}
+    for i, fixture in enumerate(fixtures):
+        outcome = int(np.argmax((home_win[i], draw[i], away_win[i])))
+        winner = None if outcome == 1 else fixture.get("teams").get("home" if outcome == 0 else "away")
+
+        fixture_predictions[fixture.get("fixture").get("id")] = {
+            "predictions": {
+                "winner": {
+                    "id": winner.get("id") if winner else None,
+                    "name": winner.get("name") if winner else "Draw",
+                },
+                "percent": {
+                    "home": f"{home_win[i]:.0%}",
+                    "draw": f"{draw[i]:.0%}",
+                    "away": f"{away_win[i]:.0%}",
+                },
+            },
+        }
+    return fixture_predictions
+
+# Get the local prediction for an upcoming fixture, or None if the model cannot make one
+def get_local_prediction(fixture_id, league_id = None, season = None):
+    try:
+        return get_season_predictions(league_id, season).get(fixture_id)
+    except Exception as e:
+        logging.error(f"Error making local prediction: {e}")
+        return None
+
+# Compare the model against the API's predictions on a season's finished fixtures
+# Each fixture is predicted by a model fitted only on the results before it was played.
+# The API's predictions are requested for the last sample_size fixtures, which uses that many API calls
+# A saved season can be evaluated instead by passing its fixtures and the API's predictions by fixture ID
+def evaluate_predictions(league_id = None, season = None, sample_size = 20, fixtures = None, upstream_predictions = None):
+    if fixtures is None:
+        league_id, season = sports_api.resolve_league_season(league_id, season)
+        fixtures = sports_api.get_finished_fixtures(league_id, season) or []
+    columns = analytics.build_fixture_columns(fixtures)
+
+    # Outcome of each finished fixture: 0 for a home win, 1 for a draw, 2 for an away win
+    goal_difference = columns["home_goals"].astype(np.int32) - columns["away_goals"]
+    outcomes = np.select([goal_difference > 0, goal_difference == 0], [0, 1], 2)
+
+    local_correct = 0
+    local_log_loss = 0.0
+    upstream_correct = 0
+    upstream_count = 0
+    evaluated_count = 0
+
+    sample_start = max(len(fixtures) - sample_size, 0)
+    for i in range(sample_start, len(fixtures)):
+        # Fit only on fixtures played before this one
+        earlier = columns["timestamp"] < columns["timestamp"][i]
+        earlier_columns = {name: values[earlier] for name, values in columns.items() if name != "team_names"}
+        team_ids = np.unique(np.concatenate((columns["home_id"], columns["away_id"])))
+        model = fit_model(earlier_columns, team_ids)
+        probabilities = np.array([p[0] for p in score_fixtures(model, columns["home_id"][i:i + 1], columns["away_id"][i:i + 1])])
+
+        evaluated_count += 1
+        local_correct += int(np.argmax(probabilities) == outcomes[i])
+        local_log_loss -= np.log(max(probabilities[outcomes[i]], 1e-12))
+
+        try:
+            if upstream_predictions is not None:
+                upstream_prediction = upstream_predictions.get(str(columns["fixture_id"][i]))
+            else:
+                upstream_prediction = sports_api.get_upstream_prediction(int(columns["fixture_id"][i]), league_id, season)
+            percent = upstream_prediction.get("predictions").get("percent")
+            upstream_probabilities = [float(percent.get(side).strip("%")) for side in ("home", "draw", "away")]
+            upstream_correct += int(np.argmax(upstream_probabilities) == outcomes[i])
+            upstream_count += 1
+        except Exception as e:
+            logging.error(f"Unable to get upstream prediction for fixture {columns['fixture_id'][i]}: {e}")
+
+    evaluation = {
+        "fixtures": evaluated_count,
+        "local_accuracy": local_correct / evaluated_count if evaluated_count else None,
+        "local_log_loss": float(local_log_loss / evaluated_count) if evaluated_count else None,
+        "upstream_fixtures": upstream_count,
+        "upstream_accuracy": upstream_correct / upstream_count if upstream_count else None,
+    }
+    return evaluation
+
+# Run the offline evaluation, e.g. "python prediction_functions.py evaluate epl 2023 50"
+# or on a saved season, e.g. "python prediction_functions.py evaluate-file season.json 20"
+# A saved season is a JSON object with the finished "fixtures" and the API's "predictions" keyed by fixture ID
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "evaluate-file":
+        with open(sys.argv[2]) as season_file:
+            saved_season = json.load(season_file)
+        sample_size = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        evaluation = evaluate_predictions(sample_size=sample_size, fixtures=saved_season.get("fixtures"), upstream_predictions=saved_season.get("predictions", {}))
+    elif len(sys.argv) > 1 and sys.argv[1] == "evaluate":
+        league_id = sports_api.get_league_id(sys.argv[2]) if len(sys.argv) > 2 else None
+        season = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        sample_size = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+        evaluation = evaluate_predictions(league_id, season, sample_size)
+    else:
+        print("Usage: python prediction_functions.py evaluate [league] [season] [sample_size]")
+        print("       python prediction_functions.py evaluate-file <saved season file> [sample_size]")
+        sys.exit(1)
+
+    for name, value in evaluation.items():
+        print(f"{name}: {value}")
@@ -0,0 +1,337 @@
+# prefork_functions.py
+# This class is responsible for running the bot as several processes
+# A supervisor process forks one refresher process and several worker processes, and restarts any that exit.
+# The refresher is the only process that calls the football API in the background: it prefetches league data,
+# loads the active leagues' players, and checks the standings. After each refresh it publishes the cached data,
+# including the loaded players and standings adjustments, as an immutable, versioned snapshot file, replacing
+# the previous version atomically.
+# Workers serve Slack events. They map the snapshot into memory, so the encoded data is held once in the
+# page cache for every worker. Sharing is only at that level: each worker decodes the values it reads and keeps
+# its own decoded copy of them until it swaps to the next version.
+# Data changes and live fixtures found by the refresher are recorded in the snapshot and passed on to
+# each worker's listeners when it swaps to the new version
+
+import os
+import sys
+import mmap
+import json
+import time
+import struct
+import signal
+import threading
+import logging
+import multiprocessing
+
+import cache_functions
+import sports_api_functions as sports_api
+import notification_functions as notifications
+
+# Path of the shared snapshot file
+__snapshot_path = os.environ.get("SHARED_SNAPSHOT_PATH", "shared_snapshot.bin")
+
+# Longest number of seconds between published versions. A version is also published soon after any data changes
+__publish_interval = int(os.environ.get("SHARED_SNAPSHOT_INTERVAL_SECONDS", 60))
+
+# Number of seconds between checks for a new version, by the refresher for changes to publish and by workers for a new file
+__check_interval = float(os.environ.get("SHARED_SNAPSHOT_CHECK_SECONDS", 1))
+
+# Number of recent data changes kept in each version, so workers that skipped a version still see its changes
+__max_changes = 50
+
+# Snapshot file layout: a header holding the format marker, the version, and the length of the index,
+# then the JSON index, then the JSON encoded values the index points into
+snapshot_marker = b"SBSNAP01"
+header_format = "<8sQQ"
+
+# Signals that stop the supervisor, which then stops every process it started
+__stop_signals = (signal.SIGTERM, signal.SIGINT)
+
+# Number of seconds a process must run for its exit to not count as a crash
+__min_uptime = 10
+
+# Longest number of seconds to wait before restarting a process that keeps crashing
+__max_restart_delay = 60
+
+# Data changes and live fixtures recorded by the refresher since it started, waiting to be published
+__pending_changes = []
+__pending_live = None
+__pending_lock = threading.Lock()
+__pending_dirty = False
+
+# Version of the live fixtures last passed on to this worker's listeners
+__last_live_version = 0
+
+# Immutable version of the shared data, read from a memory mapped snapshot file
+class SharedSnapshot:
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            self.buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_size = struct.calcsize(header_format)
+        marker, self.version, index_length = struct.unpack_from(header_format, self.buffer)
+        if marker != snapshot_marker:
+            raise ValueError(f"{path} is not a shared snapshot")
+
+        index = json.loads(self.buffer[header_size:header_size + index_length])
+        self.published_at = index.get("published_at")
+        self.changes = index.get("changes")
+        self.live = index.get("live")
+        self.entries = index.get("entries")
+        self.data_offset = header_size + index_length
+
+        # Values are decoded the first time they are read, and then shared by every request in this process.
+        # Other workers decode their own copies
+        self.decoded = {}
+
+    # Get a value from the snapshot, or None if it is not in the snapshot or has expired
+    def get(self, namespace, key, allow_stale=False):
+        location = self.entries.get(namespace, {}).get(key)
+        if location is None:
+            return None
+
+        offset, length, expires_at = location
+        if not allow_stale and expires_at is not None and expires_at < time.time():
+            return None
+
+        value = self.decoded.get((namespace, key))
+        if value is None:
+            start = self.data_offset + offset
+            value = json.loads(self.buffer[start:start + length])
+            self.decoded[(namespace, key)] = value
+        return value
+
+# Cache used by worker processes. Values in the shared snapshot are read from it, and anything the
+# worker requests itself, such as per-team fixtures, is kept in the worker's own cache
+class SnapshotCacheBackend(cache_functions.CacheBackend):
+    def __init__(self, local_cache):
+        super().__init__()
+        self.local_cache = local_cache
+        self.snapshot = None
+
+    def get(self, namespace, key, allow_stale=False):
+        snapshot = self.snapshot
+        if snapshot is not None:
+            value = snapshot.get(namespace, key, allow_stale)
+            if value is not None:
+                return value
+        return self.local_cache.get(namespace, key, allow_stale)
+
+    def set(self, namespace, key, value, ttl=None):
+        self.local_cache.set(namespace, key, value, ttl)
+
+    def invalidate(self, namespace):
+        self.local_cache.invalidate(namespace)
+
+    def acquire_lock(self, name, ttl):
+        return self.local_cache.acquire_lock(name, ttl)
+
+    def export_entries(self):
+        return self.local_cache.export_entries()
+
+    def add_invalidation_listener(self, callback):
+        self.local_cache.add_invalidation_listener(callback)
+
+    # Switch to a newer version of the shared data. Requests already reading the previous version finish with it
+    def swap(self, snapshot):
+        self.snapshot = snapshot
+
+# Write a version of the shared data, replacing the previous version atomically
+# Workers that still have the previous version mapped keep reading it until they swap
+def publish_snapshot(version, entries, changes, live, path = None):
+    path = path or __snapshot_path
+
+    data = bytearray()
+    index_entries = {}
+    for namespace, key, value, expires_at in entries:
+        encoded = json.dumps(value, separators=(",", ":")).encode()
+        index_entries.setdefault(namespace, {})[key] = [len(data), len(encoded), expires_at]
+        data.extend(encoded)
+
+    index = {
+        "published_at": time.time(),
+        "changes": changes,
+        "live": live,
+        "entries": index_entries,
+    }
+    encoded_index = json.dumps(index, separators=(",", ":")).encode()
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(struct.pack(header_format, snapshot_marker, version, len(encoded_index)))
+        snapshot_file.write(encoded_index)
+        snapshot_file.write(data)
+    os.replace(temp_path, path)
+
+# Start publishing the refresher's cache, data changes, and live fixtures for the workers
+def start_snapshot_publisher():
+    sports_api.add_data_change_listener(__record_data_change)
+    notifications.add_live_listener(__record_live_fixtures)
+
+    def publish_loop():
+        global __pending_dirty
+
+        # Versions are based on the time, so they keep increasing when the refresher restarts
+        version = 0
+        last_published = 0
+        while True:
+            with __pending_lock:
+                dirty = __pending_dirty
+
+            if dirty or time.time() - last_published >= __publish_interval:
+                version = max(version + 1, int(time.time() * 1000))
+                with __pending_lock:
+                    changes = [dict(change, version=change.get("version") or version) for change in __pending_changes]
+                    __pending_changes[:] = changes
+                    live = dict(__pending_live, version=__pending_live.get("version") or version) if __pending_live else None
+                    if live:
+                        __pending_live.update(version=live.get("version"))
+                    __pending_dirty = False
+
+                try:
+                    publish_snapshot(version, cache_functions.get_cache().export_entries(), changes, live)
+                    last_published = time.time()
+                except Exception as e:
+                    logging.error(f"Error publishing shared snapshot: {e}")
+
+            time.sleep(__check_interval)
+
+    publish_thread = threading.Thread(target=publish_loop, name="snapshot-publisher", daemon=True)
+    publish_thread.start()
+    return publish_thread
+
+# Read the shared data from the snapshot in this worker, swapping to each new version as it is published
+def start_snapshot_reader():
+    backend = SnapshotCacheBackend(cache_functions.create_cache())
+    cache_functions.set_cache(backend)
+
+    def read_loop():
+        file_id = None
+        while True:
+            try:
+                stat = os.stat(__snapshot_path)
+                if (stat.st_ino, stat.st_mtime_ns) != file_id:
+                    file_id = (stat.st_ino, stat.st_mtime_ns)
+                    __swap_snapshot(backend, SharedSnapshot(__snapshot_path))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"Error reading shared snapshot: {e}")
+            time.sleep(__check_interval)
+
+    read_thread = threading.Thread(target=read_loop, name="snapshot-reader", daemon=True)
+    read_thread.start()
+    return read_thread
+
+# Fork the refresher and worker processes, and restart any that exit until the supervisor is stopped
+# run_refresher and run_worker are the functions each process runs, and should not return
+# A process that exits soon after starting waits longer before each restart, so a crash loop does not keep forking
+def run_prefork(worker_count, run_refresher, run_worker):
+    # Fork is used so workers share the loaded code with the supervisor. Nothing may start threads before this
+    context = multiprocessing.get_context("fork")
+    targets = {"refresher": run_refresher}
+    targets.update({f"worker-{i + 1}": run_worker for i in range(worker_count)})
+    processes = {}
+    started_at = {}
+    restart_delays = {name: 0 for name in targets}
+    restart_at = {}
+
+    def start_process(name):
+        # Stop signals are held back while forking, so a new process never runs the supervisor's handler
+        signal.pthread_sigmask(signal.SIG_BLOCK, __stop_signals)
+        try:
+            process = context.Process(target=__run_process, args=(targets.get(name),), name=name)
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, __stop_signals)
+        processes[name] = process
+        started_at[name] = time.time()
+        logging.info(f"Started {name} with PID {process.pid}")
+
+    def stop(signum, frame):
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(10)
+        sys.exit(0)
+
+    for name in targets:
+        start_process(name)
+
+    # Only the supervisor stops the other processes
+    for signum in __stop_signals:
+        signal.signal(signum, stop)
+
+    while True:
+        now = time.time()
+        for name, process in list(processes.items()):
+            if process.is_alive():
+                continue
+
+            if name not in restart_at:
+                if now - started_at.get(name) < __min_uptime:
+                    restart_delays[name] = min(max(restart_delays.get(name) * 2, 1), __max_restart_delay)
+                else:
+                    restart_delays[name] = 0
+                restart_at[name] = now + restart_delays.get(name)
+                logging.error(f"{name} exited with code {process.exitcode}, restarting it in {restart_delays.get(name)}s")
+
+            if now >= restart_at.get(name):
+                del restart_at[name]
+                start_process(name)
+        time.sleep(1)
+
+# Run a forked process's function
+# The stop signals are set back to their default handling, so the process stops as soon as it gets one
+def __run_process(target):
+    for signum in __stop_signals:
+        signal.signal(signum, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, __stop_signals)
+    target()
+
+# Swap a worker to a new version, then pass on the data changes and live fixtures it has not seen yet
+# Nothing is passed on for the first version a worker reads, as it has nothing to update yet
+def __swap_snapshot(backend, snapshot):
+    global __last_live_version
+
+    previous = backend.snapshot
+    if previous is not None and snapshot.version <= previous.version:
+        return
+    backend.swap(snapshot)
+
+    live = snapshot.live
+    if previous is None:
+        __last_live_version = live.get("version") if live else 0
+        return
+
+    for change in snapshot.changes:
+        if change.get("version") > previous.version:
+            # Drop data this worker cached itself for the league's season, as the prefetcher does
+            backend.invalidate(cache_functions.make_namespace(change.get("league_id"), change.get("season")))
+            sports_api.notify_data_change(change.get("league_id"), change.get("season"), change.get("standings_changed"), set(change.get("changed_team_ids")))
+
+    if live and live.get("version") > __last_live_version:
+        __last_live_version = live.get("version")
+        notifications.notify_live_listeners(live.get("live_fixtures"), live.get("finished_fixtures"))
+
+# Record a data change found by the refresher's prefetcher, to be published with the next version
+def __record_data_change(league_id, season, standings_changed, changed_team_ids):
+    global __pending_dirty
+
+    with __pending_lock:
+        __pending_changes.append({
+            "version": None,
+            "league_id": league_id,
+            "season": season,
+            "standings_changed": standings_changed,
+            "changed_team_ids": sorted(changed_team_ids),
+        })
+        del __pending_changes[:-__max_changes]
+        __pending_dirty = True
+
+# Record the live fixtures from the refresher's poll, to be published with the next version
+def __record_live_fixtures(live_fixtures, finished_fixtures):
+    global __pending_live, __pending_dirty
+
+    with __pending_lock:
+        __pending_live = {"version": None, "live_fixtures": live_fixtures, "finished_fixtures": finished_fixtures}
+        __pending_dirty = True
@@ -0,0 +1,203 @@
+# profiling_functions.py
+# This class is responsible for profiling the running bot on demand
+# For a bounded window, a stack sampler records what every thread is doing, weighted by the CPU time
+# it uses, and tracemalloc records where memory is allocated. The samples are written as collapsed stacks that
+# flamegraph tools can read, along with the top allocation sites in the bot's own code
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+
+# Longest profiling window allowed, in seconds
+max_duration = int(os.environ.get("PROFILE_MAX_SECONDS", 120))
+
+# Number of seconds between stack samples
+__sample_interval = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_SECONDS", 0.01))
+
+# Directory the profile output files are written to
+__output_dir = os.environ.get("PROFILE_OUTPUT_DIR", "profiles")
+
+# Number of allocation sites and functions listed in the summary
+__top_count = 15
+
+# Number of frames tracemalloc keeps for each allocation, so allocations can be traced back to the bot's code
+__traceback_frames = 25
+
+# Directory holding the bot's source files, used to attribute samples and allocations to the bot's functions
+__source_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Standard library functions a thread is idle in when they are its innermost Python frame,
+# used where threads' CPU clocks cannot be read
+__idle_functions = {("threading.py", "wait"), ("queue.py", "get"), ("selectors.py", "select")}
+
+__profiling_lock = threading.Lock()
+__profiling = False
+
+# Start profiling the process for the given number of seconds
+# When the window ends, on_complete is called with a text summary and the paths of the output files
+# Returns False if a profile is already running
+def start_profiling(duration, on_complete):
+    global __profiling
+
+    duration = max(1, min(int(duration), max_duration))
+    with __profiling_lock:
+        if __profiling:
+            return False
+        __profiling = True
+
+    profile_thread = threading.Thread(target=__run_profile, args=(duration, on_complete), name="profiler", daemon=True)
+    profile_thread.start()
+    return True
+
+# Check whether a profile is running
+def is_profiling():
+    return __profiling
+
+# Sample stacks for the profiling window, then write the output files and report the summary
+def __run_profile(duration, on_complete):
+    global __profiling
+
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(__traceback_frames)
+
+    try:
+        stack_counts = __sample_stacks(duration)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        with __profiling_lock:
+            __profiling = False
+
+    try:
+        os.makedirs(__output_dir, exist_ok=True)
+        file_prefix = os.path.join(__output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+
+        # Collapsed stacks, one "frame;frame;frame count" line per distinct stack
+        folded_path = f"{file_prefix}.folded"
+        with open(folded_path, "w") as folded_file:
+            for stack, count in stack_counts.most_common():
+                folded_file.write(f"{stack} {count}\n")
+
+        allocation_sites = __get_allocation_sites(snapshot)
+        allocations_path = f"{file_prefix}-allocations.txt"
+        with open(allocations_path, "w") as allocations_file:
+            for site, size, count in allocation_sites:
+                allocations_file.write(f"{size / 1024:.1f} KiB in {count} blocks: {site}\n")
+
+        summary = __build_summary(duration, stack_counts, allocation_sites)
+        on_complete(summary, [folded_path, allocations_path])
+    except Exception as e:
+        logging.error(f"Error writing profile: {e}")
+
+# Sample the stack of every thread except the profiler's own until the window ends
+# Each sample is weighted by the CPU time the thread used since its last sample, so threads that are idle,
+# such as the background loops sleeping between runs and workers waiting for tasks, do not fill the profile
+# Returns a Counter of collapsed stacks to their weight in microseconds
+def __sample_stacks(duration):
+    stack_counts = Counter()
+    profiler_thread_id = threading.get_ident()
+    thread_names = {}
+    cpu_times = {}
+    end_time = time.time() + duration
+
+    while time.time() < end_time:
+        if len(thread_names) != threading.active_count():
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == profiler_thread_id:
+                continue
+
+            weight = __get_sample_weight(thread_id, frame, cpu_times)
+            if not weight:
+                continue
+
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            # Collapsed stacks list the outermost frame first, starting with the thread
+            frames.append(thread_names.get(thread_id, str(thread_id)))
+            stack_counts[";".join(reversed(frames))] += weight
+
+        time.sleep(__sample_interval)
+
+    return stack_counts
+
+# Get the weight of a thread's sample in microseconds, or 0 if the thread was idle
+# Where threads' CPU clocks can be read, this is the CPU time the thread used since its last sample.
+# Elsewhere, threads waiting on a lock, condition, queue, or socket selector are idle, and other threads
+# are counted as busy for the whole sample interval
+def __get_sample_weight(thread_id, frame, cpu_times):
+    if hasattr(time, "pthread_getcpuclockid"):
+        try:
+            cpu_time = time.clock_gettime_ns(time.pthread_getcpuclockid(thread_id))
+        except OSError:
+            # The thread exited after its frame was read
+            return 0
+
+        previous_cpu_time = cpu_times.get(thread_id, cpu_time)
+        cpu_times[thread_id] = cpu_time
+        return (cpu_time - previous_cpu_time) // 1000
+
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in __idle_functions:
+        return 0
+    return int(__sample_interval * 1000000)
+
+# Get the allocation sites in the bot's own code that hold the most memory
+# Each allocation is attributed to the innermost frame of its traceback that is in the bot's source files,
+# leaving out the profiler's own allocations
+# Returns a list of (site, size in bytes, number of blocks), largest first
+def __get_allocation_sites(snapshot):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(True, os.path.join(__source_dir, "*"), all_frames=True),
+        tracemalloc.Filter(False, os.path.abspath(__file__)),
+    ])
+
+    site_sizes = Counter()
+    site_counts = Counter()
+    for stat in snapshot.statistics("traceback"):
+        for frame in reversed(stat.traceback):
+            if frame.filename.startswith(__source_dir):
+                site = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                site_sizes[site] += stat.size
+                site_counts[site] += stat.count
+                break
+
+    return [(site, size, site_counts[site]) for site, size in site_sizes.most_common()]
+
+# Summarize the busiest functions in the bot's own code and the largest allocation sites
+def __build_summary(duration, stack_counts, allocation_sites):
+    total_weight = sum(stack_counts.values()) or 1
+
+    # A function is counted once per sample it appears anywhere in
+    function_counts = Counter()
+    source_files = {f for f in os.listdir(__source_dir) if f.endswith(".py")}
+    for stack, count in stack_counts.items():
+        functions = set()
+        for frame in stack.split(";"):
+            function, _, location = frame.rpartition(" (")
+            file_name = location.split(":")[0]
+            if file_name in source_files:
+                functions.add(f"{function} ({file_name})")
+
+        for function in functions:
+            function_counts[function] += count
+
+    lines = [f"*Profile of {duration}s* ({total_weight / 1000:.0f} ms of CPU time sampled)", "", "*Busiest bot functions* (share of CPU time)"]
+    for function, count in function_counts.most_common(__top_count):
+        lines.append(f"{count / total_weight:.1%} {function}")
+
+    lines.extend(["", "*Largest allocation sites in bot code*"])
+    for site, size, count in allocation_sites[:__top_count]:
+        lines.append(f"{size / 1024:.1f} KiB in {count} blocks: {site}")
+    return "\n".join(lines)
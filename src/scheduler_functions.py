@@ -0,0 +1,243 @@
+# scheduler_functions.py
+# This class is responsible for deciding which work the bot's worker threads run next
+# Every task belongs to a priority class: commands typed by users, App Home views, background
+# refreshes, and bulk fan-out. Free workers always take the highest class with waiting tasks,
+# and every class but interactive is limited to a share of the workers, and together they always leave
+# some workers to interactive tasks, so heavy background work never holds up commands. Within a class,
+# tasks are taken from each user in turn, so one user sending many commands does not hold up everybody else
+# Slack requests are classified by their body, so their listeners are queued in the right class for the
+# user they are from, whether they arrive over HTTP or Socket Mode
+# How long tasks wait in each queue is recorded for the /metrics endpoint
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future
+
+# Priority classes, from highest to lowest
+INTERACTIVE = "interactive"
+APP_HOME = "app_home"
+BACKGROUND = "background"
+BULK = "bulk"
+priority_classes = (INTERACTIVE, APP_HOME, BACKGROUND, BULK)
+
+# Number of worker threads
+__worker_count = int(os.environ.get("BOT_WORKERS", 10))
+
+# Most workers each class may use at once. Interactive tasks may use every worker
+__class_limits = {
+    INTERACTIVE: __worker_count,
+    APP_HOME: int(os.environ.get("SCHEDULER_APP_HOME_LIMIT", 4)),
+    BACKGROUND: int(os.environ.get("SCHEDULER_BACKGROUND_LIMIT", 2)),
+    BULK: int(os.environ.get("SCHEDULER_BULK_LIMIT", 1)),
+}
+
+# Number of workers only interactive tasks may use, so commands can be acknowledged within Slack's
+# 3 second limit however much other work is running
+__interactive_reserve = int(os.environ.get("SCHEDULER_INTERACTIVE_RESERVE", 1))
+
+# Upper bounds of the queue wait histogram buckets, in seconds
+queue_wait_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Queue wait histograms, keyed by queue name and priority class
+__queue_waits = {}
+__queue_waits_lock = threading.Lock()
+
+# Runs tasks on a fixed set of worker threads in priority order
+class PriorityScheduler:
+    def __init__(self, worker_count, class_limits, interactive_reserve = 0):
+        self.worker_count = worker_count
+        self.class_limits = class_limits
+
+        # Most workers every class but interactive may use together. At least one is left to them
+        self.shared_limit = max(worker_count - interactive_reserve, 1)
+
+        # Waiting tasks of each class, grouped by the user they are for, in the order users are served
+        self.queues = {priority_class: OrderedDict() for priority_class in priority_classes}
+        self.queued = {priority_class: 0 for priority_class in priority_classes}
+        self.running = {priority_class: 0 for priority_class in priority_classes}
+        self.condition = threading.Condition()
+        self.current = threading.local()
+        self.request_context = threading.local()
+        self.workers = []
+
+    # Queue a function to run in a priority class. Returns a Future holding its result
+    # key identifies who the task is for, e.g. a user ID, and urgent tasks go ahead of the rest of their class
+    def submit(self, priority_class, func, *args, key = None, urgent = False, **kwargs):
+        future = Future()
+        task = (future, func, args, kwargs, time.time())
+
+        with self.condition:
+            # Workers are only started once there is work, so a process can be forked before any threads exist
+            if not self.workers:
+                self.start_workers()
+
+            user_queues = self.queues[priority_class]
+            if urgent:
+                user_queues.setdefault(key, deque()).appendleft(task)
+                user_queues.move_to_end(key, last=False)
+            else:
+                user_queues.setdefault(key, deque()).append(task)
+            self.queued[priority_class] += 1
+            self.condition.notify()
+        return future
+
+    # Run a function in a priority class and wait for its result
+    # Tasks already running on a worker run the function straight away, as waiting could use up every worker
+    def run(self, priority_class, func, *args, key = None, **kwargs):
+        if getattr(self.current, "priority_class", None) is not None:
+            return func(*args, **kwargs)
+        return self.submit(priority_class, func, *args, key=key, **kwargs).result()
+
+    def start_workers(self):
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self.work_loop, name=f"scheduler-worker-{i + 1}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    # Take the next task: the first waiting user's oldest task in the highest class that is under its limit
+    # Must be called holding the condition. Returns None if no task can run yet
+    def take_task(self):
+        shared_running = sum(self.running[priority_class] for priority_class in priority_classes if priority_class != INTERACTIVE)
+
+        for priority_class in priority_classes:
+            user_queues = self.queues[priority_class]
+            if not user_queues or self.running[priority_class] >= self.class_limits.get(priority_class):
+                continue
+            if priority_class != INTERACTIVE and shared_running >= self.shared_limit:
+                continue
+
+            key, tasks = next(iter(user_queues.items()))
+            task = tasks.popleft()
+
+            # The user goes to the back of the line, so other users' tasks run before their next one
+            if tasks:
+                user_queues.move_to_end(key)
+            else:
+                del user_queues[key]
+
+            self.queued[priority_class] -= 1
+            self.running[priority_class] += 1
+            return priority_class, key, task
+        return None
+
+    def work_loop(self):
+        while True:
+            with self.condition:
+                taken = self.take_task()
+                while taken is None:
+                    self.condition.wait()
+                    taken = self.take_task()
+
+            priority_class, key, (future, func, args, kwargs, queued_at) = taken
+            observe_queue_wait("scheduler", priority_class, time.time() - queued_at)
+
+            self.current.priority_class = priority_class
+            self.current.key = key
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                self.current.priority_class = None
+                self.current.key = None
+                with self.condition:
+                    self.running[priority_class] -= 1
+
+                    # A task finishing can let a task of a class that was at its limit run
+                    self.condition.notify_all()
+
+    # Get the number of queued and running tasks of each class
+    def get_metrics(self):
+        with self.condition:
+            return {priority_class: {"queued": self.queued[priority_class], "running": self.running[priority_class]} for priority_class in priority_classes}
+
+# Executor that runs work in the scheduler, e.g. for the Bolt app's listeners
+# Work submitted from a scheduled task stays in that task's class and user, and goes ahead of new tasks,
+# as the task is usually waiting for it. Work submitted while dispatching a Slack request is queued in
+# the class and for the user the request was classified as
+class SchedulerExecutor(Executor):
+    def __init__(self, scheduler, default_class):
+        self.scheduler = scheduler
+        self.default_class = default_class
+
+    def submit(self, fn, /, *args, **kwargs):
+        priority_class = getattr(self.scheduler.current, "priority_class", None)
+        if priority_class is not None:
+            return self.scheduler.submit(priority_class, fn, *args, key=self.scheduler.current.key, urgent=True, **kwargs)
+
+        request_class = getattr(self.scheduler.request_context, "priority_class", None)
+        if request_class is not None:
+            return self.scheduler.submit(request_class, fn, *args, key=self.scheduler.request_context.key, **kwargs)
+        return self.scheduler.submit(self.default_class, fn, *args, **kwargs)
+
+__scheduler = PriorityScheduler(__worker_count, __class_limits, __interactive_reserve)
+
+# Queue a function to run in a priority class. Returns a Future holding its result
+def submit(priority_class, func, *args, key = None, **kwargs):
+    return __scheduler.submit(priority_class, func, *args, key=key, **kwargs)
+
+# Run a function in a priority class and wait for its result
+def run(priority_class, func, *args, key = None, **kwargs):
+    return __scheduler.run(priority_class, func, *args, key=key, **kwargs)
+
+# Get an executor that runs work in the scheduler, in the given class unless submitted from a scheduled task
+def get_executor(default_class = INTERACTIVE):
+    return SchedulerExecutor(__scheduler, default_class)
+
+# Get the priority class of a request from Slack, and the ID of the user it is from, from the request body
+# Home tab events are App Home tasks, and everything else is interactive
+def classify_request(body):
+    body = body if isinstance(body, dict) else {}
+    event = body.get("event") or {}
+    user = body.get("user")
+    user_id = event.get("user") or (user.get("id") if isinstance(user, dict) else user) or body.get("user_id")
+
+    if event.get("type") == "app_home_opened":
+        return APP_HOME, user_id
+    return INTERACTIVE, user_id
+
+# Set the class and user of the Slack request this thread is dispatching
+# Work the request's listeners submit to the executor is queued in that class for that user
+def set_request_context(priority_class, key = None):
+    __scheduler.request_context.priority_class = priority_class
+    __scheduler.request_context.key = key
+
+# Record how long a task waited in a queue before it started
+def observe_queue_wait(queue_name, priority_class, seconds):
+    with __queue_waits_lock:
+        histogram = __queue_waits.get((queue_name, priority_class))
+        if histogram is None:
+            histogram = {"buckets": [0] * len(queue_wait_buckets), "sum": 0.0, "count": 0}
+            __queue_waits[(queue_name, priority_class)] = histogram
+
+        for i, upper_bound in enumerate(queue_wait_buckets):
+            if seconds <= upper_bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+# Get the queue wait histograms, keyed by queue name and priority class
+# Bucket counts are cumulative, as in the Prometheus histogram format
+def get_queue_wait_metrics():
+    with __queue_waits_lock:
+        return {name: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]} for name, h in __queue_waits.items()}
+
+# Get the number of queued and running tasks of each class
+def get_scheduler_metrics():
+    return __scheduler.get_metrics()
+
+# Run a function in a priority class, logging instead of raising its errors
+# Used for work nothing waits on, such as timers
+def submit_logged(priority_class, func, *args, **kwargs):
+    def run_logged():
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"Scheduled {priority_class} task {func.__name__} failed: {e}")
+
+    return submit(priority_class, run_logged)
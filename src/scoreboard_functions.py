@@ -0,0 +1,175 @@
+# scoreboard_functions.py
+# This class is responsible for live scoreboard messages
+# A scoreboard is posted once, and then edited in place as the games on it change. Updates come
+# from the shared poll of the live fixtures, and each scoreboard is only edited when something it
+# shows has changed since it was last rendered, so the poll does not cause a Slack call per board
+
+import os
+import json
+import threading
+import time
+
+import sports_api_functions as sports_api
+import notification_functions as notifications
+import slack_queue_functions as slack_queue
+import scheduler_functions as scheduler
+
+# Number of seconds a scoreboard is kept up to date, in case its games never finish
+__scoreboard_ttl = int(os.environ.get("SCOREBOARD_TTL_SECONDS", 4 * 3600))
+
+# Descriptions of the statuses shown on a scoreboard
+__status_labels = {
+    "1H": "First Half",
+    "HT": "Half Time",
+    "2H": "Second Half",
+    "ET": "Extra Time",
+    "BT": "Break Time",
+    "P": "Penalties",
+    "SUSP": "Suspended",
+    "INT": "Interrupted",
+    "FT": "Full Time",
+    "AET": "Full Time (AET)",
+    "PEN": "Full Time (Pens)",
+    "AWD": "Awarded",
+    "WO": "Walkover",
+}
+
+# Scoreboards being kept up to date, keyed by channel and message timestamp
+# Each holds what the board follows and the state of every fixture as it was last rendered
+__scoreboards = {}
+__scoreboards_lock = threading.Lock()
+
+# Live fixtures from the most recent poll, or None before the first poll
+__latest_live_fixtures = None
+
+# Post a scoreboard of the live games for a team, a league, or every active league, and keep it up to date
+# Returns False without posting if there are no matching live games
+def post_scoreboard(client, channel, team_name = None, league_id = None):
+    team_id = sports_api.get_team_id(team_name) if team_name else None
+    if team_name and team_id is None:
+        raise IndexError(f"Unknown team {team_name}")
+
+    # Use the shared poll's fixtures, only asking the API if the poller has not run yet
+    with __scoreboards_lock:
+        live_fixtures = __latest_live_fixtures
+    if live_fixtures is None:
+        live_fixtures = sports_api.get_live_fixtures()
+
+    scoreboard = {
+        "team_id": team_id,
+        "league_id": league_id,
+        "title": f"Live: {team_name}" if team_name else f"Live {sports_api.get_league_name(league_id)} Scores" if league_id else "Live Scores",
+        "fixtures": {},
+        "created_at": time.time(),
+    }
+    __update_fixture_states(scoreboard, live_fixtures)
+    if not scoreboard.get("fixtures"):
+        return False
+
+    # The scoreboard is only shared with the poll once it is posted, so it can be rendered without the lock
+    res = client.chat_postMessage(channel=channel, text=scoreboard.get("title"), blocks=json.dumps(__render_blocks(scoreboard)))
+
+    with __scoreboards_lock:
+        __scoreboards[(res.get("channel"), res.get("ts"))] = scoreboard
+    return True
+
+# Edit every scoreboard whose games changed in the latest poll, and stop updating finished scoreboards
+# Polls can be handled by more than one thread, e.g. the poller and polls passed on from another process,
+# so scoreboards are only updated and rendered holding the lock
+def handle_live_fixtures(live_fixtures, finished_fixtures):
+    global __latest_live_fixtures
+
+    now = time.time()
+    updates = []
+
+    with __scoreboards_lock:
+        __latest_live_fixtures = live_fixtures
+
+        for (channel, ts), scoreboard in list(__scoreboards.items()):
+            # Only call Slack when something the scoreboard shows has changed
+            if __update_fixture_states(scoreboard, live_fixtures + finished_fixtures):
+                updates.append((channel, ts, scoreboard.get("title"), json.dumps(__render_blocks(scoreboard))))
+
+            finished = all(state.get("status") in sports_api.finished_statuses for state in scoreboard.get("fixtures").values())
+            if finished or now - scoreboard.get("created_at") > __scoreboard_ttl:
+                del __scoreboards[(channel, ts)]
+
+    for channel, ts, title, blocks in updates:
+        slack_queue.enqueue(
+            "chat_update",
+            priority_class=scheduler.BACKGROUND,
+            channel=channel,
+            ts=ts,
+            text=title,
+            blocks=blocks)
+
+# Register for the shared poll of the live fixtures
+def start_scoreboard_updates():
+    notifications.add_live_listener(handle_live_fixtures)
+
+# Record the state of every fixture the scoreboard follows. Returns whether any state changed
+def __update_fixture_states(scoreboard, fixtures):
+    changed = False
+
+    for fixture in fixtures:
+        teams = fixture.get("teams")
+        if scoreboard.get("team_id") is not None and scoreboard.get("team_id") not in (teams.get("home").get("id"), teams.get("away").get("id")):
+            continue
+        if scoreboard.get("league_id") is not None and fixture.get("league").get("id") != scoreboard.get("league_id"):
+            continue
+
+        fixture_id = fixture.get("fixture").get("id")
+        state = __extract_visible_state(fixture)
+        if scoreboard.get("fixtures").get(fixture_id) != state:
+            scoreboard.get("fixtures")[fixture_id] = state
+            changed = True
+
+    return changed
+
+# Extract the parts of a fixture shown on a scoreboard
+# The minute being played is left out, so a board is only edited when the score or the stage of the game changes
+def __extract_visible_state(fixture):
+    return {
+        "home_name": fixture.get("teams").get("home").get("name"),
+        "away_name": fixture.get("teams").get("away").get("name"),
+        "home_goals": fixture.get("goals").get("home") or 0,
+        "away_goals": fixture.get("goals").get("away") or 0,
+        "status": fixture.get("fixture").get("status").get("short"),
+    }
+
+# Render a scoreboard into blocks
+def __render_blocks(scoreboard):
+    blocks = [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": scoreboard.get("title"),
+                "emoji": True
+            }
+        },
+        {
+            "type": "divider"
+        },
+    ]
+
+    for state in scoreboard.get("fixtures").values():
+        status = __status_labels.get(state.get("status"), state.get("status"))
+        blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*{state.get('away_name')}* {state.get('away_goals')} - {state.get('home_goals')} *{state.get('home_name')}*   _{status}_"
+            }
+        })
+
+    blocks.append({
+        "type": "context",
+        "elements": [
+            {
+                "type": "mrkdwn",
+                "text": "Updates automatically while the games are being played."
+            }
+        ]
+    })
+    return blocks
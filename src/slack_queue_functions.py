@@ -0,0 +1,91 @@
+# slack_queue_functions.py
+# This class is responsible for sending bot-initiated messages to Slack
+# Messages are queued and sent by a single worker at a limited rate, so fanning a
+# notification out to many users or channels does not run into Slack's rate limits
+# Calls are sent in the order of their priority class, so Home republishes are not held up by a large fan-out
+
+import os
+import queue
+import itertools
+import threading
+import time
+import logging
+
+from slack_sdk.errors import SlackApiError
+
+import circuit_breaker_functions as breakers
+import scheduler_functions as scheduler
+
+# Minimum number of seconds between calls to the Slack Web API
+__send_interval = float(os.environ.get("SLACK_QUEUE_INTERVAL_SECONDS", 1.0))
+
+# Number of times a call is retried when Slack asks the bot to slow down
+__max_retries = 3
+
+# Calls waiting to be sent, ordered by priority class and then by when they were queued
+__send_queue = queue.PriorityQueue()
+__sequence = itertools.count()
+__client = None
+__worker_thread = None
+
+# Start the worker that sends queued calls using the given Slack client
+def start_slack_queue(client):
+    global __client, __worker_thread
+
+    __client = client
+    if __worker_thread is None:
+        __worker_thread = threading.Thread(target=__send_loop, name="slack-queue", daemon=True)
+        __worker_thread.start()
+
+# Share the send rate between several processes sending with the same token, e.g. prefork workers
+# Each process then waits process_count times the send interval between its calls. Called once, before forking
+def share_send_rate(process_count):
+    global __send_interval
+
+    __send_interval *= max(process_count, 1)
+
+# Queue a call to a Slack Web API method, e.g. enqueue("chat_postMessage", channel=..., blocks=...)
+# Calls are bulk fan-out unless another priority class is given
+def enqueue(method_name, priority_class = scheduler.BULK, **kwargs):
+    __put(priority_class, method_name, kwargs, 0)
+
+# Number of calls waiting to be sent
+def pending_count():
+    return __send_queue.qsize()
+
+# Send queued calls one at a time, no faster than the send interval
+def __send_loop():
+    while True:
+        rank, sequence, queued_at, priority_class, method_name, kwargs, attempt = __send_queue.get()
+        scheduler.observe_queue_wait("slack", priority_class, time.time() - queued_at)
+        try:
+            getattr(__client, method_name)(**kwargs)
+        except SlackApiError as e:
+            # Slack tells the bot how long to wait when it is rate limited
+            if e.response.status_code == 429 and attempt < __max_retries:
+                retry_after = int(e.response.headers.get("Retry-After", 1))
+                logging.error(f"Slack rate limited {method_name}, retrying in {retry_after}s")
+                time.sleep(retry_after)
+                __put(priority_class, method_name, kwargs, attempt + 1)
+            else:
+                logging.error(f"Error sending queued {method_name}: {e}")
+        except breakers.CircuitOpenError as e:
+            # Hold the call back until the breaker lets a probe through
+            if attempt < __max_retries:
+                retry_after = breakers.get_breaker(e.name).reset_timeout
+                logging.error(f"{e}, retrying {method_name} in {retry_after}s")
+                time.sleep(retry_after)
+                __put(priority_class, method_name, kwargs, attempt + 1)
+            else:
+                logging.error(f"Error sending queued {method_name}: {e}")
+        except Exception as e:
+            logging.error(f"Error sending queued {method_name}: {e}")
+        finally:
+            __send_queue.task_done()
+
+        time.sleep(__send_interval)
+
+# Add a call to the send queue behind earlier calls of the same priority class
+def __put(priority_class, method_name, kwargs, attempt):
+    rank = scheduler.priority_classes.index(priority_class)
+    __send_queue.put((rank, next(__sequence), time.time(), priority_class, method_name, kwargs, attempt))
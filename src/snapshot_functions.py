@@ -0,0 +1,85 @@
+# snapshot_functions.py
+# This class is responsible for checkpointing the cached upstream data to disk
+# The standings, fixtures, team lookups and predictions held in the cache are periodically written
+# to a compressed snapshot file, and loaded back at startup so a restarted bot can serve from
+# memory straight away instead of sending every first request to the football API
+
+import os
+import gzip
+import json
+import time
+import threading
+import logging
+
+import cache_functions
+
+# Path of the snapshot file
+__snapshot_path = os.environ.get("SNAPSHOT_PATH", "cache_snapshot.json.gz")
+
+# Number of seconds between checkpoints of the cache
+__snapshot_interval = int(os.environ.get("SNAPSHOT_INTERVAL_SECONDS", 300))
+
+# Format version of the snapshot file, so snapshots written by an incompatible version are ignored
+__snapshot_version = 1
+
+# Number of entries loaded from the snapshot at startup, or None if no snapshot was loaded
+loaded_entry_count = None
+
+# Write every cached value to the snapshot file, including expired values that can still be served as stale
+# The snapshot is written to a temporary file first and then moved into place, so a crash
+# part way through never leaves a truncated snapshot behind. Returns the number of entries written
+def save_snapshot(path = None):
+    path = path or __snapshot_path
+    entries = cache_functions.get_cache().export_entries()
+
+    snapshot = {
+        "version": __snapshot_version,
+        "saved_at": time.time(),
+        "entries": entries,
+    }
+
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+    os.replace(temp_path, path)
+    return len(entries)
+
+# Load the snapshot file into the cache
+# Entries that have expired since it was written are loaded as stale, so they can be served until the prefetcher
+# refreshes them. The standings and fixtures usually expire within one snapshot interval
+# Returns the number of entries loaded, or None if there is no usable snapshot
+def load_snapshot(path = None):
+    global loaded_entry_count
+
+    path = path or __snapshot_path
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except Exception as e:
+        logging.error(f"Unable to read cache snapshot {path}: {e}")
+        return None
+
+    if snapshot.get("version") != __snapshot_version:
+        logging.error(f"Ignoring cache snapshot {path} with version {snapshot.get('version')}")
+        return None
+
+    loaded_entry_count = cache_functions.get_cache().import_entries(snapshot.get("entries"))
+    logging.info(f"Loaded {loaded_entry_count} cached entries from snapshot saved {time.time() - snapshot.get('saved_at'):.0f}s ago")
+    return loaded_entry_count
+
+# Start the background thread that checkpoints the cache each snapshot interval
+def start_snapshots():
+    def snapshot_loop():
+        while True:
+            time.sleep(__snapshot_interval)
+            try:
+                save_snapshot()
+            except Exception as e:
+                logging.error(f"Error saving cache snapshot: {e}")
+
+    snapshot_thread = threading.Thread(target=snapshot_loop, name="cache-snapshots", daemon=True)
+    snapshot_thread.start()
+    return snapshot_thread
@@ -0,0 +1,132 @@
+# socket_mode_functions.py
+# This class is responsible for receiving events from Slack over Socket Mode
+# Several WebSocket connections are opened at once, so events keep arriving while one of them
+# reconnects. Each event is dispatched on the connection's message threads, and the app's listeners
+# run in the scheduler in the class and for the user the app classifies the event as, so waiting for
+# a listener's acknowledgement never holds a scheduler worker
+# Acknowledgements are sent over any open connection, so a reconnect does not drop an event that
+# is being processed, and events Slack redelivers are only processed once
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+from slack_bolt.request import BoltRequest
+from slack_sdk.socket_mode.builtin import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+# Number of WebSocket connections opened to Slack. Slack allows up to 10 per app
+__connection_count = int(os.environ.get("SOCKET_MODE_CONNECTIONS", 2))
+
+# Number of seconds an acknowledgement keeps being retried while every connection is reconnecting
+__ack_timeout = 10
+
+# Number of recently handled events remembered to recognize redeliveries
+__max_remembered_events = 1000
+
+__clients = []
+
+# Events being processed or recently processed, keyed by event ID
+# Each entry holds the acknowledgement sent for the event, or None while it is being processed
+__handled_events = OrderedDict()
+__handled_events_lock = threading.Lock()
+
+# Open the Socket Mode connections and dispatch the events they receive
+# Blocks until the process is stopped
+def start_socket_mode(app, app_token = None, connection_count = __connection_count):
+    open_connections(app, app_token, connection_count)
+    threading.Event().wait()
+
+# Open the Socket Mode connections, which dispatch the events they receive in the background
+# Returns the clients of the connections
+def open_connections(app, app_token = None, connection_count = __connection_count):
+    app_token = app_token or os.environ.get("SLACK_APP_TOKEN")
+
+    def handle_request(client, req):
+        __handle_request(app, client, req)
+
+    for i in range(connection_count):
+        client = SocketModeClient(app_token=app_token, web_client=app.client, auto_reconnect_enabled=True)
+        client.socket_mode_request_listeners.append(handle_request)
+        client.connect()
+        __clients.append(client)
+        logging.info(f"Opened Socket Mode connection {i + 1} of {connection_count}")
+    return list(__clients)
+
+# Close every Socket Mode connection
+def stop_socket_mode():
+    for client in __clients:
+        client.close()
+    __clients.clear()
+
+# Decide whether a request from Slack should be processed, and process it
+def __handle_request(app, client, req):
+    # Slack redelivers events it did not get an acknowledgement for, possibly on another connection
+    event_id = req.payload.get("event_id") if isinstance(req.payload, dict) else None
+    event_key = event_id or req.envelope_id
+
+    with __handled_events_lock:
+        if event_key in __handled_events:
+            ack = __handled_events.get(event_key)
+            duplicate = True
+        else:
+            __handled_events[event_key] = None
+            duplicate = False
+
+            while len(__handled_events) > __max_remembered_events:
+                __handled_events.popitem(last=False)
+
+    if duplicate:
+        # Acknowledge a redelivered event again if it has already been processed.
+        # If it is still being processed, it will be acknowledged when it finishes
+        if ack is not None:
+            __send_ack(client, SocketModeResponse(envelope_id=req.envelope_id, payload=ack.payload))
+        return
+
+    __process_request(app, client, req, event_key)
+
+# Run a request through the Bolt app and acknowledge it
+def __process_request(app, client, req, event_key):
+    try:
+        bolt_resp = app.dispatch(BoltRequest(mode="socket_mode", body=req.payload))
+    except Exception as e:
+        logging.error(f"Error dispatching Socket Mode request: {e}")
+
+        # Forget the event so Slack's redelivery is processed again
+        with __handled_events_lock:
+            __handled_events.pop(event_key, None)
+        return
+
+    payload = None
+    if bolt_resp.status == 200 and bolt_resp.body:
+        content_type = bolt_resp.headers.get("content-type", [""])[0]
+        payload = json.loads(bolt_resp.body) if content_type.startswith("application/json") else {"text": bolt_resp.body}
+
+    ack = SocketModeResponse(envelope_id=req.envelope_id, payload=payload)
+    with __handled_events_lock:
+        __handled_events[event_key] = ack
+
+    __send_ack(client, ack)
+
+# Send an acknowledgement, preferring the connection the request came in on
+# If that connection is reconnecting, any other open connection is used instead
+def __send_ack(client, ack):
+    deadline = time.time() + __ack_timeout
+
+    while time.time() < deadline:
+        for ack_client in [client] + [c for c in __clients if c is not client]:
+            if not ack_client.is_connected():
+                continue
+            try:
+                ack_client.send_socket_mode_response(ack)
+                return True
+            except Exception as e:
+                logging.error(f"Error acknowledging Socket Mode request: {e}")
+        time.sleep(0.5)
+
+    # Slack will redeliver the event, and it will be acknowledged from the remembered response
+    logging.error(f"Unable to acknowledge Socket Mode request {ack.envelope_id}, waiting for redelivery")
+    return False
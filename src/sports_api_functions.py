@@ -9,17 +9,87 @@ import json
 import dateutil.parser
 import datetime
 import logging
+import threading
+import time
 
 # Use dynamo functions
 import dynamo_functions as db
 
-# Set API URL and league ID, and configure logging
+# Use the cache shared by the bot's data functions
+import cache_functions
+
+# Use standings and team statistics derived from fixture results
+import aggregation_functions as aggregation
+
+# Use predictions from the local prediction model
+import prediction_functions as predictions
+
+# Fail fast while the API is down
+import circuit_breaker_functions as breakers
+
+# Run background refreshes behind commands typed by users
+import scheduler_functions as scheduler
+
+# Set API URL and default league ID, and configure logging
 __url = "https://v3.football.api-sports.io/"
-__league_id = 39
+__default_league_id = int(os.environ.get("DEFAULT_LEAGUE_ID", 39))
 logging.basicConfig(filename='sports_stats_bot_api_functions.log', filemode='a', format='%(name)s - %(levelname)s - %(message)s')
 
-# Get standings information for all 20 clubs in the EPL
-def get_standings_data_all(client, message, return_card = False):
+# Number of seconds each kind of API data is cached for
+__cache_ttls = {
+    "standings": 300,
+    "fixtures": 300,
+    "teams": 86400,
+    "teams/statistics": 300,
+    "predictions": 3600,
+    "leagues": 86400,
+}
+
+# Leagues users can refer to by name in commands, keyed by the name used in commands
+leagues = {
+    "epl": {"id": 39, "name": "English Premier League"},
+    "championship": {"id": 40, "name": "English Championship"},
+    "laliga": {"id": 140, "name": "La Liga"},
+    "seriea": {"id": 135, "name": "Serie A"},
+    "bundesliga": {"id": 78, "name": "Bundesliga"},
+    "ligue1": {"id": 61, "name": "Ligue 1"},
+    "eredivisie": {"id": 88, "name": "Eredivisie"},
+    "mls": {"id": 253, "name": "Major League Soccer"},
+}
+
+# Number of seconds to wait for the API before giving up on a request
+__request_timeout = float(os.environ.get("API_TIMEOUT_SECONDS", 10))
+
+# Number of teams shown on each page of the standings, and games on each page of past and upcoming games
+__standings_page_size = 5
+__games_page_size = 3
+
+# Team info is not tied to a league or season, so it has its own cache namespace
+__teams_namespace = "teams"
+
+# League info such as the current season is also shared across seasons
+__leagues_namespace = "leagues"
+
+# Statuses of finished fixtures: full time, after extra time, after penalties, and awarded or walkover results
+# Used everywhere a fixture is checked for being finished
+finished_statuses = ("FT", "AET", "PEN", "AWD", "WO")
+
+# Status filter requesting only finished fixtures from the API
+__finished_status_filter = "-".join(finished_statuses)
+
+# Number of seconds between background refreshes of the league data
+__prefetch_interval = int(os.environ.get("PREFETCH_INTERVAL_SECONDS", 300))
+
+# Functions called after a refresh finds new data
+__data_change_listeners = []
+
+# Get standings information for all clubs in the league
+# Only the requested page of the table is rendered, with buttons to move to the other pages.
+# When update_ts is given, that message is updated to show the page instead of posting a new one
+def get_standings_data_all(client, message, return_card = False, league_id = None, season = None, page = 1, update_ts = None):
+    league_id, season = resolve_league_season(league_id, season)
+    league_name = get_league_name(league_id)
+
     # Limit number of results when returning a card to avoid overloading the user's view
     return_card_limit = 3
 
@@ -27,13 +97,10 @@ def get_standings_data_all(client, message, return_card = False):
 
     # If getting the data fails, log the error and ask the user to try again later
     try:
-        # GET and parse the standings data from the API
-        standings_endpoint = __url + "standings"
-        standings_json = requests.get(standings_endpoint, params={"league":__league_id, "season":datetime.date.today().year}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-        standings_dict = json.loads(standings_json.content)
-        league_standings = standings_dict.get("response")[0].get("league").get("standings")[0]
+        # GET and parse the standings data
+        league_standings = get_league_standings(league_id, season)
     except Exception:
-        logging.error(Exception)
+        logging.exception("Error getting standings")
         result = client.chat_postMessage(
                 channel=message["channel"],
 				text="Error Getting Data from API",
@@ -46,9 +113,10 @@ def get_standings_data_all(client, message, return_card = False):
                     }
                 },
             ])
+        return
     
     # Create the card that will hold the standings blocks
-    header_text = "Current English Premier League Top 3" if return_card else "Current English Premier League Standings"
+    header_text = f"Current {league_name} Top 3" if return_card else f"Current {league_name} Standings"
 
     standings_card = {
         "blocks": [
@@ -66,11 +134,16 @@ def get_standings_data_all(client, message, return_card = False):
         ]
     }
 
-    # Get the required info out of the JSON response for each club in the standings
-    count = 0
-    for team_entry in league_standings:
-        count += 1
+    # The App Home card only shows the top of the table
+    if return_card:
+        page_entries = league_standings[:return_card_limit]
+    else:
+        page_count = __get_page_count(len(league_standings), __standings_page_size)
+        page = min(max(int(page), 1), page_count)
+        page_entries = league_standings[(page - 1) * __standings_page_size:page * __standings_page_size]
 
+    # Get the required info out of the JSON response for each club on the page
+    for team_entry in page_entries:
         # Extract standings data from api response
         curr_team_data = __extract_standings_data(team_entry)
 
@@ -97,40 +170,39 @@ def get_standings_data_all(client, message, return_card = False):
         for item in standings_entry:
             standings_card.get("blocks").append(item)
 
-        # Returns the top 3 teams in a card instead of printing it to Slack
-        # Used for the App Home Tab
-        if return_card and count == return_card_limit:
-            return standings_card
-        
-        # Send the blocks to Slack for every 5 teams to avoid Slack's 50 block limit
-        if count == 5 or team_entry == None: 
-            result = client.chat_postMessage(
-                    channel=message["channel"],
-					text="EPL Standings Card",
-					blocks=json.dumps(standings_card.get("blocks")))
-            standings_card.get("blocks").clear()
-            count = 0
+    # Returns the top 3 teams in a card instead of printing it to Slack
+    # Used for the App Home Tab
+    if return_card:
+        return standings_card
+
+    # Add the page buttons and send the page to Slack
+    page_args = {"league_id": league_id, "season": season}
+    standings_card.get("blocks").extend(__create_pagination_blocks("standings_page", page_args, page, page_count))
+    __send_card(client, message["channel"], f"{league_name} Standings Card", standings_card.get("blocks"), update_ts)
 
 # Get statistics for the team requested by the user
-def get_team_stats_data(client, message, team_name):
+def get_team_stats_data(client, message, team_name, league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    league_name = get_league_name(league_id)
+
     team_stats = None
     team_info_dict = None
 
     try:
         #call team info endpoint
-        teams_endpoint = __url + "teams"
-        team_info_json = requests.get(teams_endpoint, params={"name":team_name}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-        team_info_dict = json.loads(team_info_json.content).get("response")[0]
+        team_info_dict = __get_team_info(team_name)
         team_id = team_info_dict.get("team").get("id")
 
+        # Derive the stats from fixture results, falling back to the API before the team has played
+        if aggregation.standings_source == "local":
+            team_stats = aggregation.get_team_statistics(team_id, league_id, season)
+
         #call stats endpoint
-        endpoint_path = "teams/statistics"
-        endpoint = __url + endpoint_path
-        stats_json = requests.get(endpoint, params={"league":__league_id, "season":datetime.date.today().year, "team": team_id}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-        stats_dict = json.loads(stats_json.content)
-        team_stats = stats_dict.get("response")
+        if team_stats is None:
+            stats_dict = __get_api_data("teams/statistics", {"league":league_id, "season":season, "team": team_id}, __league_namespace(league_id, season))
+            team_stats = stats_dict.get("response")
     except Exception:
-        logging.error(Exception)
+        logging.exception("Error getting team stats")
         result = client.chat_postMessage(
                 channel=message["channel"],
 				text="Error Getting Data from API",
@@ -138,11 +210,12 @@ def get_team_stats_data(client, message, team_name):
                     "type": "section",
                     "text": {
                         "type": "plain_text",
-                        "text": "Unable to get team stats. Please ensure you have provided a valid EPL team name or try again later.",
+                        "text": f"Unable to get team stats. Please ensure you have provided a valid {league_name} team name or try again later.",
                         "emoji": False
                     }
                 },
             ])
+        return
 
     # Extract team stats from api response
     team_data = __extract_team_stats_data(team_stats, team_info_dict)
@@ -154,7 +227,7 @@ def get_team_stats_data(client, message, team_name):
                 "type": "header",
                 "text": {
                     "type": "plain_text",
-                    "text": f"Current English Premier League Stats for {team_name}",
+                    "text": f"Current {league_name} Stats for {team_name}",
                     "emoji": True
                 }
             },
@@ -190,13 +263,15 @@ def get_team_stats_data(client, message, team_name):
     # Send the blocks back to the client
     client.chat_postMessage(
                 channel=message["channel"],
-                text="EPL Team Stats Card",
+                text=f"{league_name} Team Stats Card",
                 blocks=json.dumps(team_info_card.get("blocks")))
 
 # Get data on recently completed games for the team requested by the user
-def get_past_games_data(client, message, team_name = None):
-    # Set the number of games to get data for 
-    number_of_games = 3
+# Only the requested page of games is rendered, with buttons to move to the other pages.
+# When update_ts is given, that message is updated to show the page instead of posting a new one
+def get_past_games_data(client, message, team_name = None, league_id = None, season = None, page = 1, update_ts = None):
+    league_id, season = resolve_league_season(league_id, season)
+    league_name = get_league_name(league_id)
 
     team_games_stats = None
 
@@ -204,23 +279,17 @@ def get_past_games_data(client, message, team_name = None):
         # If no team name provided, get prior games from any team
         if not team_name or team_name.isspace():
             # Get completed games in the current season in oldest-newest order
-            fixtures_endpoint = __url + "fixtures"
-            team_games_json = requests.get(fixtures_endpoint, params={"league":__league_id, "season":datetime.date.today().year, "status":"FT"}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            team_games_stats = json.loads(team_games_json.content).get("response")
+            team_games_stats = __get_api_data("fixtures", {"league":league_id, "season":season, "status":__finished_status_filter}, __league_namespace(league_id, season)).get("response")
 
         else:
             # Get the ID the API uses to identify a team
-            teams_endpoint = __url + "teams"
-            team_info_json = requests.get(teams_endpoint, params={"name":team_name}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            team_info_dict = json.loads(team_info_json.content).get("response")[0]
+            team_info_dict = __get_team_info(team_name)
             team_id = team_info_dict.get("team").get("id")
 
             # Get completed games for this team in the current season in oldest-newest order
-            fixtures_endpoint = __url + "fixtures"
-            team_games_json = requests.get(fixtures_endpoint, params={"team":team_id, "league":__league_id, "season":datetime.date.today().year, "status":"FT"}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            team_games_stats = json.loads(team_games_json.content).get("response")
+            team_games_stats = __get_api_data("fixtures", {"team":team_id, "league":league_id, "season":season, "status":__finished_status_filter}, __league_namespace(league_id, season)).get("response")
     except Exception:
-        logging.error(Exception)
+        logging.exception("Error getting past games")
         
         result = client.chat_postMessage(
                 channel=message["channel"],
@@ -229,14 +298,15 @@ def get_past_games_data(client, message, team_name = None):
                     "type": "section",
                     "text": {
                         "type": "plain_text",
-                        "text": "Unable to get past games. Please ensure you have provided a valid EPL team name or try again later.",
+                        "text": f"Unable to get past games. Please ensure you have provided a valid {league_name} team name or try again later.",
                         "emoji": False
                     }
                 },
             ])
+        return
 
     # Set header text based on whether a team was requested
-    header_text = f"Recent Games Played by {team_name}" if team_name else "Recent English Premier League Games"
+    header_text = f"Recent Games Played by {team_name}" if team_name else f"Recent {league_name} Games"
 
     # Create card to hold recent game data blocks
     recent_game_card = {
@@ -255,24 +325,26 @@ def get_past_games_data(client, message, team_name = None):
         ]
     }
 
+    # Limit the number of games displayed on each page to not overload the user's screen with a wall of info
+    page_count = __get_page_count(len(team_games_stats), __games_page_size)
+    page = min(max(int(page), 1), page_count)
+
      # If there are no past games, add a message to the card and do not bother trying to parse the response
     if len(team_games_stats) == 0:
-        upcoming_game_card.get("blocks").append(
+        recent_game_card.get("blocks").append(
             {
-                "type": "plain_text",
-                "text": f"No past games found for {team_name} in the current season.",
-                "emoji": False
+                "type": "section",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"No past games found for {team_name or league_name} in the current season.",
+                    "emoji": False
+                }
             }
         )
     else:
-        # Go through the game information in newest to oldest chronological order
-        count = 0
-        for i in range(len(team_games_stats)-1, 0, -1):
-            # Limit the number of games displayed to not overload the user's screen with a wall of info
-            if count == number_of_games: break
-
-            curr_game = team_games_stats[i]
-
+        # Go through the game information on the page in newest to oldest chronological order
+        newest_games = team_games_stats[::-1]
+        for curr_game in newest_games[(page - 1) * __games_page_size:page * __games_page_size]:
             # Get the data for the current game
             past_game_data = __extract_past_games_data(curr_game)
 
@@ -299,40 +371,33 @@ def get_past_games_data(client, message, team_name = None):
             for item in curr_game_card:
                 recent_game_card.get("blocks").append(item)
 
-            count += 1
-
-    # Send the blocks back to the user
-    client.chat_postMessage(
-                channel=message["channel"],
-                text="EPL Team Info Card",
-                blocks=json.dumps(recent_game_card.get("blocks")))
+    # Add the page buttons and send the blocks back to the user
+    page_args = {"team_name": team_name, "league_id": league_id, "season": season}
+    recent_game_card.get("blocks").extend(__create_pagination_blocks("pastgames_page", page_args, page, page_count))
+    __send_card(client, message["channel"], f"{league_name} Team Info Card", recent_game_card.get("blocks"), update_ts)
 
 # Get data on upcoming game by team or in general
-def get_next_game_data(client, message, team_name = None, return_card = False):
-    # Set the number of games to get data for 
-    number_of_games = 3
+# Only the requested page of games is rendered, so predictions are only made for the games shown.
+# When update_ts is given, that message is updated to show the page instead of posting a new one
+def get_next_game_data(client, message, team_name = None, return_card = False, league_id = None, season = None, page = 1, update_ts = None):
+    league_id, season = resolve_league_season(league_id, season)
+    league_name = get_league_name(league_id)
 
     future_games = None
 
     try:
-        fixtures_endpoint = __url + "fixtures"
-
         if not team_name or team_name.isspace():
             # Get upcoming teams games for current season in closest to current date order
-            future_games_json = requests.get(fixtures_endpoint, params={"league":__league_id, "season":datetime.date.today().year, "status":"NS"}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            future_games = json.loads(future_games_json.content).get("response")
+            future_games = __get_api_data("fixtures", {"league":league_id, "season":season, "status":"NS"}, __league_namespace(league_id, season)).get("response")
         else:
             # Get team id for API
-            teams_endpoint = __url + "teams"
-            team_info_json = requests.get(teams_endpoint, params={"name":team_name}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            team_info_dict = json.loads(team_info_json.content).get("response")[0]
+            team_info_dict = __get_team_info(team_name)
             team_id = team_info_dict.get("team").get("id")
 
             # Get upcoming teams games for current season in closest to current date order for given tea,
-            future_games_json = requests.get(fixtures_endpoint, params={"team":team_id, "league":__league_id, "season":datetime.date.today().year, "status":"NS"}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-            future_games = json.loads(future_games_json.content).get("response")
+            future_games = __get_api_data("fixtures", {"team":team_id, "league":league_id, "season":season, "status":"NS"}, __league_namespace(league_id, season)).get("response")
     except Exception:
-        logging.error(Exception)
+        logging.exception("Error getting upcoming games")
         
         result = client.chat_postMessage(
                 channel=message["channel"],
@@ -341,14 +406,15 @@ def get_next_game_data(client, message, team_name = None, return_card = False):
                     "type": "section",
                     "text": {
                         "type": "plain_text",
-                        "text": "Unable to get upcoming games. Please ensure you have provided a valid EPL team name or try again later.",
+                        "text": f"Unable to get upcoming games. Please ensure you have provided a valid {league_name} team name or try again later.",
                         "emoji": False
                     }
                 },
             ])
+        return
 
     # Set header text based on whether a team was requested
-    header_text = f"Upcoming Games Featuring {team_name}" if team_name else "Upcoming English Premier League Games"
+    header_text = f"Upcoming Games Featuring {team_name}" if team_name else f"Upcoming {league_name} Games"
 
     # Create the card to hold the blocks
     upcoming_game_card = {
@@ -367,33 +433,28 @@ def get_next_game_data(client, message, team_name = None, return_card = False):
         ]
     }
 
+    # Limit the number of games displayed on each page to not overload the user's screen with a wall of info
+    # The App Home card always shows the first page
+    page_count = __get_page_count(len(future_games), __games_page_size)
+    page = 1 if return_card else min(max(int(page), 1), page_count)
+
     # If there are no upcoming games, add a message to the card and do not bother trying to parse the response
     if len(future_games) == 0:
         upcoming_game_card.get("blocks").append(
             {
-                "type": "plain_text",
-                "text": f"No upcoming games found for {team_name} in the current season.",
-                "emoji": False
+                "type": "section",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"No upcoming games found for {team_name or league_name} in the current season.",
+                    "emoji": False
+                }
             }
         )
     else:
-        # Create blocks for each game returned by the API
-        count = 0
-        for i in range(0, len(future_games)):
-            # Limit the number of games displayed to not overload the user's screen with a wall of info
-            if count == number_of_games: break
-
-            curr_game = future_games[i]
-
-            future_game_prediction = None
-
+        # Create blocks for each game on the page
+        for curr_game in future_games[(page - 1) * __games_page_size:page * __games_page_size]:
             # Get predicted winner for each game
-            try:
-                predictions_endpoint = __url + "predictions"
-                future_game_prediction_json = requests.get(predictions_endpoint, params={"fixture":curr_game.get("fixture").get("id")}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
-                future_game_prediction = json.loads(future_game_prediction_json.content).get("response")[0]
-            except Exception:
-                logging.error(Exception)
+            future_game_prediction = get_prediction(curr_game, league_id, season)
 
             # Extract data from game and prediction results
             next_games_data = __extract_next_games_data(curr_game, future_game_prediction)
@@ -421,17 +482,14 @@ def get_next_game_data(client, message, team_name = None, return_card = False):
             for item in curr_game_card:
                 upcoming_game_card.get("blocks").append(item)
 
-            count += 1
-
     # If a generic card was requested, return it
     # Primarily used for App Home
     if return_card: return upcoming_game_card
 
-    # Send team-specific blocks to client for display
-    client.chat_postMessage(
-                channel=message["channel"],
-                text="EPL Team Info Card",
-                blocks=json.dumps(upcoming_game_card.get("blocks")))
+    # Add the page buttons and send team-specific blocks to client for display
+    page_args = {"team_name": team_name, "league_id": league_id, "season": season}
+    upcoming_game_card.get("blocks").extend(__create_pagination_blocks("nextgames_page", page_args, page, page_count))
+    __send_card(client, message["channel"], f"{league_name} Team Info Card", upcoming_game_card.get("blocks"), update_ts)
 
 # Get top 3 standings and next 3 games to update the app home
 def get_app_home_data(client, event):
@@ -440,12 +498,20 @@ def get_app_home_data(client, event):
     result = db.get_favorite_team(user_id)
 
     team_name = None
+    league_id = None
     if result is not None:
         team_name = result.get("team_name")
+        league_id = result.get("league_id")
 
+    # Return the card
+    return json.dumps(get_app_home_blocks(team_name, league_id))
+
+# Get the list of blocks making up the app home for a user with the given favorite team
+# The app home shows the favorite team's league, or the default league if no favorite team is set
+def get_app_home_blocks(team_name = None, league_id = None):
     # Reuse standings and upcoming games functionality to get blocks with required data
-    top_3_standings_blocks = get_standings_data_all(None, None, True)
-    upcoming_games_blocks = get_next_game_data(None, None, team_name, True)
+    top_3_standings_blocks = get_standings_data_all(None, None, True, league_id)
+    upcoming_games_blocks = get_next_game_data(None, None, team_name, True, league_id)
 
     # Handle None responses
     if not top_3_standings_blocks or not upcoming_games_blocks:
@@ -496,21 +562,377 @@ def get_app_home_data(client, event):
     for item in upcoming_games_blocks.get("blocks"):
             app_home_blocks.get("blocks").append(item)
     
-    # Return the card
-    return json.dumps(app_home_blocks.get("blocks"))
+    return app_home_blocks.get("blocks")
 
-# Get the API's ID representing an EPL team
+# Get the API's ID representing a team
 def get_team_id(team_name):
-    teams_endpoint = __url + "teams"
-    team_info_json = requests.get(teams_endpoint, params={"name":team_name}, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")})
+    team_info = __get_api_data("teams", {"name":team_name}, __teams_namespace)
 
-    if json.loads(team_info_json.content).get("results") == 0:
+    if team_info.get("results") == 0:
         return None
     else:
-        team_info_dict = json.loads(team_info_json.content).get("response")[0]
+        team_info_dict = team_info.get("response")[0]
         team_id = team_info_dict.get("team").get("id")
         return team_id
+
+# Get the fixtures currently being played in the given leagues. Live data is never cached
+def get_live_fixtures(league_ids = None):
+    league_ids = league_ids or get_active_league_ids()
+    return __request_api_data("fixtures", {"live":"-".join(str(league_id) for league_id in league_ids)}).get("response")
+
+# Get the API's standings for a league's season
+def get_upstream_standings(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    standings_dict = __get_api_data("standings", {"league":league_id, "season":season}, __league_namespace(league_id, season))
+    return standings_dict.get("response")[0].get("league").get("standings")[0]
+
+# Get a league's standings from the configured standings source
+# Standings derived from fixture results fall back to the API's before any results are in
+def get_league_standings(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+
+    league_standings = None
+    if aggregation.standings_source == "local":
+        league_standings = aggregation.get_standings(league_id, season)
+
+    if not league_standings:
+        league_standings = get_upstream_standings(league_id, season)
+    return league_standings
+
+# Get every finished fixture in a league's season in oldest-newest order
+def get_finished_fixtures(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    return __get_api_data("fixtures", {"league":league_id, "season":season, "status":__finished_status_filter}, __league_namespace(league_id, season)).get("response")
+
+# Get every team in a league's season
+def get_league_teams(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    return __get_api_data("teams", {"league":league_id, "season":season}, __teams_namespace).get("response")
+
+# Get every upcoming fixture in a league's season in closest to current date order
+def get_upcoming_fixtures(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    return __get_api_data("fixtures", {"league":league_id, "season":season, "status":"NS"}, __league_namespace(league_id, season)).get("response")
+
+# Get the API's prediction for a fixture
+def get_upstream_prediction(fixture_id, league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    return __get_api_data("predictions", {"fixture":fixture_id}, __league_namespace(league_id, season)).get("response")[0]
+
+# Get the prediction for a fixture from the configured prediction source, falling back to the other source
+def get_prediction(fixture, league_id, season):
+    fixture_id = fixture.get("fixture").get("id")
+
+    if predictions.prediction_source == "local":
+        future_game_prediction = predictions.get_local_prediction(fixture_id, league_id, season)
+        if future_game_prediction is not None:
+            return future_game_prediction
+
+    try:
+        return get_upstream_prediction(fixture_id, league_id, season)
+    except Exception:
+        logging.exception(f"Could not get the API's prediction for fixture {fixture_id}")
+
+    if predictions.prediction_source != "local":
+        return predictions.get_local_prediction(fixture_id, league_id, season)
+    return None
+
+# Get one page of the players who have played in a league's season
+# Player data is bulk loaded into the player store, so it is not cached here
+def get_players_page(league_id, season, page):
+    return __request_api_data("players", {"league":league_id, "season":season, "page":page})
+
+# Get a single fixture by its ID. Used to get the final state of a fixture that is no longer live
+def get_fixture(fixture_id):
+    fixtures = __request_api_data("fixtures", {"id":fixture_id}).get("response")
+    return fixtures[0] if fixtures else None
+
+# Refresh the current season's standings and fixtures ahead of user requests
+# If the upstream data changed, the season's cached data is invalidated on every instance
+# and the data change listeners are told which teams were affected
+def prefetch_league_data(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    cache = cache_functions.get_cache()
+    namespace = __league_namespace(league_id, season)
+
+    # Only one instance sharing the cache needs to refresh the data each interval
+    if not cache.acquire_lock(f"prefetch:{namespace}", max(__prefetch_interval - 1, 1)):
+        return
+
+    try:
+        prefetch_team_index(league_id, season)
+    except Exception as e:
+        logging.error(f"Error prefetching teams for league {league_id}: {e}")
+
+    requests_to_refresh = [
+        ("standings", {"league":league_id, "season":season}),
+        ("fixtures", {"league":league_id, "season":season, "status":__finished_status_filter}),
+        ("fixtures", {"league":league_id, "season":season, "status":"NS"}),
+    ]
+
+    # GET fresh copies of the data and check whether any of it changed since the last refresh
+    refreshed = []
+    standings_changed = False
+    changed_team_ids = set()
+    for endpoint_path, params in requests_to_refresh:
+        key = __cache_key(endpoint_path, params)
+        api_dict = __request_api_data(endpoint_path, params)
+        if api_dict.get("errors"):
+            logging.error(f"Prefetch of {endpoint_path} failed: {api_dict.get('errors')}")
+            return
+
+        # Compare against the shared cached copy, which may have been refreshed by another instance or restored
+        # from a snapshot. It is usually just expiring when the next refresh runs, so stale copies are compared too
+        previous_dict = cache.get(namespace, key, allow_stale=True)
+        if previous_dict != api_dict:
+            if endpoint_path == "standings":
+                standings_changed = True
+            else:
+                changed_team_ids.update(__get_changed_fixture_team_ids(previous_dict, api_dict))
+        refreshed.append((endpoint_path, key, api_dict))
+
+    # Drop stale per-team and per-fixture data before storing the fresh copies
+    if standings_changed or changed_team_ids:
+        cache.invalidate(namespace)
+
+    for endpoint_path, key, api_dict in refreshed:
+        cache.set(namespace, key, api_dict, __cache_ttls.get(endpoint_path))
+
+    if standings_changed or changed_team_ids:
+        notify_data_change(league_id, season, standings_changed, changed_team_ids)
+
+# Cache every team in a league's season under the key a lookup by the team's name uses, so team
+# commands can be served without looking the team up in the API. Skipped while the season's team list is cached
+def prefetch_team_index(league_id, season):
+    cache = cache_functions.get_cache()
+    params = {"league":league_id, "season":season}
+    if cache.get(__teams_namespace, __cache_key("teams", params)) is not None:
+        return
+
+    api_dict = __request_api_data("teams", params)
+    if api_dict.get("errors"):
+        logging.error(f"Prefetch of teams failed: {api_dict.get('errors')}")
+        return
+
+    for team_entry in api_dict.get("response"):
+        team_dict = {"results": 1, "response": [team_entry]}
+        cache.set(__teams_namespace, __cache_key("teams", {"name":team_entry.get("team").get("name")}), team_dict, __cache_ttls.get("teams"))
+    cache.set(__teams_namespace, __cache_key("teams", params), api_dict, __cache_ttls.get("teams"))
+
+# Call every data change listener
+# Used by the prefetcher, and to pass on data changes found by another process
+def notify_data_change(league_id, season, standings_changed, changed_team_ids):
+    for callback in __data_change_listeners:
+        try:
+            callback(league_id, season, standings_changed, changed_team_ids)
+        except Exception as e:
+            logging.error(f"Data change listener failed: {e}")
+
+# Check whether a league's standings and fixtures are all in the cache, so commands for it can be served from memory
+def is_league_data_cached(league_id = None, season = None):
+    league_id, season = resolve_league_season(league_id, season)
+    cache = cache_functions.get_cache()
+    namespace = __league_namespace(league_id, season)
+
+    cached_requests = [
+        ("standings", {"league":league_id, "season":season}),
+        ("fixtures", {"league":league_id, "season":season, "status":__finished_status_filter}),
+        ("fixtures", {"league":league_id, "season":season, "status":"NS"}),
+    ]
+    # Expired copies count, such as those loaded from a snapshot, as they are served if the API fails before they are refreshed
+    return all(cache.get(namespace, __cache_key(endpoint_path, params), allow_stale=True) is not None for endpoint_path, params in cached_requests)
+
+# Register a function called after a refresh finds new data
+# It is called with the league and season, whether the standings changed, and the set of team IDs whose fixtures changed
+def add_data_change_listener(callback):
+    __data_change_listeners.append(callback)
+
+# Start a background thread that refreshes the current season of every active league each prefetch interval
+def start_prefetcher():
+    def prefetch_loop():
+        while True:
+            for league_id in get_active_league_ids():
+                try:
+                    scheduler.run(scheduler.BACKGROUND, prefetch_league_data, league_id)
+                except Exception as e:
+                    logging.error(f"Error prefetching data for league {league_id}: {e}")
+            time.sleep(__prefetch_interval)
+
+    prefetch_thread = threading.Thread(target=prefetch_loop, name="league-prefetcher", daemon=True)
+    prefetch_thread.start()
+    return prefetch_thread
+
+# Get the IDs of the teams playing in fixtures that differ between two fixtures responses
+def __get_changed_fixture_team_ids(previous_dict, api_dict):
+    previous_fixtures = {f.get("fixture").get("id"): f for f in (previous_dict or {}).get("response") or []}
+    current_fixtures = {f.get("fixture").get("id"): f for f in api_dict.get("response") or []}
+
+    changed_team_ids = set()
+    for fixture_id in previous_fixtures.keys() | current_fixtures.keys():
+        previous_fixture = previous_fixtures.get(fixture_id)
+        current_fixture = current_fixtures.get(fixture_id)
+        if previous_fixture == current_fixture:
+            continue
+
+        for fixture in (previous_fixture, current_fixture):
+            if fixture is not None:
+                changed_team_ids.add(fixture.get("teams").get("home").get("id"))
+                changed_team_ids.add(fixture.get("teams").get("away").get("id"))
+    return changed_team_ids
+
+# Get the API's league ID for a league given by its name in commands or by its ID
+# Returns None if the league is not recognized
+def get_league_id(league):
+    if league is None:
+        return __default_league_id
+
+    league = str(league).strip().lower()
+    if league in leagues:
+        return leagues.get(league).get("id")
+    if league.isdigit():
+        return int(league)
+    return None
+
+# Get the display name of a league
+def get_league_name(league_id):
+    for league in leagues.values():
+        if league.get("id") == league_id:
+            return league.get("name")
+    return f"League {league_id}"
+
+# Get the IDs of the leagues the bot keeps fresh in the background, set by ACTIVE_LEAGUES
+def get_active_league_ids():
+    active_leagues = os.environ.get("ACTIVE_LEAGUES")
+    if not active_leagues:
+        return [__default_league_id]
+
+    league_ids = [get_league_id(league) for league in active_leagues.split(",") if league.strip()]
+    return [league_id for league_id in league_ids if league_id is not None]
+
+# Get the season currently being played in a league
+# Seasons are identified by the year they start in, so a season spanning two calendar
+# years is still the current season in the January after it started
+def get_current_season(league_id = None):
+    league_id = league_id or __default_league_id
+
+    try:
+        league_info = __get_api_data("leagues", {"id":league_id, "current":"true"}, __leagues_namespace).get("response")
+        return league_info[0].get("seasons")[0].get("year")
+    except Exception as e:
+        logging.error(f"Unable to get current season for league {league_id}: {e}")
+
+    # Most leagues start their season in the second half of the year
+    today = datetime.date.today()
+    return today.year if today.month >= 7 else today.year - 1
+
+# Fill in the default league and its current season when they are not given
+# The league can be given by its name or ID. Raises ValueError if the league or season is not valid
+def resolve_league_season(league_id = None, season = None):
+    resolved_league_id = get_league_id(league_id or None)
+    if resolved_league_id is None:
+        raise ValueError(f"Unknown league {league_id}")
+
+    season = season or get_current_season(resolved_league_id)
+    if not str(season).strip().isdigit() or len(str(season).strip()) != 4:
+        raise ValueError(f"Invalid season {season}")
+    return int(resolved_league_id), int(season)
+
+# Get the cache namespace for a league and season
+def __league_namespace(league_id, season):
+    return cache_functions.make_namespace(league_id, season)
+
+# Build the key a request to the API is cached under
+def __cache_key(endpoint_path, params):
+    return endpoint_path + "?" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+# GET data from an API endpoint and parse the JSON response
+# Each endpoint has its own circuit breaker, so one failing endpoint does not stop requests to the others.
+# Raises CircuitOpenError without making the request while the endpoint's breaker is open
+def __request_api_data(endpoint_path, params):
+    def request():
+        api_json = requests.get(__url + endpoint_path, params=params, headers={"x-apisports-key":os.environ.get("FOOTBALL_API_TOKEN")}, timeout=__request_timeout)
+        api_json.raise_for_status()
+        return json.loads(api_json.content)
+
+    return breakers.get_breaker(f"football_api:{endpoint_path}").call(request)
+
+# GET data from an API endpoint, serving it from the cache when it has already been requested
+def __get_api_data(endpoint_path, params, namespace):
+    cache = cache_functions.get_cache()
+    key = __cache_key(endpoint_path, params)
+
+    api_dict = cache.get(namespace, key)
+    if api_dict is not None:
+        return api_dict
+
+    try:
+        api_dict = __request_api_data(endpoint_path, params)
+    except Exception as e:
+        # Serve the last cached copy, even if it has expired, while the API is failing
+        api_dict = cache.get(namespace, key, allow_stale=True)
+        if api_dict is None:
+            raise
+        logging.error(f"Serving stale {endpoint_path} data: {e}")
+        return api_dict
+
+    # Do not cache error responses so the next request tries again
+    if not api_dict.get("errors"):
+        cache.set(namespace, key, api_dict, __cache_ttls.get(endpoint_path))
+    return api_dict
+
+# Get the API's team info for a team name. Raises IndexError if the team does not exist
+def __get_team_info(team_name):
+    return __get_api_data("teams", {"name":team_name}, __teams_namespace).get("response")[0]
     
+# Get the number of pages needed to show a list. An empty list still has one page
+def __get_page_count(item_count, page_size):
+    return max((item_count + page_size - 1) // page_size, 1)
+
+# Create the blocks that let the user move between the pages of a list
+# Each button's value holds the arguments needed to render its page, and its action ID starts with action_prefix
+def __create_pagination_blocks(action_prefix, page_args, page, page_count):
+    if page_count <= 1:
+        return []
+
+    buttons = []
+    if page > 1:
+        buttons.append({
+            "type": "button",
+            "text": {"type": "plain_text", "text": "◀ Previous", "emoji": True},
+            "action_id": f"{action_prefix}_previous",
+            "value": json.dumps(dict(page_args, page=page - 1)),
+        })
+    if page < page_count:
+        buttons.append({
+            "type": "button",
+            "text": {"type": "plain_text", "text": "Next ▶", "emoji": True},
+            "action_id": f"{action_prefix}_next",
+            "value": json.dumps(dict(page_args, page=page + 1)),
+        })
+
+    pagination_blocks = [
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"Page {page} of {page_count}"
+                }
+            ]
+        },
+        {
+            "type": "actions",
+            "elements": buttons
+        },
+    ]
+    return pagination_blocks
+
+# Post a card to a channel, or update the message with the given timestamp to show it instead
+def __send_card(client, channel, text, blocks, update_ts = None):
+    if update_ts:
+        return client.chat_update(channel=channel, ts=update_ts, text=text, blocks=json.dumps(blocks))
+    return client.chat_postMessage(channel=channel, text=text, blocks=json.dumps(blocks))
+
 # Create set of blocks representing standings for a team
 def __create_team_card_block(team_data):
     # Invoke None error handling in caller
@@ -528,9 +950,9 @@ def __create_team_card_block(team_data):
     team_home_wins = team_data.get("team_home_wins")
     team_home_draws = team_data.get("team_home_draws")
     team_home_losses = team_data.get("team_home_losses")
-    team_away_wins = team_data.get("team_wins")
-    team_away_draws = team_data.get("team_draws")
-    team_away_losses = team_data.get("team_losses")
+    team_away_wins = team_data.get("team_away_wins")
+    team_away_draws = team_data.get("team_away_draws")
+    team_away_losses = team_data.get("team_away_losses")
 
     # Create the blocks and inject values
     standings_entry = [
@@ -837,6 +1259,11 @@ def __extract_next_games_data(curr_game, future_game_prediction):
         "venue_city" : curr_game.get("fixture").get("venue").get("city"),
         "season_round" : curr_game.get("league").get("round"),
         "game_datetime" : str(date_object),
-        "predicted_winner": future_game_prediction.get("predictions").get("winner").get("name") or "Prediction Unavailable"
+        "predicted_winner": "Prediction Unavailable"
     }
+
+    # There is no prediction if both prediction sources failed
+    if future_game_prediction is not None:
+        predicted_winner = future_game_prediction.get("predictions").get("winner") or {}
+        next_games_data["predicted_winner"] = predicted_winner.get("name") or "Prediction Unavailable"
     return next_games_data
@@ -0,0 +1,118 @@
+# status_functions.py
+# This class is responsible for reporting the health, readiness and metrics of the bot over HTTP
+# /health answers as long as the process is running, and /ready only answers with 200 once the
+# cache holds the data for every active league, so a load balancer or orchestrator only sends
+# traffic to instances that can serve commands from memory
+# /metrics reports the state of every circuit breaker, and the scheduler's queues and queue waits,
+# in the Prometheus text format
+
+import os
+import json
+import time
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sports_api_functions as sports_api
+import snapshot_functions as snapshots
+import circuit_breaker_functions as breakers
+import scheduler_functions as scheduler
+
+# Port the health, readiness and metrics endpoints are served on
+__health_port = int(os.environ.get("HEALTH_PORT", 8080))
+
+# Get the readiness of the bot, with the cache warmth of every active league
+def get_readiness():
+    league_warmth = {}
+    for league_id in sports_api.get_active_league_ids():
+        try:
+            league_warmth[str(league_id)] = sports_api.is_league_data_cached(league_id)
+        except Exception as e:
+            logging.error(f"Unable to check cache warmth for league {league_id}: {e}")
+            league_warmth[str(league_id)] = False
+
+    readiness = {
+        "ready": all(league_warmth.values()),
+        "leagues": league_warmth,
+        "snapshot_entries_loaded": snapshots.loaded_entry_count,
+    }
+    return readiness
+
+# Get the bot's metrics in the Prometheus text format
+def get_metrics_text():
+    state_values = {breakers.CLOSED: 0, breakers.HALF_OPEN: 1, breakers.OPEN: 2}
+    breaker_metrics = breakers.get_breaker_metrics()
+
+    lines = [
+        "# HELP sportsbot_circuit_breaker_state Circuit breaker state, 0 closed, 1 half open, 2 open",
+        "# TYPE sportsbot_circuit_breaker_state gauge",
+    ]
+    lines.extend(f'sportsbot_circuit_breaker_state{{breaker="{name}"}} {state_values.get(m.get("state"))}' for name, m in breaker_metrics.items())
+
+    for count_name, description in (("calls", "Calls let through"), ("failures", "Calls that failed"),
+                                    ("rejections", "Calls failed fast while open"), ("opens", "Times opened")):
+        lines.append(f"# HELP sportsbot_circuit_breaker_{count_name}_total {description}")
+        lines.append(f"# TYPE sportsbot_circuit_breaker_{count_name}_total counter")
+        lines.extend(f'sportsbot_circuit_breaker_{count_name}_total{{breaker="{name}"}} {m.get(count_name)}' for name, m in breaker_metrics.items())
+
+    scheduler_metrics = scheduler.get_scheduler_metrics()
+    for count_name, description in (("queued", "Tasks waiting for a worker"), ("running", "Tasks being run by a worker")):
+        lines.append(f"# HELP sportsbot_scheduler_{count_name} {description}")
+        lines.append(f"# TYPE sportsbot_scheduler_{count_name} gauge")
+        lines.extend(f'sportsbot_scheduler_{count_name}{{class="{priority_class}"}} {m.get(count_name)}' for priority_class, m in scheduler_metrics.items())
+
+    lines.append("# HELP sportsbot_queue_wait_seconds Time tasks waited in a queue before they started")
+    lines.append("# TYPE sportsbot_queue_wait_seconds histogram")
+    for (queue_name, priority_class), histogram in sorted(scheduler.get_queue_wait_metrics().items()):
+        labels = f'queue="{queue_name}",class="{priority_class}"'
+        lines.extend(f'sportsbot_queue_wait_seconds_bucket{{{labels},le="{upper_bound}"}} {count}' for upper_bound, count in zip(scheduler.queue_wait_buckets, histogram.get("buckets")))
+        lines.append(f'sportsbot_queue_wait_seconds_bucket{{{labels},le="+Inf"}} {histogram.get("count")}')
+        lines.append(f'sportsbot_queue_wait_seconds_sum{{{labels}}} {histogram.get("sum")}')
+        lines.append(f'sportsbot_queue_wait_seconds_count{{{labels}}} {histogram.get("count")}')
+    return "\n".join(lines) + "\n"
+
+# Wait until the cache is warm, or until the timeout passes. Returns whether the bot is ready
+def wait_until_ready(timeout, poll_interval = 1):
+    deadline = time.time() + timeout
+
+    while True:
+        if get_readiness().get("ready"):
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(poll_interval)
+
+# Handles requests to the health, readiness and metrics endpoints
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/ready":
+            readiness = get_readiness()
+            self.send_json(200 if readiness.get("ready") else 503, readiness)
+        elif self.path == "/metrics":
+            self.send_content(200, "text/plain; version=0.0.4", get_metrics_text().encode())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def send_json(self, status, body):
+        self.send_content(status, "application/json", json.dumps(body).encode())
+
+    def send_content(self, status, content_type, content):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # Probes hit these endpoints every few seconds, so requests are not logged
+    def log_message(self, format, *args):
+        pass
+
+# Start serving the health and readiness endpoints in a background thread
+def start_status_server(port = __health_port):
+    server = ThreadingHTTPServer(("", port), StatusRequestHandler)
+    server_thread = threading.Thread(target=server.serve_forever, name="status-server", daemon=True)
+    server_thread.start()
+    logging.info(f"Serving health and readiness endpoints on port {port}")
+    return server
@@ -0,0 +1,19 @@
+# conftest.py
+# Makes the bot's modules importable in tests, the same way app.py imports them from src
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# The DynamoDB resource is created when its module is imported, and needs a region and credentials
+# Tests that use DynamoDB run against moto, so the credentials are never sent anywhere
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+# moto hooks into the AWS clients created after it is imported, so it is imported before any bot module
+try:
+    import moto
+except ImportError:
+    pass
@@ -0,0 +1,155 @@
+# test_aggregation_functions.py
+# Tests for the league table derived from fixture results
+
+import pytest
+
+import aggregation_functions as aggregation
+import cache_functions
+import sports_api_functions as sports_api
+
+def make_fixture(fixture_id, status, home_id, away_id, home_goals, away_goals, home_winner = None, away_winner = None):
+    return {
+        "fixture": {"id": fixture_id, "status": {"short": status}},
+        "teams": {
+            "home": {"id": home_id, "name": f"Team {home_id}", "winner": home_winner},
+            "away": {"id": away_id, "name": f"Team {away_id}", "winner": away_winner},
+        },
+        "goals": {"home": home_goals, "away": away_goals},
+    }
+
+@pytest.fixture
+def league(monkeypatch):
+    monkeypatch.setattr(aggregation, "__aggregates", {})
+    cache = cache_functions.LRUCacheBackend(100)
+    monkeypatch.setattr(cache_functions, "get_cache", lambda: cache)
+    monkeypatch.setattr(sports_api, "resolve_league_season", lambda league_id, season: (league_id, season))
+
+    fixtures = []
+    teams = [{"team": {"id": team_id, "name": f"Team {team_id}"}} for team_id in (1, 2, 3, 4)]
+    monkeypatch.setattr(sports_api, "get_finished_fixtures", lambda league_id, season: list(fixtures))
+    monkeypatch.setattr(sports_api, "get_league_teams", lambda league_id, season: teams)
+    return fixtures, teams
+
+def table(league_id = 39, season = 2024):
+    return {entry.get("team").get("id"): entry for entry in aggregation.get_standings(league_id, season)}
+
+def test_table_counts_every_finished_status(league):
+    fixtures, teams = league
+    fixtures.extend([
+        make_fixture(1, "FT", 1, 2, 2, 0),
+        make_fixture(2, "AET", 2, 3, 1, 1),
+        make_fixture(3, "PEN", 3, 1, 0, 0),
+        make_fixture(4, "AWD", 2, 1, None, None, home_winner=True, away_winner=False),
+    ])
+
+    standings = table()
+    assert standings[1].get("all").get("played") == 3
+    assert standings[1].get("points") == 4
+    assert standings[2].get("points") == 4
+    assert standings[2].get("all").get("goals") == {"for": 4, "against": 3}
+    assert standings[3].get("points") == 2
+    assert [entry.get("team").get("id") for entry in aggregation.get_standings(39, 2024)] == [2, 1, 3, 4]
+
+def test_teams_without_results_are_in_the_table(league):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+
+    standings = table()
+    assert sorted(standings) == [1, 2, 3, 4]
+    assert standings[4].get("all").get("played") == 0
+    assert aggregation.get_team_statistics(4, 39, 2024).get("fixtures").get("played").get("total") == 0
+
+def test_corrected_score_is_applied(league):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    assert table()[1].get("points") == 3
+
+    fixtures[0] = make_fixture(1, "FT", 1, 2, 1, 1)
+    standings = table()
+    assert standings[1].get("points") == 1
+    assert standings[1].get("all").get("played") == 1
+    assert standings[2].get("points") == 1
+
+def test_point_adjustments_survive_a_rebuild(league):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    upstream = list(aggregation.get_standings(39, 2024))
+    upstream[0] = dict(upstream[0], points=upstream[0].get("points") - 2)
+
+    assert aggregation.check_consistency(39, 2024, upstream) == []
+    assert table()[1].get("points") == 1
+
+    fixtures.append(make_fixture(2, "FT", 3, 1, 0, 1))
+    assert table()[1].get("points") == 4
+
+def test_table_is_empty_without_the_league_teams(league, monkeypatch):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    monkeypatch.setattr(sports_api, "get_league_teams", lambda league_id, season: None)
+
+    # The caller then falls back to the API's standings
+    assert aggregation.get_standings(39, 2024) == []
+    assert aggregation.get_team_statistics(1, 39, 2024).get("fixtures").get("wins").get("total") == 1
+
+def test_new_results_are_applied_once(league, monkeypatch):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    table()
+
+    applied = []
+    apply_fixture_result = aggregation.apply_fixture_result
+    monkeypatch.setattr(aggregation, "apply_fixture_result", lambda aggregate, fixture: applied.append(fixture.get("fixture").get("id")) or apply_fixture_result(aggregate, fixture))
+
+    # Unchanged results are not counted again
+    fixtures.append(make_fixture(2, "FT", 3, 4, 2, 2))
+    standings = table()
+    assert standings[1].get("all").get("played") == 1
+    assert standings[3].get("points") == 1
+    assert aggregation.get_aggregate(39, 2024).get("applied").keys() == {1, 2}
+
+    # The same cached response is not looked at again
+    cached = list(fixtures)
+    monkeypatch.setattr(sports_api, "get_finished_fixtures", lambda league_id, season: cached)
+    applied.clear()
+    table()
+    table()
+    assert applied == [1, 2]
+
+def test_results_no_longer_finished_are_removed(league):
+    fixtures, teams = league
+    fixtures.extend([make_fixture(1, "FT", 1, 2, 1, 0), make_fixture(2, "FT", 3, 4, 0, 1)])
+    assert table()[1].get("points") == 3
+
+    del fixtures[0]
+    standings = table()
+    assert standings[1].get("all").get("played") == 0
+    assert standings[2].get("points") == 0
+    assert standings[4].get("points") == 3
+
+def test_league_teams_are_not_refetched_on_every_call(league, monkeypatch):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    calls = []
+    monkeypatch.setattr(sports_api, "get_league_teams", lambda league_id, season: calls.append(league_id))
+
+    assert table() == {}
+    assert table() == {}
+    assert len(calls) == 1
+
+    # Once the retry interval has passed the teams are fetched again
+    monkeypatch.setattr(aggregation, "__teams_retry_interval", 0)
+    monkeypatch.setattr(sports_api, "get_league_teams", lambda league_id, season: teams)
+    standings = table()
+    assert sorted(standings) == [1, 2, 3, 4]
+    assert standings[1].get("points") == 3
+
+def test_point_adjustments_are_shared_through_the_cache(league, monkeypatch):
+    fixtures, teams = league
+    fixtures.append(make_fixture(1, "FT", 1, 2, 1, 0))
+    upstream = list(aggregation.get_standings(39, 2024))
+    upstream[0] = dict(upstream[0], points=upstream[0].get("points") - 2)
+    assert aggregation.check_consistency(39, 2024, upstream) == []
+
+    # Another process sharing the cache, such as a prefork worker, has its own aggregates
+    monkeypatch.setattr(aggregation, "__aggregates", {})
+    assert table()[1].get("points") == 1
@@ -0,0 +1,123 @@
+# test_analytics_functions.py
+# Tests for the vectorized form and head-to-head analytics, checked against a simple loop over the fixtures
+
+import random
+
+import pytest
+
+import analytics_functions as analytics
+import sports_api_functions as sports_api
+
+def make_fixture(fixture_id, timestamp, home_id, away_id, home_goals, away_goals):
+    return {
+        "fixture": {"id": fixture_id, "timestamp": timestamp},
+        "teams": {"home": {"id": home_id, "name": f"Team {home_id}"}, "away": {"id": away_id, "name": f"Team {away_id}"}},
+        "goals": {"home": home_goals, "away": away_goals},
+    }
+
+# A season where every pair of six teams meets a few times, listed out of date order
+def make_season(seed = 7):
+    rng = random.Random(seed)
+    fixtures = []
+    for home_id in range(1, 7):
+        for away_id in range(1, 7):
+            for meeting in range(2):
+                if home_id != away_id:
+                    fixtures.append(make_fixture(len(fixtures) + 1, rng.randrange(10 ** 6), home_id, away_id, rng.randrange(5), rng.randrange(5)))
+    rng.shuffle(fixtures)
+    return fixtures
+
+# Form of every team worked out one fixture at a time
+def loop_team_form(fixtures, form_games):
+    games = {}
+    for fixture in sorted(fixtures, key=lambda f: f.get("fixture").get("timestamp")):
+        home = fixture.get("teams").get("home")
+        away = fixture.get("teams").get("away")
+        home_goals = fixture.get("goals").get("home")
+        away_goals = fixture.get("goals").get("away")
+        games.setdefault(home.get("id"), []).append(("home", home_goals, away_goals))
+        games.setdefault(away.get("id"), []).append(("away", away_goals, home_goals))
+
+    team_form = {}
+    for team_id, team_games in games.items():
+        letters = ["W" if gf > ga else "D" if gf == ga else "L" for side, gf, ga in team_games]
+        points = [3 if gf > ga else 1 if gf == ga else 0 for side, gf, ga in team_games]
+        differences = [gf - ga for side, gf, ga in team_games]
+        running = [sum(differences[:i + 1]) for i in range(len(differences))]
+
+        def split(side):
+            split_games = [(gf, ga) for game_side, gf, ga in team_games if side in (None, game_side)]
+            return {
+                "played": len(split_games),
+                "wins": sum(1 for gf, ga in split_games if gf > ga),
+                "draws": sum(1 for gf, ga in split_games if gf == ga),
+                "losses": sum(1 for gf, ga in split_games if gf < ga),
+                "goals_for": sum(gf for gf, ga in split_games),
+                "goals_against": sum(ga for gf, ga in split_games),
+            }
+
+        team_form[team_id] = {
+            "team_name": f"Team {team_id}",
+            "form": "".join(letters[-form_games:]),
+            "recent_points": sum(points[-form_games:]),
+            "recent_goal_difference": sum(differences[-form_games:]),
+            "previous_goal_difference": sum(differences[-2 * form_games:-form_games]),
+            "goal_difference_trend": running[-2 * form_games:],
+            "splits": {"total": split(None), "home": split("home"), "away": split("away")},
+        }
+    return team_form
+
+@pytest.mark.parametrize("form_games", [1, 3, 5])
+def test_team_form_matches_a_loop_over_the_fixtures(form_games):
+    fixtures = make_season()
+    columns = analytics.build_fixture_columns(fixtures)
+    assert analytics.compute_team_form(columns, form_games) == loop_team_form(fixtures, form_games)
+
+def test_team_form_of_a_season_without_results():
+    assert analytics.compute_team_form(analytics.build_fixture_columns([])) == {}
+
+@pytest.mark.parametrize("team_a_id, team_b_id", [(1, 2), (2, 1), (3, 6), (1, 99)])
+def test_head_to_head_matches_a_loop_over_the_fixtures(team_a_id, team_b_id):
+    fixtures = make_season()
+    meetings = sorted(
+        (f for f in fixtures if {f.get("teams").get("home").get("id"), f.get("teams").get("away").get("id")} == {team_a_id, team_b_id}),
+        key=lambda f: f.get("fixture").get("timestamp"))
+
+    a_goals = [f.get("goals").get("home") if f.get("teams").get("home").get("id") == team_a_id else f.get("goals").get("away") for f in meetings]
+    b_goals = [f.get("goals").get("away") if f.get("teams").get("home").get("id") == team_a_id else f.get("goals").get("home") for f in meetings]
+    expected = {
+        "team_a_wins": sum(1 for a, b in zip(a_goals, b_goals) if a > b),
+        "team_b_wins": sum(1 for a, b in zip(a_goals, b_goals) if a < b),
+        "draws": sum(1 for a, b in zip(a_goals, b_goals) if a == b),
+        "team_a_goals": sum(a_goals),
+        "team_b_goals": sum(b_goals),
+        "games": [
+            {
+                "timestamp": f.get("fixture").get("timestamp"),
+                "home_id": f.get("teams").get("home").get("id"),
+                "away_id": f.get("teams").get("away").get("id"),
+                "home_goals": f.get("goals").get("home"),
+                "away_goals": f.get("goals").get("away"),
+            }
+            for f in meetings
+        ],
+    }
+
+    columns = analytics.build_fixture_columns(fixtures)
+    assert analytics.compute_head_to_head(columns, team_a_id, team_b_id) == expected
+
+def test_corrected_result_is_not_served_stale(monkeypatch):
+    monkeypatch.setattr(analytics, "__analytics", {})
+    monkeypatch.setattr(sports_api, "resolve_league_season", lambda league_id, season: (league_id, season))
+    fixtures = [make_fixture(1, 100, 1, 2, 1, 0), make_fixture(2, 200, 2, 1, 0, 0)]
+    monkeypatch.setattr(sports_api, "get_finished_fixtures", lambda league_id, season: list(fixtures))
+
+    assert analytics.get_season_analytics(39, 2024).get("team_form").get(1).get("form") == "WD"
+
+    # Same number of fixtures and the same latest fixture, with a corrected score
+    fixtures[0] = make_fixture(1, 100, 1, 2, 1, 3)
+    assert analytics.get_season_analytics(39, 2024).get("team_form").get(1).get("form") == "LD"
+
+    # Unchanged results keep the computed analytics
+    computed = analytics.get_season_analytics(39, 2024)
+    assert analytics.get_season_analytics(39, 2024) is computed
@@ -0,0 +1,122 @@
+# test_app.py
+# Tests for the command grammar and the page button handlers
+
+import re
+import json
+import importlib
+
+import pytest
+from slack_sdk import WebClient
+from slack_sdk.web import SlackResponse
+
+import sports_api_functions as sports_api
+
+from test_sports_api_functions import RecordingClient, make_standing, read_page
+
+# Import the Bolt app without a Slack workspace
+# Bolt checks the bot token with auth.test when the app is created, so the check is answered locally
+@pytest.fixture(scope="module")
+def app():
+    def auth_test(self, **kwargs):
+        return SlackResponse(client=self, http_verb="POST", api_url="auth.test", req_args={}, headers={}, status_code=200,
+                             data={"ok": True, "user_id": "U0", "bot_id": "B0", "team_id": "T0", "url": "https://test.slack.com/"})
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+        mp.setenv("SLACK_SIGNING_SECRET", "secret")
+        mp.setattr(WebClient, "auth_test", auth_test)
+        yield importlib.import_module("app")
+
+# Build the body Slack sends when a page button on a message is clicked
+def click(button_value, action_id, message_ts = "1700000000.000100"):
+    return {
+        "actions": [{"action_id": action_id, "value": json.dumps(button_value)}],
+        "channel": {"id": "C1"},
+        "message": {"ts": message_ts},
+    }
+
+@pytest.fixture
+def standings(monkeypatch):
+    table = [make_standing(rank) for rank in range(1, 13)]
+    monkeypatch.setattr(sports_api, "get_league_standings", lambda league_id, season: table)
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "La Liga")
+    return table
+
+def test_standings_buttons_round_trip_through_the_action_handler(app, standings):
+    client = RecordingClient()
+    sports_api.get_standings_data_all(client, {"channel": "C1"}, league_id=140, season=2022)
+    buttons = read_page(client.calls[0][1].get("blocks"))[2]
+
+    # Each click updates the original message to the page the button names, keeping the league and season
+    acks = []
+    visited = []
+    for action_id in ("standings_page_next", "standings_page_next", "standings_page_previous"):
+        client.calls.clear()
+        app.standings_page(lambda: acks.append(action_id), click(buttons.get(action_id), action_id), client)
+
+        [(method, kwargs)] = client.calls
+        assert method == "chat_update"
+        assert (kwargs.get("channel"), kwargs.get("ts")) == ("C1", "1700000000.000100")
+        team_names, labels, buttons = read_page(kwargs.get("blocks"))
+        visited.append(labels[0])
+        assert all((value.get("league_id"), value.get("season")) == (140, 2022) for value in buttons.values())
+
+    assert visited == ["Page 2 of 3", "Page 3 of 3", "Page 2 of 3"]
+    assert len(acks) == 3
+
+def test_past_games_buttons_round_trip_through_the_action_handler(app, monkeypatch):
+    games = [{
+        "fixture": {"id": game_id, "date": f"2024-08-{game_id:02d}T14:00:00+00:00", "venue": {"name": "Stadium", "city": "City"}},
+        "teams": {"home": {"id": 1, "name": "Arsenal"}, "away": {"id": game_id + 1, "name": f"Team {game_id + 1}"}},
+        "goals": {"home": 1, "away": 0},
+    } for game_id in range(1, 8)]
+    monkeypatch.setattr(sports_api, "__get_team_info", lambda team_name: {"team": {"id": 1}})
+    monkeypatch.setattr(sports_api, "__get_api_data", lambda endpoint_path, params, namespace: {"response": games})
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "EPL")
+
+    client = RecordingClient()
+    sports_api.get_past_games_data(client, {"channel": "C1"}, "Arsenal", league_id=39, season=2024)
+    buttons = read_page(client.calls[0][1].get("blocks"))[2]
+    assert buttons == {"pastgames_page_next": {"team_name": "Arsenal", "league_id": 39, "season": 2024, "page": 2}}
+
+    # The last page holds the oldest game
+    for page in (2, 3):
+        client.calls.clear()
+        app.past_games_page(lambda: None, click(buttons.get("pastgames_page_next"), "pastgames_page_next"), client)
+        [(method, kwargs)] = client.calls
+        assert method == "chat_update"
+        team_names, labels, buttons = read_page(kwargs.get("blocks"))
+        assert labels == [f"Page {page} of 3"]
+    assert team_names == ["Team 2"]
+    assert list(buttons) == ["pastgames_page_previous"]
+
+def test_next_games_button_passes_the_team_to_the_page(app, monkeypatch):
+    requests = []
+    monkeypatch.setattr(sports_api, "get_next_game_data", lambda client, message, team_name, **kwargs: requests.append((message, team_name, kwargs)))
+    value = {"team_name": "Arsenal", "league_id": 39, "season": 2024, "page": 2}
+    app.next_games_page(lambda: None, click(value, "nextgames_page_next"), None)
+
+    assert requests == [({"channel": "C1"}, "Arsenal", {"league_id": 39, "season": 2024, "page": 2, "update_ts": "1700000000.000100"})]
+
+@pytest.mark.parametrize("text, command, expected", [
+    ("standings", "", ("Standings", None, None)),
+    ("team arsenal", "team", ("Arsenal", None, None)),
+    ("team real madrid league:laliga", "team", ("Real Madrid", 140, None)),
+    ("team real madrid LEAGUE:LaLiga season:2022", "team", ("Real Madrid", 140, 2022)),
+    ("pastgames season:2019 league:61 paris saint germain", "pastgames", ("Paris Saint Germain", 61, 2019)),
+    ("nextgames league:bundesliga", "nextgames", ("", 78, None)),
+])
+def test_league_and_season_options_are_parsed(app, text, command, expected):
+    assert getattr(app, "__parse_command")(text, command) == expected
+
+@pytest.mark.parametrize("text, message", [
+    ("team arsenal league:nowhere", "Unknown league *nowhere*"),
+    ("team arsenal league:", "Unknown league"),
+    ("team arsenal season:22", "Invalid season *22*"),
+    ("team arsenal season:2022/23", "Invalid season *2022/23*"),
+    ("team arsenal season:last", "Invalid season *last*"),
+    ("team arsenal season:", "Invalid season"),
+])
+def test_invalid_league_and_season_options_are_rejected(app, text, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        getattr(app, "__parse_command")(text, "team")
@@ -0,0 +1,77 @@
+# test_cache_functions.py
+# Tests for the LRU and Redis cache backends
+
+import time
+
+import pytest
+
+import cache_functions
+
+@pytest.fixture
+def redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    return cache_functions.create_cache("redis", redis_client=fakeredis.FakeRedis())
+
+def test_lru_evicts_least_recently_used():
+    cache = cache_functions.LRUCacheBackend(2)
+    cache.set("ns", "a", 1)
+    cache.set("ns", "b", 2)
+    cache.get("ns", "a")
+    cache.set("ns", "c", 3)
+
+    assert cache.get("ns", "a") == 1
+    assert cache.get("ns", "b") is None
+    assert cache.get("ns", "c") == 3
+
+def test_lru_serves_expired_entries_only_when_stale_is_allowed():
+    cache = cache_functions.LRUCacheBackend(10)
+    cache.set("ns", "a", 1, ttl=-1)
+
+    assert cache.get("ns", "a") is None
+    assert cache.get("ns", "a", allow_stale=True) == 1
+
+def test_redis_get_set_and_invalidate(redis_cache):
+    redis_cache.set("39:2024", "standings", {"rank": 1}, ttl=300)
+    redis_cache.set("39:2025", "standings", {"rank": 2}, ttl=300)
+    assert redis_cache.get("39:2024", "standings") == {"rank": 1}
+
+    redis_cache.invalidate("39:2024")
+    assert redis_cache.get("39:2024", "standings") is None
+    assert redis_cache.get("39:2025", "standings") == {"rank": 2}
+
+def test_redis_serves_expired_entries_only_when_stale_is_allowed(redis_cache):
+    redis_cache.set("ns", "a", 1, ttl=300)
+    redis_cache.client.hset(redis_cache.namespace_key("ns"), "a", cache_functions.serialize_record(1, time.time() - 1))
+
+    assert redis_cache.get("ns", "a") is None
+    assert redis_cache.get("ns", "a", allow_stale=True) == 1
+
+def test_redis_short_ttl_does_not_shorten_namespace_lifetime(redis_cache):
+    namespace_key = redis_cache.namespace_key("39:2024")
+    redis_cache.set("39:2024", "prediction", {"winner": "Arsenal"}, ttl=3600)
+    redis_cache.set("39:2024", "standings", {"rank": 1}, ttl=300)
+
+    assert redis_cache.client.ttl(namespace_key) > 600
+    redis_cache.set("39:2024", "predictions", {"winner": "Chelsea"}, ttl=7200)
+    assert redis_cache.client.ttl(namespace_key) > 7200
+
+def test_redis_locks_are_taken_once(redis_cache):
+    assert redis_cache.acquire_lock("prefetch:39", 60)
+    assert not redis_cache.acquire_lock("prefetch:39", 60)
+
+def test_redis_export_skips_locks(redis_cache):
+    redis_cache.set("39:2024", "standings", {"rank": 1}, ttl=300)
+    redis_cache.acquire_lock("prefetch:39", 60)
+
+    entries = redis_cache.export_entries()
+    assert [(namespace, key, value) for namespace, key, value, expires_at in entries] == [("39:2024", "standings", {"rank": 1})]
+
+def test_backend_must_implement_every_cache_operation():
+    class PartialBackend(cache_functions.CacheBackend):
+        def get(self, namespace, key, allow_stale=False):
+            return None
+
+    with pytest.raises(TypeError):
+        cache_functions.CacheBackend()
+    with pytest.raises(TypeError):
+        PartialBackend()
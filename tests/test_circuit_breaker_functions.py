@@ -0,0 +1,149 @@
+# test_circuit_breaker_functions.py
+# Tests for the circuit breaker state machine
+
+import threading
+
+import pytest
+
+import circuit_breaker_functions as breakers
+
+def fail():
+    raise RuntimeError("unavailable")
+
+def succeed():
+    return "ok"
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breakers.time, "time", lambda: now[0])
+    return now
+
+def open_breaker(breaker):
+    for i in range(breaker.failure_threshold):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = breakers.CircuitBreaker("test", 3, 30)
+    for i in range(2):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+    assert breaker.state == breakers.CLOSED
+
+    # A success in between starts the count again
+    assert breaker.call(succeed) == "ok"
+    open_breaker(breaker)
+    assert breaker.state == breakers.OPEN
+
+    # Calls fail fast without reaching the dependency
+    calls = []
+    with pytest.raises(breakers.CircuitOpenError):
+        breaker.call(calls.append, 1)
+    assert calls == []
+    assert breaker.get_metrics().get("rejections") == 1
+    assert breaker.get_metrics().get("opens") == 1
+
+def test_failures_that_do_not_count_keep_the_breaker_closed(clock):
+    breaker = breakers.CircuitBreaker("test", 2, 30)
+    for i in range(3):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail, is_failure=lambda e: False)
+    assert breaker.state == breakers.CLOSED
+
+def test_single_probe_is_let_through_after_the_reset_timeout(clock):
+    breaker = breakers.CircuitBreaker("test", 2, 30)
+    open_breaker(breaker)
+
+    clock[0] += 29
+    with pytest.raises(breakers.CircuitOpenError):
+        breaker.call(succeed)
+
+    # The first call after the timeout is the probe, and every other call is rejected while it runs
+    clock[0] += 1
+    probe_started = threading.Event()
+    probe_gate = threading.Event()
+    def probe():
+        probe_started.set()
+        probe_gate.wait(5)
+        return "ok"
+
+    probe_thread = threading.Thread(target=breaker.call, args=(probe,))
+    probe_thread.start()
+    probe_started.wait(5)
+    assert breaker.state == breakers.HALF_OPEN
+    with pytest.raises(breakers.CircuitOpenError):
+        breaker.call(succeed)
+
+    probe_gate.set()
+    probe_thread.join(5)
+    assert breaker.state == breakers.CLOSED
+    assert breaker.call(succeed) == "ok"
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = breakers.CircuitBreaker("test", 2, 30)
+    open_breaker(breaker)
+
+    clock[0] += 30
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.state == breakers.OPEN
+    assert breaker.get_metrics().get("opens") == 2
+
+    # The reset timeout starts again from the failed probe
+    clock[0] += 29
+    with pytest.raises(breakers.CircuitOpenError):
+        breaker.call(succeed)
+    clock[0] += 1
+    assert breaker.call(succeed) == "ok"
+    assert breaker.state == breakers.CLOSED
+
+def test_slow_call_from_before_the_breaker_opened_does_not_close_it(clock):
+    breaker = breakers.CircuitBreaker("test", 2, 30)
+
+    # A call starts while the breaker is closed, and finishes after other calls opened it
+    slow_started = threading.Event()
+    slow_gate = threading.Event()
+    def slow():
+        slow_started.set()
+        slow_gate.wait(5)
+        return "ok"
+
+    slow_thread = threading.Thread(target=breaker.call, args=(slow,))
+    slow_thread.start()
+    slow_started.wait(5)
+    open_breaker(breaker)
+
+    slow_gate.set()
+    slow_thread.join(5)
+    assert breaker.state == breakers.OPEN
+    with pytest.raises(breakers.CircuitOpenError):
+        breaker.call(succeed)
+
+def test_slow_call_finishing_while_half_open_does_not_decide_the_probe(clock):
+    breaker = breakers.CircuitBreaker("test", 2, 30)
+
+    slow_started = threading.Event()
+    slow_gate = threading.Event()
+    def slow():
+        slow_started.set()
+        slow_gate.wait(5)
+        raise RuntimeError("timed out")
+
+    slow_thread = threading.Thread(target=lambda: pytest.raises(RuntimeError, breaker.call, slow))
+    slow_thread.start()
+    slow_started.wait(5)
+    open_breaker(breaker)
+
+    # The slow call fails after the probe has started, and the probe's success still closes the breaker
+    clock[0] += 30
+    probe_gate = threading.Event()
+    probe_thread = threading.Thread(target=breaker.call, args=(lambda: probe_gate.wait(5),))
+    probe_thread.start()
+    slow_gate.set()
+    slow_thread.join(5)
+    assert breaker.state == breakers.HALF_OPEN
+
+    probe_gate.set()
+    probe_thread.join(5)
+    assert breaker.state == breakers.CLOSED
@@ -0,0 +1,99 @@
+# test_digest_functions.py
+# Tests for sending the round preview and results digest
+
+import json
+
+import pytest
+
+import digest_functions as digest
+import dynamo_functions as db
+import slack_queue_functions as slack_queue
+import sports_api_functions as sports_api
+
+def make_standings(*team_ids):
+    return [{"rank": rank, "team": {"id": team_id, "name": f"Team {team_id}"}, "points": 10 - rank} for rank, team_id in enumerate(team_ids, start=1)]
+
+@pytest.fixture
+def tables():
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        db.create_tables()
+        yield
+
+@pytest.fixture
+def league(monkeypatch, tables):
+    upcoming = [{
+        "fixture": {"id": 1, "timestamp": 1000, "date": "2024-08-17T14:00:00+00:00"},
+        "league": {"round": "Regular Season - 2"},
+        "teams": {"home": {"id": 1, "name": "Team 1"}, "away": {"id": 2, "name": "Team 2"}},
+    }]
+    standings = make_standings(1, 2)
+    monkeypatch.setattr(sports_api, "resolve_league_season", lambda league_id, season: (league_id, season))
+    monkeypatch.setattr(sports_api, "get_upcoming_fixtures", lambda league_id, season: upcoming)
+    monkeypatch.setattr(sports_api, "get_league_standings", lambda league_id, season: standings)
+    monkeypatch.setattr(sports_api, "get_finished_fixtures", lambda league_id, season: [])
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "EPL")
+    monkeypatch.setattr(sports_api, "get_prediction", lambda fixture, league_id, season: None)
+
+    posts = []
+    monkeypatch.setattr(slack_queue, "enqueue", lambda method, **kwargs: posts.append(kwargs))
+    db.set_digest_channel("C1", 39)
+    return upcoming, standings, posts
+
+def test_digest_state_is_kept_out_of_the_channel_index(tables):
+    db.set_digest_channel("C1", 39)
+    assert db.set_digest_sent(39, 2024, "Regular Season - 2", {"1": 2, "2": 1})
+
+    assert db.get_digest_state(39, 2024) == ("Regular Season - 2", {"1": 2, "2": 1})
+    assert db.get_digest_state(39, 2023) == (None, {})
+    assert db.get_digest_channels(39) == ["C1"]
+
+def test_each_round_is_recorded_as_sent_once(tables):
+    assert db.set_digest_sent(39, 2024, "Regular Season - 2", {"1": 1})
+    assert not db.set_digest_sent(39, 2024, "Regular Season - 2", {"1": 2})
+    assert db.get_digest_state(39, 2024) == ("Regular Season - 2", {"1": 1})
+    assert db.set_digest_sent(39, 2024, "Regular Season - 3", {"1": 2})
+
+def test_failed_render_leaves_the_digest_to_the_next_check(league, monkeypatch):
+    upcoming, standings, posts = league
+    monkeypatch.setattr(sports_api, "get_prediction", lambda fixture, league_id, season: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        digest.send_digest_if_due(39, 2024, now=0)
+
+    monkeypatch.setattr(sports_api, "get_prediction", lambda fixture, league_id, season: None)
+    assert digest.send_digest_if_due(39, 2024, now=0)
+    assert [post.get("channel") for post in posts] == ["C1"]
+    assert not digest.send_digest_if_due(39, 2024, now=0)
+
+def test_table_movement_is_shown_from_the_previous_digest(league):
+    upcoming, standings, posts = league
+    assert digest.send_digest_if_due(39, 2024, now=0)
+
+    upcoming[0]["league"]["round"] = "Regular Season - 3"
+    standings[:] = make_standings(2, 1)
+    assert digest.send_digest_if_due(39, 2024, now=0)
+    table_text = "\n".join(block.get("text").get("text") for block in json.loads(posts[-1].get("blocks")) if block.get("type") == "section")
+    assert "1. 🔼1 *Team 2*" in table_text
+    assert "2. 🔽1 *Team 1*" in table_text
+
+def test_sent_round_is_not_rendered_again(league, monkeypatch):
+    upcoming, standings, posts = league
+    assert digest.send_digest_if_due(39, 2024, now=0)
+
+    # A restarted or second instance sees the round as sent before rendering anything
+    monkeypatch.setattr(digest, "build_digest_blocks", lambda *args: pytest.fail("digest rendered again"))
+    assert not digest.send_digest_if_due(39, 2024, now=0)
+    assert len(posts) == 1
+
+def test_only_the_instance_recording_the_round_posts_it(league, monkeypatch):
+    upcoming, standings, posts = league
+
+    # Another instance records the round while this one is rendering it
+    build_digest_blocks = digest.build_digest_blocks
+    def render_while_another_instance_sends(*args):
+        db.set_digest_sent(39, 2024, "Regular Season - 2", {})
+        return build_digest_blocks(*args)
+    monkeypatch.setattr(digest, "build_digest_blocks", render_while_another_instance_sends)
+
+    assert not digest.send_digest_if_due(39, 2024, now=0)
+    assert posts == []
@@ -0,0 +1,50 @@
+# test_dynamo_functions.py
+# Tests for finding a team's followers through the DynamoDB follower indexes
+
+import pytest
+
+import dynamo_functions as db
+import sports_api_functions as sports_api
+
+@pytest.fixture
+def tables(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setattr(db, "__followers", {})
+    monkeypatch.setattr(sports_api, "get_team_id", lambda team_name: {"Arsenal": 42, "Chelsea": 49}.get(team_name))
+    monkeypatch.setattr(sports_api, "get_league_id", lambda league: 39)
+    with moto.mock_aws():
+        db.create_tables()
+        yield
+
+def test_followers_are_found_through_the_index(tables):
+    for user_id in ("U1", "U2", "U3"):
+        db.set_favorite_team(user_id, "Arsenal")
+    db.set_favorite_team("U4", "Chelsea")
+
+    assert db.get_team_followers(42) == {"U1", "U2", "U3"}
+    assert db.get_follower_count(49) == 1
+
+def test_followers_pages_cover_every_follower(tables):
+    for i in range(5):
+        db.set_favorite_team(f"U{i}", "Arsenal")
+
+    follower_ids = []
+    start_key = None
+    while True:
+        page_ids, start_key = db.get_followers_page(42, limit=2, start_key=start_key)
+        follower_ids.extend(page_ids)
+        if start_key is None:
+            break
+    assert sorted(follower_ids) == [f"U{i}" for i in range(5)]
+
+def test_mirror_follows_changes_made_by_this_instance(tables):
+    db.set_favorite_team("U1", "Arsenal")
+    db.set_subscription("C1", "Arsenal")
+    assert db.get_team_followers(42) == {"U1"}
+    assert db.get_subscribers(42) == ["C1"]
+
+    db.set_favorite_team("U1", "Chelsea")
+    db.remove_subscription("C1")
+    assert db.get_team_followers(42) == set()
+    assert db.get_team_followers(49) == {"U1"}
+    assert db.get_subscribers(42) == []
@@ -0,0 +1,58 @@
+# test_history_functions.py
+# Tests for the archive of past seasons
+
+import os
+
+import pytest
+
+import history_functions as history
+import sports_api_functions as sports_api
+
+def make_fixture(fixture_id, home_id, away_id, home_goals, away_goals):
+    return {
+        "fixture": {"id": fixture_id, "timestamp": fixture_id},
+        "teams": {"home": {"id": home_id, "name": f"Team {home_id}"}, "away": {"id": away_id, "name": f"Team {away_id}"}},
+        "goals": {"home": home_goals, "away": away_goals},
+    }
+
+def make_standings_entry(rank, team_id, points):
+    return {"rank": rank, "points": points, "team": {"id": team_id, "name": f"Team {team_id}"},
+            "all": {"played": 2, "win": points // 3, "draw": points % 3, "lose": 2 - points // 3 - points % 3, "goals": {"for": 2, "against": 1}}}
+
+@pytest.fixture
+def archive(monkeypatch, tmp_path):
+    monkeypatch.setattr(history, "__history_dir", str(tmp_path))
+    monkeypatch.setattr(history, "__seasons", {})
+    monkeypatch.setattr(history, "__records", {})
+    monkeypatch.setattr(sports_api, "get_finished_fixtures", lambda league_id, season: [make_fixture(1, 1, 2, 2, 0), make_fixture(2, 2, 1, 1, 1)])
+    monkeypatch.setattr(sports_api, "get_upstream_standings", lambda league_id, season: [make_standings_entry(1, 1, 4), make_standings_entry(2, 2, 1)])
+
+    assert history.import_seasons(39, 2022, 2023) == [2022, 2023]
+    return tmp_path
+
+def test_imported_seasons_are_read_back(archive):
+    assert [entry.get("rank") for entry in history.compute_team_history(39, 1)] == [1, 1]
+    records = history.get_all_time_records(39)
+    assert records.get("seasons") == [2022, 2023]
+    assert records.get("titles") == [("Team 1", 2)]
+
+def test_season_being_imported_again_is_served_from_the_previous_mapping(archive):
+    history.load_season(39, 2023)
+
+    # Importing again renames the previous directory aside before the new one is swapped in
+    season_dir = os.path.join(archive, "39", "2023")
+    os.rename(season_dir, f"{season_dir}.old")
+
+    assert history.load_season(39, 2023).get("season") == 2023
+    assert [entry.get("season") for entry in history.compute_team_history(39, 1)] == [2022, 2023]
+
+def test_season_not_loaded_before_is_skipped_while_it_is_swapped_in(archive):
+    season_dir = os.path.join(archive, "39", "2023")
+    os.rename(season_dir, f"{season_dir}.old")
+
+    assert history.load_season(39, 2023) is None
+    assert [entry.get("season") for entry in history.compute_team_history(39, 1)] == [2022]
+    assert history.get_all_time_records(39).get("seasons") == [2022]
+
+def test_season_that_is_not_archived_is_none(archive):
+    assert history.load_season(39, 2010) is None
@@ -0,0 +1,156 @@
+# test_home_tab_functions.py
+# Tests for tracking Home tab viewers and republishing their views when the data they see changes
+
+import json
+
+import pytest
+
+import home_tab_functions as home
+import dynamo_functions as db
+import slack_queue_functions as slack_queue
+import sports_api_functions as sports_api
+
+def make_team(team_id, league_id = 39):
+    return {"team_name": f"Team {team_id}", "team_id": team_id, "league_id": league_id}
+
+# Batch timers that only run when the test fires them
+class FakeTimer:
+    def __init__(self, interval, function, args = None):
+        self.function = function
+        self.args = args or ()
+        self.daemon = False
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def fire(self):
+        self.function(*self.args)
+
+@pytest.fixture
+def viewers(monkeypatch):
+    monkeypatch.setattr(home, "__recent_viewers", {})
+    monkeypatch.setattr(home, "__pending_users", set())
+    monkeypatch.setattr(home, "__pending_timer", None)
+
+    # Every user's favorite team and followers come from these, and each team's blocks show its current content
+    favorites = {"U1": make_team(1), "U2": make_team(2), "U3": None, "U4": make_team(4, league_id=140)}
+    followers = {1: ["U1"], 2: ["U2"], 4: ["U4"]}
+    content = {None: "table", "Team 1": "table", "Team 2": "table", "Team 4": "table"}
+    monkeypatch.setattr(db, "get_favorite_team", lambda user_id: favorites.get(user_id))
+    monkeypatch.setattr(db, "get_team_followers", lambda team_id: followers.get(team_id, []))
+    monkeypatch.setattr(sports_api, "get_league_id", lambda league: 39)
+
+    renders = []
+    def get_app_home_blocks(team_name = None, league_id = None):
+        renders.append(team_name)
+        return [
+            {"type": "section", "text": {"type": "mrkdwn", "text": content.get(team_name)}},
+            {"type": "context", "elements": [{"type": "mrkdwn", "text": f"Last Updated: {len(renders)}"}]},
+        ]
+    monkeypatch.setattr(sports_api, "get_app_home_blocks", get_app_home_blocks)
+
+    timers = []
+    def make_timer(*args, **kwargs):
+        timers.append(FakeTimer(*args, **kwargs))
+        return timers[-1]
+    monkeypatch.setattr(home.threading, "Timer", make_timer)
+
+    # The batch is run straight away instead of through the scheduler when its timer fires
+    monkeypatch.setattr(home.scheduler, "submit_logged", lambda priority_class, func, *args: func(*args))
+
+    published = []
+    monkeypatch.setattr(slack_queue, "enqueue", lambda method, **kwargs: published.append(kwargs))
+
+    for user_id in favorites:
+        home.render_home_tab(user_id)
+    renders.clear()
+    return {"content": content, "followers": followers, "renders": renders, "timers": timers, "published": published}
+
+def published_users(published):
+    return sorted(kwargs.get("user_id") for kwargs in published)
+
+def test_viewers_are_tracked_when_they_open_home(viewers):
+    recent_viewers = getattr(home, "__recent_viewers")
+    assert sorted(recent_viewers) == ["U1", "U2", "U3", "U4"]
+    assert recent_viewers.get("U1").get("favorite_team") == make_team(1)
+    assert recent_viewers.get("U3").get("favorite_team") is None
+
+def test_viewers_who_have_not_opened_home_recently_are_forgotten(viewers):
+    getattr(home, "__recent_viewers").get("U2")["viewed_at"] -= getattr(home, "__viewer_ttl") + 1
+    home.handle_data_change(39, 2024, True, [])
+    assert "U2" not in getattr(home, "__recent_viewers")
+    assert getattr(home, "__pending_users") == {"U1", "U3"}
+
+def test_standings_change_republishes_every_viewer_in_the_league(viewers):
+    home.handle_data_change(39, 2024, True, [])
+    assert getattr(home, "__pending_users") == {"U1", "U2", "U3"}
+
+def test_team_change_republishes_its_followers_and_viewers_without_a_favorite(viewers):
+    home.handle_data_change(39, 2024, False, [1])
+    assert getattr(home, "__pending_users") == {"U1", "U3"}
+
+    # Changes in another league only reach that league's viewers
+    getattr(home, "__pending_users").clear()
+    home.handle_data_change(140, 2024, False, [4])
+    assert getattr(home, "__pending_users") == {"U4"}
+
+def test_followers_error_falls_back_to_remembered_favorite_teams(viewers, monkeypatch, caplog):
+    def get_team_followers(team_id):
+        raise RuntimeError("throttled")
+    monkeypatch.setattr(db, "get_team_followers", get_team_followers)
+
+    home.handle_data_change(39, 2024, False, [2])
+    assert getattr(home, "__pending_users") == {"U2", "U3"}
+    assert "Error getting followers of team 2" in caplog.text
+
+def test_changes_close_together_are_republished_in_one_batch(viewers):
+    viewers["content"].update({"Team 1": "new table", "Team 2": "new table", None: "new table"})
+    home.handle_data_change(39, 2024, False, [1])
+    home.handle_data_change(39, 2024, False, [2])
+    home.handle_data_change(39, 2024, True, [])
+
+    assert len(viewers["timers"]) == 1
+    assert viewers["timers"][0].started
+    assert viewers["published"] == []
+
+    viewers["timers"][0].fire()
+    assert published_users(viewers["published"]) == ["U1", "U2", "U3"]
+    assert sorted(viewers["renders"], key=str) == sorted(["Team 1", "Team 2", None], key=str)
+    assert getattr(home, "__pending_users") == set()
+
+    # The next change starts a new batch
+    home.handle_data_change(39, 2024, True, [])
+    assert len(viewers["timers"]) == 2
+
+def test_users_with_the_same_favorite_team_share_a_render(viewers, monkeypatch):
+    monkeypatch.setattr(db, "get_favorite_team", lambda user_id: make_team(1))
+    home.render_home_tab("U5")
+    viewers["followers"][1] = ["U1", "U5"]
+    viewers["content"]["Team 1"] = "new table"
+    viewers["renders"].clear()
+
+    home.handle_data_change(39, 2024, False, [1])
+    viewers["timers"][0].fire()
+
+    assert published_users(viewers["published"]) == ["U1", "U5"]
+    assert viewers["renders"].count("Team 1") == 1
+
+def test_unchanged_view_is_not_republished(viewers):
+    # Only the "Last Updated" line differs from what the users already see
+    home.handle_data_change(39, 2024, True, [])
+    viewers["timers"][0].fire()
+    assert viewers["published"] == []
+
+    viewers["content"]["Team 2"] = "new table"
+    home.handle_data_change(39, 2024, True, [])
+    viewers["timers"][1].fire()
+    assert published_users(viewers["published"]) == ["U2"]
+    view = viewers["published"][0].get("view")
+    assert view.get("type") == "home"
+    assert json.loads(view.get("blocks"))[0].get("text").get("text") == "new table"
+
+    # Once published, the same content is not sent again
+    home.handle_data_change(39, 2024, True, [])
+    viewers["timers"][2].fire()
+    assert len(viewers["published"]) == 1
@@ -0,0 +1,84 @@
+# test_notification_functions.py
+# Tests for detecting match events from the shared poll of the live fixtures
+
+import pytest
+
+import notification_functions as notifications
+import sports_api_functions as sports_api
+
+detect_events = getattr(notifications, "__detect_events")
+
+def make_state(status, home_goals = 0, away_goals = 0, red_cards = ()):
+    return {"status": status, "home_goals": home_goals, "away_goals": away_goals, "home_name": "Home", "away_name": "Away", "red_cards": list(red_cards)}
+
+def make_fixture(fixture_id, status, home_goals = 0, away_goals = 0, events = ()):
+    return {
+        "fixture": {"id": fixture_id, "status": {"short": status}},
+        "teams": {"home": {"id": 1, "name": "Home"}, "away": {"id": 2, "name": "Away"}},
+        "goals": {"home": home_goals, "away": away_goals},
+        "events": list(events),
+    }
+
+def make_card(team_name, player_name, detail):
+    return {"type": "Card", "detail": detail, "team": {"name": team_name}, "player": {"name": player_name}}
+
+def test_kickoff_when_a_fixture_is_first_seen_or_leaves_not_started():
+    assert detect_events(None, make_state("1H")) == [":stopwatch: *Kickoff*: Away at Home"]
+    assert detect_events(make_state("NS"), make_state("1H")) == [":stopwatch: *Kickoff*: Away at Home"]
+    assert detect_events(None, make_state("NS")) == []
+    assert detect_events(make_state("1H"), make_state("1H")) == []
+
+def test_goal_for_each_side():
+    assert detect_events(make_state("1H"), make_state("1H", home_goals=1)) == [":soccer: *Goal for Home!* Away 0 - 1 Home"]
+    assert detect_events(make_state("2H", 1, 0), make_state("2H", 1, 1)) == [":soccer: *Goal for Away!* Away 1 - 1 Home"]
+    assert detect_events(make_state("2H", 1, 1), make_state("2H", 2, 2)) == [
+        ":soccer: *Goal for Home!* Away 2 - 2 Home",
+        ":soccer: *Goal for Away!* Away 2 - 2 Home",
+    ]
+
+def test_goals_scored_before_the_first_poll_are_announced_with_the_kickoff():
+    assert detect_events(None, make_state("1H", away_goals=1)) == [
+        ":stopwatch: *Kickoff*: Away at Home",
+        ":soccer: *Goal for Away!* Away 1 - 0 Home",
+    ]
+
+@pytest.mark.parametrize("status", sports_api.finished_statuses)
+def test_full_time_for_every_finished_status(status):
+    assert detect_events(make_state("2H", 2, 1), make_state(status, 2, 1)) == [":checkered_flag: *Full Time*: Away 1 - 2 Home"]
+    assert detect_events(make_state(status, 2, 1), make_state(status, 2, 1)) == []
+
+def test_red_card_for_each_new_sending_off():
+    old_state = make_state("2H", red_cards=[["Home", "A. Defender"]])
+    new_state = make_state("2H", red_cards=[["Home", "A. Defender"], ["Away", "B. Striker"]])
+    assert detect_events(old_state, new_state) == [":red_circle: *Red Card* for B. Striker of Away. Away 0 - 0 Home"]
+    assert detect_events(new_state, new_state) == []
+
+def test_red_cards_are_read_from_the_fixture_events():
+    fixture = make_fixture(1, "2H", events=[
+        {"type": "Goal", "detail": "Normal Goal", "team": {"name": "Home"}, "player": {"name": "C. Forward"}},
+        make_card("Home", "D. Midfielder", "Yellow Card"),
+        make_card("Away", "B. Striker", "Red Card"),
+        make_card("Home", "A. Defender", "Second Yellow card"),
+    ])
+    state = getattr(notifications, "__extract_fixture_state")(fixture)
+    assert state.get("red_cards") == [["Away", "B. Striker"], ["Home", "A. Defender"]]
+
+def test_other_status_changes_send_nothing():
+    assert detect_events(make_state("1H"), make_state("HT")) == []
+    assert detect_events(make_state("2H"), make_state("SUSP")) == []
+
+def test_awarded_fixture_gets_its_full_time_result(monkeypatch):
+    monkeypatch.setattr(notifications, "__fixture_states", {})
+    monkeypatch.setattr(notifications, "__live_listeners", [])
+    sent = []
+    monkeypatch.setattr(notifications, "__notify_subscribers", lambda fixture, event_text: sent.append(event_text))
+
+    monkeypatch.setattr(sports_api, "get_live_fixtures", lambda: [make_fixture(1, "SUSP")])
+    notifications.poll_live_fixtures(notify=False)
+
+    # The suspended game is awarded and drops out of the live list
+    monkeypatch.setattr(sports_api, "get_live_fixtures", lambda: [])
+    monkeypatch.setattr(sports_api, "get_fixture", lambda fixture_id: make_fixture(1, "AWD", 3, 0))
+    notifications.poll_live_fixtures()
+    assert sent == [":soccer: *Goal for Home!* Away 0 - 3 Home", ":checkered_flag: *Full Time*: Away 0 - 3 Home"]
+    assert getattr(notifications, "__fixture_states") == {}
@@ -0,0 +1,164 @@
+# test_player_functions.py
+# Tests for bulk loading the player store
+
+import threading
+
+import pytest
+
+import cache_functions
+import player_functions as players
+import scheduler_functions as scheduler
+import sports_api_functions as sports_api
+
+def make_page(page, total_pages, player_ids):
+    return {
+        "paging": {"current": page, "total": total_pages},
+        "response": [
+            {
+                "player": {"id": player_id, "name": f"P. Player{player_id}", "firstname": "Pat", "lastname": f"Player{player_id}"},
+                "statistics": [{"team": {"id": 1, "name": "Team 1"}, "games": {"position": "Attacker"}, "goals": {}}],
+            }
+            for player_id in player_ids
+        ],
+    }
+
+@pytest.fixture
+def pages(monkeypatch):
+    monkeypatch.setattr(players, "__requests_per_minute", 60000)
+    monkeypatch.setattr(players, "__stores", {})
+    monkeypatch.setattr(players, "__loading", set())
+    monkeypatch.setattr(players, "__failed_at", {})
+    cache = cache_functions.LRUCacheBackend(100)
+    monkeypatch.setattr(cache_functions, "get_cache", lambda: cache)
+
+    calls = []
+    responses = {}
+    gate = threading.Event()
+    gate.set()
+
+    def get_players_page(league_id, season, page):
+        gate.wait(5)
+        calls.append(page)
+        response = responses.get(page)
+        if isinstance(response, list):
+            response = response.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(sports_api, "get_players_page", get_players_page)
+
+    # Keep the background loads, so tests can wait for them
+    loads = []
+    refresh_player_store = players.refresh_player_store
+    def record_load(*args):
+        load = refresh_player_store(*args)
+        if load is not None:
+            loads.append(load)
+        return load
+    monkeypatch.setattr(players, "refresh_player_store", record_load)
+    return responses, calls, gate, loads
+
+# Make a loaded store, and the copy of it in the cache, look older than the store TTL
+def expire_store(store):
+    store["loaded_at"] = 0
+    cache_functions.get_cache().get("players:39:2024", "players")["loaded_at"] = 0
+
+def test_failed_page_is_retried(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 2, [1])
+    responses[2] = [RuntimeError("timeout"), {"errors": {"rateLimit": "Too many requests"}}, make_page(2, 2, [2])]
+
+    store = players.load_players(39, 2024).result(5)
+    assert sorted(store.get("players")) == [1, 2]
+    assert store.get("skipped_pages") == 0
+    assert calls.count(2) == 3
+
+def test_page_that_keeps_failing_is_skipped(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 3, [1])
+    responses[2] = RuntimeError("timeout")
+    responses[3] = make_page(3, 3, [3])
+
+    store = players.load_players(39, 2024).result(5)
+    assert sorted(store.get("players")) == [1, 3]
+    assert store.get("skipped_pages") == 1
+
+def test_stores_load_in_the_background(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 1, [1])
+
+    gate.clear()
+    assert players.get_player_store(39, 2024) is None
+    assert players.get_player_store(39, 2024) is None
+    gate.set()
+
+    assert len(loads) == 1
+    loads[0].result(5)
+    assert sorted(players.get_player_store(39, 2024).get("players")) == [1]
+
+def test_expired_store_is_served_while_it_reloads(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 1, [1])
+    players.refresh_player_store(39, 2024).result(5)
+    store = players.get_player_store(39, 2024)
+    expire_store(store)
+
+    responses[1] = make_page(1, 1, [1, 2])
+    gate.clear()
+    assert players.get_player_store(39, 2024) is store
+    gate.set()
+
+    loads[-1].result(5)
+    assert sorted(players.get_player_store(39, 2024).get("players")) == [1, 2]
+
+def test_failed_reload_keeps_previous_store(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 1, [1])
+    players.refresh_player_store(39, 2024).result(5)
+    store = players.get_player_store(39, 2024)
+    expire_store(store)
+
+    responses[1] = RuntimeError("timeout")
+    players.refresh_player_store(39, 2024).result(5)
+    assert players.get_player_store(39, 2024) is store
+
+    # The failed load is not retried straight away
+    assert players.refresh_player_store(39, 2024) is None
+
+def test_store_loaded_by_another_process_is_used(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 1, [1, 2])
+    players.refresh_player_store(39, 2024).result(5)
+
+    # A prefork worker reads the refresher's players from the shared snapshot instead of loading them
+    players.__stores.clear()
+    calls.clear()
+    store = players.get_player_store(39, 2024)
+    assert sorted(store.get("players")) == [1, 2]
+    assert players.get_squad(store, 1) == [store.get("players").get(1), store.get("players").get(2)]
+    assert calls == []
+    assert len(loads) == 1
+
+def test_player_on_more_than_one_page_is_added_once(pages):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 2, [1, 2])
+    responses[2] = make_page(2, 2, [2, 3])
+
+    store = players.load_players(39, 2024).result(5)
+    assert sorted(store.get("players")) == [1, 2, 3]
+    assert sorted(p.get("id") for p in players.get_squad(store, 1)) == [1, 2, 3]
+
+def test_pages_are_fetched_as_bulk_tasks(pages, monkeypatch):
+    responses, calls, gate, loads = pages
+    responses[1] = make_page(1, 4, [1])
+    for page in range(2, 5):
+        responses[page] = make_page(page, 4, [page])
+
+    submitted = []
+    submit = scheduler.submit
+    monkeypatch.setattr(scheduler, "submit", lambda priority_class, func, *args, **kwargs: submitted.append(priority_class) or submit(priority_class, func, *args, **kwargs))
+
+    # Each page is a bulk task of its own, and no task holds a bulk worker waiting on the others
+    store = players.refresh_player_store(39, 2024).result(5)
+    assert sorted(store.get("players")) == [1, 2, 3, 4]
+    assert submitted == [scheduler.BULK] * 4
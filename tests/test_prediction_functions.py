@@ -0,0 +1,33 @@
+# test_prediction_functions.py
+# Tests for the offline evaluation of the prediction model on a saved season
+
+import json
+import os
+
+import pytest
+
+import prediction_functions as predictions
+
+# A generated eight team season in the API's format, with the API's predictions mocked for its last 20 fixtures
+season_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "prediction_evaluation_season.json")
+
+@pytest.fixture
+def saved_season():
+    with open(season_path) as season_file:
+        return json.load(season_file)
+
+def test_evaluation_of_saved_season(saved_season):
+    evaluation = predictions.evaluate_predictions(sample_size=20, fixtures=saved_season.get("fixtures"), upstream_predictions=saved_season.get("predictions"))
+
+    assert evaluation.get("fixtures") == 20
+    assert evaluation.get("upstream_fixtures") == 20
+    assert evaluation.get("local_accuracy") == pytest.approx(0.7)
+    assert evaluation.get("local_log_loss") == pytest.approx(0.939, abs=0.001)
+    assert evaluation.get("upstream_accuracy") == pytest.approx(0.45)
+
+def test_fixtures_without_an_upstream_prediction_are_not_compared(saved_season):
+    evaluation = predictions.evaluate_predictions(sample_size=20, fixtures=saved_season.get("fixtures"), upstream_predictions={})
+
+    assert evaluation.get("fixtures") == 20
+    assert evaluation.get("upstream_fixtures") == 0
+    assert evaluation.get("upstream_accuracy") is None
@@ -0,0 +1,83 @@
+# test_prefork_functions.py
+# Tests for sharing the refresher's data with prefork workers, and for supervising the processes
+
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+import cache_functions
+import prefork_functions as prefork
+import sports_api_functions as sports_api
+
+def test_published_snapshot_reads_back_every_entry(tmp_path):
+    path = str(tmp_path / "shared_snapshot.bin")
+    entries = [
+        ("39:2024", "standings", {"response": [{"rank": 1}]}, time.time() + 300),
+        ("39:2024", "fixtures", {"response": []}, time.time() - 1),
+        ("teams", "arsenal", {"id": 42, "name": "Arsenal ⚽"}, None),
+    ]
+    prefork.publish_snapshot(7, entries, [], None, path)
+
+    snapshot = prefork.SharedSnapshot(path)
+    assert snapshot.version == 7
+    assert snapshot.get("39:2024", "standings") == {"response": [{"rank": 1}]}
+    assert snapshot.get("39:2024", "fixtures") is None
+    assert snapshot.get("39:2024", "fixtures", allow_stale=True) == {"response": []}
+    assert snapshot.get("teams", "arsenal") == {"id": 42, "name": "Arsenal ⚽"}
+    assert snapshot.get("teams", "chelsea") is None
+
+def test_worker_swaps_versions_and_passes_on_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared_snapshot.bin")
+    changes = []
+    monkeypatch.setattr(sports_api, "__data_change_listeners", [lambda *change: changes.append(change)])
+    backend = prefork.SnapshotCacheBackend(cache_functions.LRUCacheBackend(100))
+    swap_snapshot = getattr(prefork, "__swap_snapshot")
+
+    prefork.publish_snapshot(1, [("39:2024", "standings", {"rank": 1}, None)], [], None, path)
+    swap_snapshot(backend, prefork.SharedSnapshot(path))
+    backend.set("39:2024", "team_fixtures", {"response": []})
+
+    change = {"version": 2, "league_id": 39, "season": 2024, "standings_changed": True, "changed_team_ids": [1]}
+    prefork.publish_snapshot(2, [("39:2024", "standings", {"rank": 2}, None)], [change], None, path)
+    swap_snapshot(backend, prefork.SharedSnapshot(path))
+
+    assert backend.get("39:2024", "standings") == {"rank": 2}
+    assert backend.get("39:2024", "team_fixtures") is None
+    assert changes == [(39, 2024, True, {1})]
+
+    # Older versions are never swapped back in
+    prefork.publish_snapshot(1, [("39:2024", "standings", {"rank": 1}, None)], [], None, path)
+    swap_snapshot(backend, prefork.SharedSnapshot(path))
+    assert backend.get("39:2024", "standings") == {"rank": 2}
+
+@pytest.mark.skipif(sys.platform == "win32", reason="prefork needs fork")
+def test_interrupt_stops_supervisor_and_every_process(tmp_path):
+    # Ctrl-C sends SIGINT to the supervisor and every process it forked
+    script = textwrap.dedent(f"""
+        import sys, time
+        sys.path.insert(0, {os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")!r})
+        import prefork_functions as prefork
+
+        def run():
+            while True:
+                time.sleep(1)
+
+        prefork.run_prefork(2, run, run)
+    """)
+    supervisor = subprocess.Popen([sys.executable, "-c", script], cwd=tmp_path, env=dict(os.environ, AWS_DEFAULT_REGION="us-east-1"),
+                                  stderr=subprocess.PIPE, start_new_session=True)
+    time.sleep(3)
+    os.killpg(supervisor.pid, signal.SIGINT)
+
+    stderr = supervisor.communicate(timeout=20)[1].decode()
+    assert supervisor.returncode == 0, stderr
+    # Forked processes report any exception from the stop handler they should not be running
+    assert "Process worker" not in stderr
+    assert "Process refresher" not in stderr
+    with pytest.raises(ProcessLookupError):
+        os.killpg(supervisor.pid, 0)
@@ -0,0 +1,37 @@
+# test_profiling_functions.py
+# Tests for the on-demand stack sampler
+
+import threading
+import time
+
+import profiling_functions as profiling
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def sleep_loop(stop):
+    while not stop.is_set():
+        time.sleep(0.01)
+
+def wait_loop(stop):
+    stop.wait()
+
+def test_samples_are_weighted_by_cpu_time():
+    stop = threading.Event()
+    threads = [threading.Thread(target=target, args=(stop,), daemon=True) for target in (spin, sleep_loop, wait_loop)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        stack_counts = getattr(profiling, "__sample_stacks")(1)
+    finally:
+        stop.set()
+
+    def weight_of(function_name):
+        return sum(weight for stack, weight in stack_counts.items() if f"{function_name} (test_profiling_functions.py" in stack)
+
+    total_weight = sum(stack_counts.values())
+    assert weight_of("spin") > 0.5 * total_weight
+    assert weight_of("sleep_loop") < 0.05 * total_weight
+    assert weight_of("wait_loop") < 0.01 * total_weight
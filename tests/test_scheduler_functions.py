@@ -0,0 +1,96 @@
+# test_scheduler_functions.py
+# Tests for the order the scheduler's workers take tasks in
+
+import threading
+
+import scheduler_functions as scheduler
+
+def make_scheduler(worker_count = 1, interactive_reserve = 0, **limits):
+    class_limits = {scheduler.INTERACTIVE: worker_count, scheduler.APP_HOME: worker_count, scheduler.BACKGROUND: worker_count, scheduler.BULK: worker_count}
+    class_limits.update({getattr(scheduler, name.upper()): limit for name, limit in limits.items()})
+    return scheduler.PriorityScheduler(worker_count, class_limits, interactive_reserve)
+
+# Occupy a worker until the returned event is set
+def block_worker(priority_scheduler, priority_class = scheduler.INTERACTIVE):
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+    future = priority_scheduler.submit(priority_class, blocked)
+    assert started.wait(5)
+    return release, future
+
+def test_higher_classes_run_first():
+    priority_scheduler = make_scheduler()
+    release, blocked = block_worker(priority_scheduler)
+
+    order = []
+    futures = [priority_scheduler.submit(priority_class, order.append, priority_class)
+               for priority_class in (scheduler.BULK, scheduler.BACKGROUND, scheduler.APP_HOME, scheduler.INTERACTIVE)]
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == [scheduler.INTERACTIVE, scheduler.APP_HOME, scheduler.BACKGROUND, scheduler.BULK]
+
+def test_users_take_turns_within_a_class():
+    priority_scheduler = make_scheduler()
+    release, blocked = block_worker(priority_scheduler)
+
+    order = []
+    futures = [priority_scheduler.submit(scheduler.INTERACTIVE, order.append, task, key=user)
+               for user, task in (("U1", "U1-1"), ("U1", "U1-2"), ("U1", "U1-3"), ("U2", "U2-1"))]
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == ["U1-1", "U2-1", "U1-2", "U1-3"]
+
+def test_class_limit_holds_back_tasks():
+    priority_scheduler = make_scheduler(worker_count=3, bulk=1)
+    release, blocked = block_worker(priority_scheduler, scheduler.BULK)
+
+    second_bulk = priority_scheduler.submit(scheduler.BULK, lambda: "bulk")
+    interactive = priority_scheduler.submit(scheduler.INTERACTIVE, lambda: "interactive")
+    assert interactive.result(5) == "interactive"
+    assert not second_bulk.done()
+
+    release.set()
+    assert second_bulk.result(5) == "bulk"
+
+def test_reserved_worker_is_only_used_by_interactive_tasks():
+    priority_scheduler = make_scheduler(worker_count=2, interactive_reserve=1)
+    release, blocked = block_worker(priority_scheduler, scheduler.BACKGROUND)
+
+    # The other classes together may only use one of the two workers
+    app_home = priority_scheduler.submit(scheduler.APP_HOME, lambda: "app_home")
+    interactive = priority_scheduler.submit(scheduler.INTERACTIVE, lambda: "interactive")
+    assert interactive.result(5) == "interactive"
+    assert not app_home.done()
+    assert priority_scheduler.get_metrics().get(scheduler.APP_HOME) == {"queued": 1, "running": 0}
+
+    release.set()
+    assert app_home.result(5) == "app_home"
+
+def test_executor_queues_request_work_in_the_request_class():
+    priority_scheduler = make_scheduler(worker_count=2)
+    executor = scheduler.SchedulerExecutor(priority_scheduler, scheduler.INTERACTIVE)
+
+    def current():
+        return priority_scheduler.current.priority_class, priority_scheduler.current.key
+    assert executor.submit(current).result(5) == (scheduler.INTERACTIVE, None)
+
+    priority_scheduler.request_context.priority_class = scheduler.APP_HOME
+    priority_scheduler.request_context.key = "U1"
+    assert executor.submit(current).result(5) == (scheduler.APP_HOME, "U1")
+
+    # Work submitted from a running task stays in that task's class
+    assert executor.submit(lambda: executor.submit(current).result(5)).result(5) == (scheduler.APP_HOME, "U1")
+
+def test_requests_are_classified_from_their_body():
+    assert scheduler.classify_request({"event": {"type": "app_home_opened", "user": "U1"}}) == (scheduler.APP_HOME, "U1")
+    assert scheduler.classify_request({"event": {"type": "message", "user": "U2"}}) == (scheduler.INTERACTIVE, "U2")
+    assert scheduler.classify_request({"type": "block_actions", "user": {"id": "U3"}}) == (scheduler.INTERACTIVE, "U3")
+    assert scheduler.classify_request({"command": "/standings", "user_id": "U4"}) == (scheduler.INTERACTIVE, "U4")
@@ -0,0 +1,46 @@
+# test_scoreboard_functions.py
+# Tests for keeping live scoreboards up to date
+
+import pytest
+
+import scoreboard_functions as scoreboards
+import slack_queue_functions as slack_queue
+import sports_api_functions as sports_api
+
+def make_fixture(fixture_id, home_goals, status = "1H"):
+    return {
+        "fixture": {"id": fixture_id, "status": {"short": status}},
+        "league": {"id": 39},
+        "teams": {"home": {"id": 1, "name": "Team 1"}, "away": {"id": 2, "name": "Team 2"}},
+        "goals": {"home": home_goals, "away": 0},
+    }
+
+@pytest.fixture
+def board(monkeypatch):
+    monkeypatch.setattr(scoreboards, "__scoreboards", {})
+    monkeypatch.setattr(scoreboards, "__latest_live_fixtures", [make_fixture(1, 0)])
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "EPL")
+
+    updates = []
+    monkeypatch.setattr(slack_queue, "enqueue", lambda method, **kwargs: updates.append(kwargs))
+    client = type("Client", (), {"chat_postMessage": lambda self, **kwargs: {"channel": kwargs.get("channel"), "ts": "1.0"}})()
+    assert scoreboards.post_scoreboard(client, "C1", league_id=39)
+    return updates
+
+def test_scoreboard_is_only_edited_when_it_changes(board):
+    updates = board
+    scoreboards.handle_live_fixtures([make_fixture(1, 0)], [])
+    assert updates == []
+
+    scoreboards.handle_live_fixtures([make_fixture(1, 1)], [])
+    assert len(updates) == 1
+
+    scoreboards.handle_live_fixtures([], [make_fixture(1, 1, "FT")])
+    assert len(updates) == 2
+    assert getattr(scoreboards, "__scoreboards") == {}
+
+def test_scoreboard_of_an_awarded_game_completes(board):
+    updates = board
+    scoreboards.handle_live_fixtures([], [make_fixture(1, 3, "AWD")])
+    assert len(updates) == 1
+    assert getattr(scoreboards, "__scoreboards") == {}
@@ -0,0 +1,75 @@
+# test_snapshot_functions.py
+# Tests for checkpointing the cache to disk and loading it back
+
+import time
+
+import pytest
+
+import cache_functions
+import snapshot_functions as snapshots
+import sports_api_functions as sports_api
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = cache_functions.LRUCacheBackend(100)
+    monkeypatch.setattr(cache_functions, "get_cache", lambda: cache)
+    return cache
+
+def restart(monkeypatch):
+    cache = cache_functions.LRUCacheBackend(100)
+    monkeypatch.setattr(cache_functions, "get_cache", lambda: cache)
+    return cache
+
+def test_snapshot_round_trip_keeps_expiry_times(cache, monkeypatch, tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    cache.set("39:2024", "standings", {"rank": 1}, ttl=3600)
+    cache.set("teams", "arsenal", {"id": 42})
+    expires_at = cache.entries[("39:2024", "standings")][1]
+
+    assert snapshots.save_snapshot(path) == 2
+    restored = restart(monkeypatch)
+    assert snapshots.load_snapshot(path) == 2
+
+    assert restored.get("39:2024", "standings") == {"rank": 1}
+    assert restored.get("teams", "arsenal") == {"id": 42}
+    assert restored.entries[("39:2024", "standings")][1] == pytest.approx(expires_at)
+    assert restored.entries[("teams", "arsenal")][1] is None
+
+def test_expired_entries_are_restored_as_stale(cache, monkeypatch, tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    cache.set("39:2024", "standings", {"rank": 1}, ttl=300)
+    snapshots.save_snapshot(path)
+
+    # The restart happens after the entry expired
+    restored = restart(monkeypatch)
+    monkeypatch.setattr(time, "time", lambda real_time=time.time: real_time() + 600)
+    assert snapshots.load_snapshot(path) == 1
+
+    assert restored.get("39:2024", "standings") is None
+    assert restored.get("39:2024", "standings", allow_stale=True) == {"rank": 1}
+    assert restored.entries[("39:2024", "standings")][1] < time.time()
+
+def test_restored_league_data_is_ready_and_not_reported_as_changed(cache, monkeypatch, tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    fixture = {"fixture": {"id": 1}, "teams": {"home": {"id": 1}, "away": {"id": 2}}, "goals": {"home": 1, "away": 0}}
+    responses = {
+        "standings": {"response": [{"league": {"standings": [[{"rank": 1, "team": {"id": 1}}]]}}]},
+        "FT-AET-PEN-AWD-WO": {"response": [fixture]},
+        "NS": {"response": []},
+        "teams": {"response": []},
+    }
+    monkeypatch.setattr(sports_api, "__request_api_data", lambda endpoint_path, params: responses.get(params.get("status") or endpoint_path))
+    changes = []
+    monkeypatch.setattr(sports_api, "__data_change_listeners", [lambda *change: changes.append(change)])
+
+    sports_api.prefetch_league_data(39, 2024)
+    snapshots.save_snapshot(path)
+
+    restart(monkeypatch)
+    monkeypatch.setattr(time, "time", lambda real_time=time.time: real_time() + 600)
+    snapshots.load_snapshot(path)
+    assert sports_api.is_league_data_cached(39, 2024)
+
+    changes.clear()
+    sports_api.prefetch_league_data(39, 2024)
+    assert changes == []
@@ -0,0 +1,222 @@
+# test_socket_mode_functions.py
+# Tests for the Socket Mode transport against a local stand-in for Slack's Socket Mode servers
+
+import base64
+import functools
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+from slack_bolt import App
+from slack_sdk import WebClient
+
+import socket_mode_functions as socket_mode
+
+# Local stand-in for Slack. Serves the Web API calls the app makes on plain HTTP, and accepts
+# WebSocket connections on the URL apps.connections.open returns
+class SlackStandIn:
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.acks = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = conn.recv(1024)
+            if not data:
+                conn.close()
+                return
+            request += data
+        head, body = request.split(b"\r\n\r\n", 1)
+        lines = head.decode().split("\r\n")
+        headers = {line.split(":", 1)[0].strip().lower(): line.split(":", 1)[1].strip() for line in lines[1:] if ":" in line}
+
+        if headers.get("upgrade", "").lower() != "websocket":
+            self.handle_api_call(conn, lines[0].split(" ")[1], headers, body)
+            return
+
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key") + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        conn.sendall(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        with self.lock:
+            index = len(self.connections)
+            self.connections.append(conn)
+        self.read_frames(index, conn)
+
+    def handle_api_call(self, conn, path, headers, body):
+        while len(body) < int(headers.get("content-length", 0)):
+            body += conn.recv(1024)
+
+        if path.endswith("apps.connections.open"):
+            response = {"ok": True, "url": f"ws://127.0.0.1:{self.port}/link"}
+        else:
+            response = {"ok": True, "user_id": "U0", "bot_id": "B0", "team_id": "T0", "user": "bot", "team": "Team"}
+        encoded = json.dumps(response).encode()
+        conn.sendall(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(encoded)}\r\nConnection: close\r\n\r\n".encode() + encoded)
+        conn.close()
+
+    # Read the client's frames, answering pings and recording acknowledgements
+    def read_frames(self, index, conn):
+        try:
+            while True:
+                header = self.recv_exactly(conn, 2)
+                opcode = header[0] & 0x0f
+                length = header[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack("!H", self.recv_exactly(conn, 2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self.recv_exactly(conn, 8))[0]
+                mask = self.recv_exactly(conn, 4) if header[1] & 0x80 else bytes(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.recv_exactly(conn, length)))
+
+                if opcode == 0x9:
+                    self.send_frame(conn, 0xa, payload)
+                elif opcode == 0x1:
+                    with self.lock:
+                        self.acks.append((index, json.loads(payload).get("envelope_id")))
+                elif opcode == 0x8:
+                    return
+        except OSError:
+            return
+
+    def recv_exactly(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def send_frame(self, conn, opcode, payload):
+        if len(payload) < 126:
+            length = bytes([len(payload)])
+        else:
+            length = bytes([126]) + struct.pack("!H", len(payload))
+        conn.sendall(bytes([0x80 | opcode]) + length + payload)
+
+    # Send a request to the app over one of its connections
+    def send(self, index, envelope):
+        self.send_frame(self.connections[index], 0x1, json.dumps(envelope).encode())
+
+    # Close one of the app's connections, as Slack does when it refreshes them
+    def drop(self, index):
+        conn = self.connections[index]
+        self.send_frame(conn, 0x8, struct.pack("!H", 1001))
+        conn.close()
+
+    def wait_for(self, predicate, timeout = 10):
+        deadline = time.time() + timeout
+        while not predicate():
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self):
+        self.server.close()
+        for conn in self.connections:
+            conn.close()
+
+def event_envelope(envelope_id, event_id):
+    return {
+        "type": "events_api",
+        "envelope_id": envelope_id,
+        "accepts_response_payload": False,
+        "payload": {
+            "type": "event_callback",
+            "team_id": "T0",
+            "api_app_id": "A0",
+            "event_id": event_id,
+            "event_time": 1,
+            "event": {"type": "app_mention", "user": "U1", "text": "<@U0> standings", "channel": "C1", "ts": "1.0"},
+        },
+    }
+
+def command_envelope(envelope_id):
+    return {
+        "type": "slash_commands",
+        "envelope_id": envelope_id,
+        "accepts_response_payload": True,
+        "payload": {"command": "/standings", "text": "", "team_id": "T0", "user_id": "U1", "channel_id": "C1", "api_app_id": "A0", "trigger_id": "1"},
+    }
+
+@pytest.fixture
+def slack(monkeypatch):
+    stand_in = SlackStandIn()
+    monkeypatch.setattr(socket_mode, "__clients", [])
+    monkeypatch.setattr(socket_mode, "__handled_events", OrderedDict())
+
+    # Ping often, so a dropped connection is noticed and reopened quickly
+    monkeypatch.setattr(socket_mode, "SocketModeClient", functools.partial(socket_mode.SocketModeClient, ping_interval=0.2))
+
+    app = App(client=WebClient(token="xoxb-test", base_url=f"http://127.0.0.1:{stand_in.port}/api/"), signing_secret="secret")
+    clients = socket_mode.open_connections(app, "xapp-test", 2)
+    assert stand_in.wait_for(lambda: len(stand_in.connections) == 2)
+    yield stand_in, app, clients
+
+    # Closing the stand-in first ends the clients' blocking reads, so they close straight away
+    stand_in.close()
+    socket_mode.stop_socket_mode()
+
+def test_redelivered_event_is_processed_once(slack):
+    stand_in, app, clients = slack
+    mentions = []
+    app.event("app_mention")(lambda event: mentions.append(event.get("ts")))
+
+    stand_in.send(0, event_envelope("envelope-1", "Ev1"))
+    assert stand_in.wait_for(lambda: (0, "envelope-1") in stand_in.acks)
+
+    # Slack redelivers the event with a new envelope on the other connection
+    stand_in.send(1, event_envelope("envelope-2", "Ev1"))
+    assert stand_in.wait_for(lambda: (1, "envelope-2") in stand_in.acks)
+
+    time.sleep(0.5)
+    assert mentions == ["1.0"]
+
+def test_ack_is_sent_over_another_connection_when_the_original_drops(slack):
+    stand_in, app, clients = slack
+    gate = threading.Event()
+
+    @app.command("/standings")
+    def handle_standings(ack):
+        gate.wait(5)
+        ack()
+
+    stand_in.send(0, command_envelope("envelope-1"))
+    time.sleep(0.2)
+    stand_in.drop(0)
+    assert stand_in.wait_for(lambda: not clients[0].is_connected(), 5)
+
+    gate.set()
+    assert stand_in.wait_for(lambda: stand_in.acks == [(1, "envelope-1")])
+
+def test_dropped_connection_reconnects(slack):
+    stand_in, app, clients = slack
+    mentions = []
+    app.event("app_mention")(lambda event: mentions.append(event.get("ts")))
+
+    stand_in.drop(0)
+    assert stand_in.wait_for(lambda: len(stand_in.connections) == 3)
+    assert stand_in.wait_for(lambda: clients[0].is_connected(), 5)
+
+    stand_in.send(2, event_envelope("envelope-1", "Ev1"))
+    assert stand_in.wait_for(lambda: (2, "envelope-1") in stand_in.acks)
+    assert stand_in.wait_for(lambda: mentions == ["1.0"], 5)
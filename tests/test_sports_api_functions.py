@@ -0,0 +1,183 @@
+# test_sports_api_functions.py
+# Tests for the background refresh of league data, and paging through standings and games
+
+import re
+import json
+
+import pytest
+
+import cache_functions
+import sports_api_functions as sports_api
+
+def make_fixture(fixture_id, home_id, away_id, home_goals, away_goals):
+    return {
+        "fixture": {"id": fixture_id, "timestamp": fixture_id, "status": {"short": "FT"}},
+        "teams": {"home": {"id": home_id, "name": f"Team {home_id}"}, "away": {"id": away_id, "name": f"Team {away_id}"}},
+        "goals": {"home": home_goals, "away": away_goals},
+    }
+
+@pytest.fixture
+def upstream(monkeypatch):
+    cache = cache_functions.LRUCacheBackend(100)
+    monkeypatch.setattr(cache_functions, "get_cache", lambda: cache)
+
+    responses = {
+        "standings": {"response": [{"league": {"standings": [[{"rank": 1, "team": {"id": 1}}]]}}]},
+        "FT-AET-PEN-AWD-WO": {"response": [make_fixture(1, 1, 2, 2, 0)]},
+        "NS": {"response": [make_fixture(2, 2, 1, None, None)]},
+        "teams": {"response": []},
+    }
+
+    def request_api_data(endpoint_path, params):
+        return responses.get(params.get("status") or endpoint_path)
+    monkeypatch.setattr(sports_api, "__request_api_data", request_api_data)
+
+    changes = []
+    monkeypatch.setattr(sports_api, "__data_change_listeners", [lambda *change: changes.append(change)])
+    return cache, responses, changes
+
+def prefetch_again(cache):
+    # Another instance, or this one after a restart, takes the prefetch lock next interval
+    cache.locks.clear()
+    sports_api.prefetch_league_data(39, 2024)
+
+def test_unchanged_data_keeps_cache_and_does_not_notify(upstream):
+    cache, responses, changes = upstream
+    sports_api.prefetch_league_data(39, 2024)
+    changes.clear()
+    cache.set(cache_functions.make_namespace(39, 2024), "prediction", {"winner": 1}, 3600)
+
+    prefetch_again(cache)
+    assert changes == []
+    assert cache.get(cache_functions.make_namespace(39, 2024), "prediction") == {"winner": 1}
+
+def test_unchanged_expired_data_does_not_notify(upstream):
+    cache, responses, changes = upstream
+    sports_api.prefetch_league_data(39, 2024)
+    changes.clear()
+
+    # The refresh usually runs just as the previous copies expire
+    for key, (value, expires_at) in list(cache.entries.items()):
+        cache.entries[key] = (value, 0)
+
+    prefetch_again(cache)
+    assert changes == []
+
+def test_changed_result_notifies_with_the_teams_involved(upstream):
+    cache, responses, changes = upstream
+    sports_api.prefetch_league_data(39, 2024)
+    changes.clear()
+    cache.set(cache_functions.make_namespace(39, 2024), "prediction", {"winner": 1}, 3600)
+
+    responses["FT-AET-PEN-AWD-WO"] = {"response": [make_fixture(1, 1, 2, 2, 1)]}
+    prefetch_again(cache)
+    assert changes == [(39, 2024, False, {1, 2})]
+    assert cache.get(cache_functions.make_namespace(39, 2024), "prediction") is None
+
+def test_upcoming_game_without_prediction_is_shown_as_unavailable():
+    game = make_fixture(2, 2, 1, None, None)
+    game["fixture"].update({"date": "2024-08-17T14:00:00+00:00", "venue": {"name": "Stadium", "city": "City"}})
+    game["league"] = {"round": "Regular Season - 1"}
+
+    next_games_data = getattr(sports_api, "__extract_next_games_data")(game, None)
+    assert next_games_data.get("predicted_winner") == "Prediction Unavailable"
+
+def test_team_stats_error_is_reported_once(upstream, monkeypatch):
+    posts = []
+    client = type("Client", (), {"chat_postMessage": lambda self, **kwargs: posts.append(kwargs)})()
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "EPL")
+    monkeypatch.setattr(sports_api, "__get_team_info", lambda team_name: [][0])
+
+    sports_api.get_team_stats_data(client, {"channel": "C1"}, "Nowhere FC", 39, 2024)
+    assert [post.get("text") for post in posts] == ["Error Getting Data from API"]
+
+# Slack client that records the messages it posts and updates
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def chat_postMessage(self, **kwargs):
+        self.calls.append(("chat_postMessage", kwargs))
+
+    def chat_update(self, **kwargs):
+        self.calls.append(("chat_update", kwargs))
+
+def make_standing(rank):
+    record = {"win": 1, "draw": 1, "lose": 1}
+    return {"rank": rank, "team": {"id": rank, "name": f"Team {rank}", "logo": ""}, "points": 40 - rank, "all": record, "home": record, "away": record}
+
+# Get the names of the teams on a sent page, the page label, and the values of its buttons by action ID
+def read_page(blocks):
+    blocks = json.loads(blocks)
+    team_names = list(dict.fromkeys(re.findall(r"Team \d+", json.dumps(blocks))))
+    labels = [block.get("elements")[0].get("text") for block in blocks if block.get("type") == "context"]
+    buttons = {element.get("action_id"): json.loads(element.get("value")) for block in blocks if block.get("type") == "actions" for element in block.get("elements")}
+    return team_names, labels, buttons
+
+@pytest.fixture
+def standings(monkeypatch):
+    table = [make_standing(rank) for rank in range(1, 13)]
+    monkeypatch.setattr(sports_api, "get_league_standings", lambda league_id, season: table)
+    monkeypatch.setattr(sports_api, "get_league_name", lambda league_id: "EPL")
+    return table
+
+def test_first_standings_page_is_posted_with_a_next_button(standings):
+    client = RecordingClient()
+    sports_api.get_standings_data_all(client, {"channel": "C1"}, league_id=39, season=2024)
+
+    [(method, kwargs)] = client.calls
+    assert method == "chat_postMessage"
+    team_names, labels, buttons = read_page(kwargs.get("blocks"))
+    assert team_names == [f"Team {rank}" for rank in range(1, 6)]
+    assert labels == ["Page 1 of 3"]
+    assert buttons == {"standings_page_next": {"league_id": 39, "season": 2024, "page": 2}}
+
+@pytest.mark.parametrize("page, shown_page", [(0, 1), (-3, 1), (2, 2), (3, 3), (99, 3)])
+def test_standings_page_is_kept_within_bounds(standings, page, shown_page):
+    client = RecordingClient()
+    sports_api.get_standings_data_all(client, {"channel": "C1"}, league_id=39, season=2024, page=page)
+
+    team_names, labels, buttons = read_page(client.calls[0][1].get("blocks"))
+    assert team_names == [f"Team {rank}" for rank in range((shown_page - 1) * 5 + 1, min(shown_page * 5, 12) + 1)]
+    assert labels == [f"Page {shown_page} of 3"]
+
+    # The first page has no previous button, and the last page has no next button
+    expected_pages = [p for p in (shown_page - 1, shown_page + 1) if 1 <= p <= 3]
+    assert sorted(value.get("page") for value in buttons.values()) == expected_pages
+
+def test_short_list_has_no_page_buttons(standings):
+    del standings[5:]
+    client = RecordingClient()
+    sports_api.get_standings_data_all(client, {"channel": "C1"}, league_id=39, season=2024)
+
+    team_names, labels, buttons = read_page(client.calls[0][1].get("blocks"))
+    assert len(team_names) == 5
+    assert labels == []
+    assert buttons == {}
+
+def test_page_replaces_the_original_message(standings):
+    client = RecordingClient()
+    sports_api.get_standings_data_all(client, {"channel": "C1"}, league_id=39, season=2024, page=2, update_ts="1700000000.000100")
+
+    [(method, kwargs)] = client.calls
+    assert method == "chat_update"
+    assert kwargs.get("channel") == "C1"
+    assert kwargs.get("ts") == "1700000000.000100"
+    assert read_page(kwargs.get("blocks"))[1] == ["Page 2 of 3"]
+
+@pytest.mark.parametrize("league_id, season, expected", [
+    (None, None, (39, 2023)),
+    (None, 2021, (39, 2021)),
+    (140, None, (140, 2023)),
+    ("laliga", "2022", (140, 2022)),
+    ("61", 2019, (61, 2019)),
+])
+def test_league_and_season_are_resolved(monkeypatch, league_id, season, expected):
+    monkeypatch.setattr(sports_api, "get_current_season", lambda league_id: 2023)
+    assert sports_api.resolve_league_season(league_id, season) == expected
+
+@pytest.mark.parametrize("league_id, season", [("nowhere", 2022), (39, "22"), (39, "last"), (39, 20221)])
+def test_invalid_league_or_season_is_rejected(monkeypatch, league_id, season):
+    monkeypatch.setattr(sports_api, "get_current_season", lambda league_id: 2023)
+    with pytest.raises(ValueError):
+        sports_api.resolve_league_season(league_id, season)